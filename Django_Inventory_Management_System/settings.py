@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -47,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'inventory.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,13 +85,101 @@ WSGI_APPLICATION = 'Django_Inventory_Management_System.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
+# The database profile is read from the environment: DATABASE_ENGINE=postgresql selects
+# PostgreSQL, configured with DATABASE_NAME, DATABASE_USER, DATABASE_PASSWORD,
+# DATABASE_HOST and DATABASE_PORT; anything else selects the SQLite file DATABASE_NAME,
+# by default db.sqlite3. Connections are kept open for DATABASE_CONN_MAX_AGE seconds,
+# so requests do not pay for connection setup, and checked before being reused.
+
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite').lower()
+
+if DATABASE_ENGINE in ('postgres', 'postgresql'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'inventory'),
+            'USER': os.environ.get('DATABASE_USER', ''),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', ''),
+            'PORT': os.environ.get('DATABASE_PORT', ''),
+            'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 600)),
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            # Begins transactions immediately and applies INVENTORY_SQLITE_PRAGMAS on connect
+            'ENGINE': 'inventory.backends.sqlite3',
+            'NAME': os.environ.get('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 600)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # Seconds a writer waits for the database lock before raising "database is locked"
+                'timeout': 20,
+            },
+        }
+    }
+
+# Pragmas run on every new SQLite connection. WAL lets readers proceed while a request
+# writes, synchronous=NORMAL only syncs at checkpoints, which is safe in WAL mode, and
+# the database file is memory mapped up to mmap_size bytes.
+INVENTORY_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'busy_timeout': 20000,
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# The file based cache is shared by all worker processes, so invalidating the
+# inventory snapshots in one worker invalidates them everywhere.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
     }
 }
 
+# Maximum age in seconds of cached inventory snapshots such as the dashboard
+INVENTORY_SNAPSHOT_TIMEOUT = 300
+
+# Unit cost holdings are valued at in report summaries: 'latest', 'average' (moving
+# average cost of the units on hand) or 'fifo' (cost of the most recently received units)
+INVENTORY_VALUATION_METHOD = 'latest'
+
+# Maximum age in seconds of cached template fragments such as the sidebar and report charts
+INVENTORY_FRAGMENT_TIMEOUT = 300
+
+# Engraved deliveries post one engraved_numbers[] field per unit, so allow deliveries
+# of tens of thousands of units instead of Django's default of 1000 fields
+DATA_UPLOAD_MAX_NUMBER_FIELDS = 50000
+
+# Requests executing the same query at least this many times are logged as likely N+1 patterns
+INVENTORY_DUPLICATE_QUERY_THRESHOLD = 5
+
+# Bearer token Prometheus presents to scrape /metrics. Without a matching token only
+# logged-in staff users can read the metrics.
+INVENTORY_METRICS_TOKEN = os.environ.get('INVENTORY_METRICS_TOKEN', '')
+
+# Request metrics are logged as one JSON line per request on the inventory.metrics logger
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'inventory.metrics': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# Directory the background report worker writes generated reports to
+REPORT_ARTIFACTS_DIR = BASE_DIR / 'report_artifacts'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
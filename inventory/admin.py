@@ -1,10 +1,65 @@
 from django.contrib import admin
-from .models import InventoryItem, ItemCategory, StaffDepartment, Employee, Quantity, StockHistory, IssuedOutHistory
+from .models import InventoryItem, ItemCategory, StaffDepartment, Employee, Quantity, StockHistory, IssuedOutHistory, \
+    StockLedgerEntry
+from .services import adjust_quantity
+
+
+class ReadOnlyAdmin(admin.ModelAdmin):
+    """
+    Lists and shows records without allowing them to be added, changed or deleted.
+
+    Used for the stock history, issued-out history and stock ledger, which are only
+    written by the stock movement services so that the ledger stays complete.
+    """
+    # The records show their item and department, which would be fetched row by row
+    list_select_related = True
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class QuantityAdmin(admin.ModelAdmin):
+    """
+    Lets quantities be corrected after a stock count. A changed quantity is saved with
+    `adjust_quantity`, which appends the difference to the stock ledger as an
+    adjustment. Quantities are never added or deleted here; receipts create them.
+    """
+    list_display = ('item', 'department', 'quantity', 'average_cost')
+    readonly_fields = ('item', 'department', 'average_cost')
+    list_select_related = ('item', 'department')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def save_model(self, request, obj, form, change):
+        if 'quantity' in form.changed_data:
+            adjust_quantity(obj.pk, obj.quantity, f'Changed in the admin by {request.user}')
+        # The other fields do not feed the ledger and are saved as they are
+        fields = [name for name in form.changed_data if name != 'quantity']
+        if fields:
+            obj.save(update_fields=fields)
+
+
+class StockLedgerEntryAdmin(ReadOnlyAdmin):
+    list_display = ('created_at', 'item', 'department', 'change', 'kind', 'note')
+    list_filter = ('kind',)
+
+
 # Register your models here.
 admin.site.register(InventoryItem)
 admin.site.register(ItemCategory)
 admin.site.register(StaffDepartment)
 admin.site.register(Employee)
-admin.site.register(Quantity)
-admin.site.register(StockHistory)
-admin.site.register(IssuedOutHistory)
\ No newline at end of file
+admin.site.register(Quantity, QuantityAdmin)
+admin.site.register(StockHistory, ReadOnlyAdmin)
+admin.site.register(IssuedOutHistory, ReadOnlyAdmin)
+admin.site.register(StockLedgerEntry, StockLedgerEntryAdmin)
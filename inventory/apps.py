@@ -7,3 +7,7 @@ class InventoryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'inventory'
     path = os.path.dirname(os.path.abspath(__file__))
+
+    def ready(self):
+        # Register the signal handlers that keep derived tables in sync
+        from inventory import signals  # noqa: F401
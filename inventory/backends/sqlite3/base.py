@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    The SQLite backend, tuned for several processes writing to one database file.
+
+    Every new connection applies the `INVENTORY_SQLITE_PRAGMAS` setting, since journal
+    mode, synchronous level, memory mapping and busy timeout are per connection settings
+    in SQLite.
+
+    Transactions begin with BEGIN IMMEDIATE, taking the write lock up front. A deferred
+    transaction that reads before it writes, such as issuing stock, cannot wait for the
+    lock when another connection committed in the meantime and fails at once with
+    "database is locked"; an immediate one waits up to the busy timeout instead.
+    """
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for pragma, value in getattr(settings, 'INVENTORY_SQLITE_PRAGMAS', {}).items():
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
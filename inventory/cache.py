@@ -0,0 +1,116 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+DATA_VERSION_KEY = 'inventory:data_version'
+DEPARTMENTS_VERSION_KEY = 'inventory:departments_version'
+
+# The department list of this process and the departments version it was loaded under
+_departments = (None, None)
+
+
+def _get_version(key):
+    # Create the token on first use; another process may have created it in the meantime, keep theirs
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def get_data_version():
+    """
+    Returns the current inventory data version token.
+
+    The token changes every time stock, quantity or issuance data is written, so it can
+    be embedded in cache keys to invalidate every derived snapshot at once. A token is
+    created on first use if the cache does not hold one yet.
+
+    :return: The current data version token as a string.
+    """
+    return _get_version(DATA_VERSION_KEY)
+
+
+def get_departments_version():
+    """
+    Returns the current departments version token.
+
+    The token changes every time a department is added, renamed or deleted, so it can
+    be embedded in the cache keys of fragments rendering the department list.
+
+    :return: The current departments version token as a string.
+    """
+    return _get_version(DEPARTMENTS_VERSION_KEY)
+
+
+def bump_data_version():
+    """
+    Invalidates every snapshot keyed on the inventory data version.
+
+    The new token is written once the surrounding transaction commits, so that no
+    reader can rebuild a snapshot under the new version from uncommitted data.
+    """
+    transaction.on_commit(lambda: cache.set(DATA_VERSION_KEY, uuid.uuid4().hex, timeout=None))
+
+
+def get_or_build_snapshot(name, builder, timeout=None):
+    """
+    Returns a cached snapshot built by `builder`, rebuilding it when the inventory
+    data version or the current date changes.
+
+    The current date is part of the cache key so that date-relative windows, such as
+    "this month" or "expiring in 30 days", roll over at midnight even when no data was
+    written.
+
+    :param name: The name of the snapshot, used as the cache key prefix.
+    :param builder: A callable without arguments returning the value to cache. The value
+        must be picklable; querysets should be evaluated before they are returned.
+    :param timeout: Optional timeout in seconds. Defaults to the
+        `INVENTORY_SNAPSHOT_TIMEOUT` setting.
+    :return: The cached or freshly built snapshot.
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'INVENTORY_SNAPSHOT_TIMEOUT', 300)
+    key = f'inventory:snapshot:{name}:{get_data_version()}:{timezone.localdate().isoformat()}'
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = builder()
+        cache.set(key, snapshot, timeout=timeout)
+    return snapshot
+
+
+def get_departments():
+    """
+    Returns the list of all staff departments, loaded once per process.
+
+    The list is kept in memory together with the departments version it was loaded
+    under, and reloaded when `invalidate_departments` has changed the version, so a
+    department added or renamed in one process is picked up by every other process
+    on its next read. Reading the list costs a cache lookup but no query.
+
+    :return: A list of StaffDepartment instances. The instances are shared between
+        requests and must not be modified.
+    """
+    global _departments
+    from inventory.models import StaffDepartment
+
+    version = get_departments_version()
+    loaded_version, departments = _departments
+    if departments is None or loaded_version != version:
+        departments = list(StaffDepartment.objects.all())
+        _departments = (version, departments)
+    return departments
+
+
+def invalidate_departments():
+    """
+    Drops the department list of this process and, once the surrounding transaction
+    commits, makes every other process reload theirs.
+    """
+    global _departments
+    _departments = (None, None)
+    transaction.on_commit(lambda: cache.set(DEPARTMENTS_VERSION_KEY, uuid.uuid4().hex, timeout=None))
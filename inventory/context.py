@@ -1,32 +1,48 @@
 from collections import defaultdict
 import json
-from datetime import timedelta
-from django.db.models import Sum, F, DecimalField, OuterRef, Subquery, Max, Avg
+from datetime import datetime, time, timedelta
+from django.core.paginator import Paginator
+from django.db.models import Sum, F, DecimalField, OuterRef, Subquery, Max, Avg, Q
 from django.db.models.functions import Coalesce, TruncMonth
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 from django.core.serializers.json import DjangoJSONEncoder
-from inventory.models import Employee, InventoryItem, ItemCategory, Quantity, IssuedOutHistory, StockHistory, StaffDepartment
-from inventory.forms import ItemCategoryForm, StaffDepartmentForm, EmployeeForm, StockHistoryForm
+from inventory.cache import get_or_build_snapshot, get_departments
+from inventory.valuation import get_valuation_method, holding_value, issued_cost, issued_unit_cost, summarize_holdings
+from inventory.models import Employee, InventoryItem, ItemCategory, Quantity, IssuedOutHistory, StockHistory, StaffDepartment, \
+    DailyStockMovement, StockSnapshot
+from inventory.forms import ItemCategoryForm, StaffDepartmentForm, EmployeeForm, StockHistoryForm, DeliveredItemsFilterForm
 
 def get_dashboard_context():
     """
-    Fetch and calculate a comprehensive dashboard context for an inventory management
-    system. This function aggregates and processes various data such as department
-    information, inventory statistics, stock trends, and recent activities, and
-    formats them for use within a dashboard UI.
+    Fetch a comprehensive dashboard context for an inventory management system. The
+    context is served from a cached snapshot keyed on the inventory data version and the
+    current date, so repeat page loads do not hit the database until stock, quantities
+    or issuances change.
 
     :return: A dictionary containing the complete dashboard context data, including
         details on inventory, stock trends, turnover rates, department statistics,
         recent transactions, and other relevant contextual information for user
         interfaces.
     """
+    return get_or_build_snapshot('dashboard', _build_dashboard_context)
+
+def _build_dashboard_context():
+    """
+    Calculate the dashboard context from the database. This function aggregates and
+    processes various data such as department information, inventory statistics, stock
+    trends, and recent activities, and formats them for use within a dashboard UI.
+    Querysets are evaluated so the result can be cached.
+
+    :return: A dictionary containing the complete dashboard context data.
+    """
     now = timezone.now()
     current_month_start = now.replace(day=1)
     last_month_start = now - timedelta(days=30)
     six_months_ago = now - timedelta(days=180)
 
-    departments = StaffDepartment.objects.annotate(stock_size=Sum('quantity__quantity'))
+    departments = list(StaffDepartment.objects.annotate(stock_size=Sum('quantity__quantity')))
     total_items = InventoryItem.objects.count()
     new_items_last_month = InventoryItem.objects.filter(date_added__gte=last_month_start).count()
     new_items_this_month = InventoryItem.objects.filter(date_added__gte=current_month_start).count()
@@ -37,15 +53,15 @@ def get_dashboard_context():
     current_stock = Quantity.objects.aggregate(Sum('quantity'))['quantity__sum'] or 0
     turnover_rate = (items_issued / current_stock) * 100 if current_stock else 0
     top_issued_items = IssuedOutHistory.objects.values('item__item_name').annotate(total_issued=Sum('quantity_issued_out')).order_by('-total_issued')[:5]
-    out_of_stock = Quantity.objects.filter(quantity=0)
-    recent_transactions = StockHistory.objects.order_by('-date_added')[:10]
+    out_of_stock = list(Quantity.objects.filter(quantity=0).select_related('item', 'department'))
+    recent_transactions = list(StockHistory.objects.select_related('item', 'department').order_by('-date_added')[:10])
     stock_trends = StockHistory.objects.filter(date_added__gte=six_months_ago) \
         .annotate(month=TruncMonth('date_added')) \
         .values('month') \
         .annotate(total_added=Sum('quantity')) \
         .order_by('month')
     stock_trends = [{'month': trend['month'].strftime('%Y-%m'), 'total_added': trend['total_added']} for trend in stock_trends]
-    expiring_soon = Quantity.objects.filter(expiry_date__lte=now + timedelta(days=30)).exclude(expiry_date__isnull=True)
+    expiring_soon = list(Quantity.objects.filter(expiry_date__lte=now + timedelta(days=30)).exclude(expiry_date__isnull=True).select_related('item'))
 
     context = {
         'total_items': total_items,
@@ -55,7 +71,11 @@ def get_dashboard_context():
         'low_stock_items': low_stock_items,
         'low_stock_percentage': round(low_stock_percentage, 2),
         'turnover_rate': round(turnover_rate, 2),
-        'departments_list': json.dumps(list(departments.values()), cls=DjangoJSONEncoder),
+        'departments_list': json.dumps([
+            {'id': department.id, 'Department_name': department.Department_name, 'date_added': department.date_added,
+             'added_by_id': department.added_by_id, 'stock_size': department.stock_size}
+            for department in departments
+        ], cls=DjangoJSONEncoder),
         'top_issued_items': json.dumps(list(top_issued_items), cls=DjangoJSONEncoder),
         'out_of_stock': out_of_stock,
         'recent_transactions': recent_transactions,
@@ -94,8 +114,8 @@ def get_inventory_context(form):
         'category_form': ItemCategoryForm(),
         'department_form': StaffDepartmentForm(),
         'employee_form': EmployeeForm(),
-        'items': InventoryItem.objects.all(),
-        'departments': StaffDepartment.objects.all(),
+        'items': InventoryItem.objects.select_related('added_by'),
+        'departments': SimpleLazyObject(get_departments),
         'total_items': total_items,
         'total_quantity': total_quantity,
         'out_of_stock_percentage': calculate_percentage(calculate_aggregate(out_of_stock_items, 'quantity'), total_quantity),
@@ -124,10 +144,12 @@ def get_item_details_context(item_id, stock_form):
     employee_form = EmployeeForm()
 
     engraved_numbers = StockHistory.objects.filter(item=item, issued=False).values_list('engraved_number', flat=True).distinct()
-    quantities = Quantity.objects.filter(item=item)
+    quantities = Quantity.objects.filter(item=item).select_related('department')
     employees = list(Employee.objects.values('id', 'name', 'department_id'))
-    stock_history = StockHistory.objects.filter(item=item).order_by('date_added')
-    issued_out_history = IssuedOutHistory.objects.filter(item=item).order_by('date')
+    stock_history = StockHistory.objects.filter(item=item).select_related('department', 'added_by').order_by('date_added')
+    issued_out_history = IssuedOutHistory.objects.filter(item=item).select_related(
+        'department', 'issued_to', 'issued_by'
+    ).order_by('date')
 
     return {
         'item': item,
@@ -140,54 +162,146 @@ def get_item_details_context(item_id, stock_form):
         'engraved_numbers': engraved_numbers,
     }
 
-def get_combined_report_context():
+# The date field each report model is scoped by
+REPORT_DATE_FIELDS = {
+    StockHistory: 'date_added',
+    IssuedOutHistory: 'date',
+    DailyStockMovement: 'date',
+}
+
+def scope_report_queryset(queryset, start=None, end=None, department=None):
+    """
+    Restricts a report queryset to a date range and a department in SQL, so that a
+    report over a month only reads that month's rows.
+
+    Stock history is scoped by its delivery date, issued-out history by the day it was
+    issued and the daily stock movement rollup by its date; quantities are current
+    holdings and are only scoped by department.
+
+    :param queryset: A queryset of StockHistory, IssuedOutHistory, DailyStockMovement or
+        Quantity records.
+    :param start: Optional first date to include.
+    :param end: Optional last date to include.
+    :param department: Optional department to restrict the queryset to.
+    :return: The scoped queryset.
+    """
+    if department is not None:
+        queryset = queryset.filter(department=department)
+    date_field = REPORT_DATE_FIELDS.get(queryset.model)
+    if date_field is None:
+        return queryset
+    if queryset.model is IssuedOutHistory:
+        # Compare against day boundaries instead of the date of the column, so the index on it can be used
+        if start:
+            queryset = queryset.filter(date__gte=timezone.make_aware(datetime.combine(start, time.min)))
+        if end:
+            queryset = queryset.filter(date__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)))
+        return queryset
+    if start:
+        queryset = queryset.filter(**{f'{date_field}__gte': start})
+    if end:
+        queryset = queryset.filter(**{f'{date_field}__lte': end})
+    return queryset
+
+def get_daily_stock_movement(department=None, start=None, end=None):
+    """
+    Returns the quantities and values added and issued per day, read from the daily
+    stock movement rollup, so the cost depends on the number of days and items moved
+    rather than on the number of transactions.
+
+    Issued stock is valued at the latest unit cost of each item.
+
+    :param department: Optional department to restrict the movement to.
+    :param start: Optional first date to include.
+    :param end: Optional last date to include.
+    :return: A dictionary mapping 'YYYY-MM-DD' dates, in date order, to dictionaries with
+        the 'added', 'issued', 'value_added' and 'value_issued' totals of the day.
+    """
+    movements = scope_report_queryset(DailyStockMovement.objects.all(), start, end, department)
+    rows = movements.values('date').annotate(
+        added=Sum('quantity_added'),
+        issued=Sum('quantity_issued'),
+        total_added=Sum('value_added'),
+        total_issued=Coalesce(Sum(F('quantity_issued') * F('item__cost_snapshot__unit_cost')), 0,
+                              output_field=DecimalField()),
+    ).order_by('date')
+    return {
+        row['date'].strftime("%Y-%m-%d"): {
+            'added': row['added'],
+            'issued': row['issued'],
+            'value_added': row['total_added'],
+            'value_issued': row['total_issued'],
+        }
+        for row in rows
+    }
+
+
+def get_combined_report_context(start=None, end=None, department=None, valuation=None):
     """
     Provides a comprehensive report context derived from inventory data. The function summarizes various metrics on
     inventory stock, including total items, quantities, values, costs, stock movements, supplier data, departmental
     usage, inflow, and expiration details. Additionally, it generates data for visual charts using stock movement and
     supplier information.
 
+    Deliveries, issues and stock movement are restricted to the given period; current holdings, expiry and
+    depreciation are only restricted to the given department. The context is served from a cached snapshot per
+    period, department and valuation method, keyed on the inventory data version and the current date, so the
+    summaries and the chart JSON are only recomputed after stock, quantities or issuances change.
+
+    :param start: Optional first date of the reported period.
+    :param end: Optional last date of the reported period.
+    :param department: Optional department to restrict the report to.
+    :param valuation: Optional valuation method of the summaries and departmental usage, see
+        `inventory.valuation.get_valuation_method`.
     :return: Dictionary containing detailed inventory-related metrics, structured summaries for categories, departments,
              suppliers, stock movements, along with chart data serialized as JSON.
     """
+    valuation = get_valuation_method(valuation)
+    name = f"combined_report:{start or ''}:{end or ''}:{department.pk if department is not None else ''}:{valuation}"
+    return get_or_build_snapshot(name, lambda: _build_combined_report_context(start, end, department, valuation))
+
+def _build_combined_report_context(start=None, end=None, department=None, valuation=None):
+    """
+    Calculate the combined report context from the database. Querysets are evaluated so the result can be cached;
+    the stock and issued-out history are limited to the latest ten records, which is all the report shows.
+
+    :param start: Optional first date of the reported period.
+    :param end: Optional last date of the reported period.
+    :param department: Optional department to restrict the report to.
+    :param valuation: Optional valuation method of the summaries and departmental usage.
+    :return: A dictionary containing the complete combined report context data.
+    """
+    # Scope every source table to the requested period and department
+    stock = scope_report_queryset(StockHistory.objects.all(), start, end, department)
+    issued = scope_report_queryset(IssuedOutHistory.objects.all(), start, end, department)
+    quantities = scope_report_queryset(Quantity.objects.all(), department=department)
+
     # Calculate total items and total quantity in inventory
-    total_items = InventoryItem.objects.count()
-    total_quantity = Quantity.objects.aggregate(total_quantity=Sum('quantity'))['total_quantity'] or 0
+    if department is None:
+        total_items = InventoryItem.objects.count()
+    else:
+        total_items = quantities.values('item').distinct().count()
+    total_quantity = quantities.aggregate(total_quantity=Sum('quantity'))['total_quantity'] or 0
 
     # Calculate total value and cost of stock history
-    total_value_and_cost = StockHistory.objects.aggregate(
+    total_value_and_cost = stock.aggregate(
         total_value=Coalesce(Sum(F('quantity') * F('unit_cost')), 0, output_field=DecimalField()),
         total_cost=Coalesce(Sum('total_cost'), 0, output_field=DecimalField())
     )
     total_value = total_value_and_cost['total_value']
     total_cost = total_value_and_cost['total_cost']
 
-    # Summarize categories and departments
-    category_summary = InventoryItem.objects.values('category').annotate(
-        total_quantity=Coalesce(Sum('quantity__quantity'), 0),
-        total_value=Coalesce(Sum(F('quantity__quantity') * F('stockhistory__unit_cost')), 0, output_field=DecimalField())
-    )
-
-    department_summary = Quantity.objects.values('department__Department_name').annotate(
-        total_quantity=Sum('quantity'),
-        total_value=Coalesce(Sum(F('quantity') * F('item__stockhistory__unit_cost')), 0, output_field=DecimalField())
-    )
+    # Summarize categories and departments, valuing every holding at exactly one unit cost per item
+    category_summary = list(summarize_holdings(quantities, method=valuation, category=F('item__category')))
+    department_summary = list(summarize_holdings(quantities, 'department__Department_name', method=valuation))
 
     # Fetch stock history and issued out history
     today = timezone.now().date()
-    stock_history = StockHistory.objects.order_by('-date_added')
-    issued_out_history = IssuedOutHistory.objects.order_by('-date')
-
-    # Calculate stock movement
-    stock_movement = defaultdict(lambda: {'added': 0, 'issued': 0, 'value_added': 0, 'value_issued': 0})
-    for stock in stock_history:
-        date_key = stock.date_added.strftime("%Y-%m-%d")
-        stock_movement[date_key]['added'] += stock.quantity
-        stock_movement[date_key]['value_added'] += stock.total_cost
-    for issued in issued_out_history:
-        date_key = issued.date.strftime("%Y-%m-%d")
-        stock_movement[date_key]['issued'] += issued.quantity_issued_out
-        stock_movement[date_key]['value_issued'] += issued.quantity_issued_out * issued.item.stockhistory_set.latest('date_added').unit_cost
+    stock_history = list(stock.select_related('item').order_by('-date_added')[:10])
+    issued_out_history = list(issued.select_related('item', 'issued_to', 'department').order_by('-date')[:10])
+
+    # Calculate stock movement from the daily rollup
+    stock_movement = get_daily_stock_movement(department, start, end)
 
     # Prepare data for charts
     stock_dates = list(stock_movement.keys())
@@ -197,34 +311,34 @@ def get_combined_report_context():
     value_issued = [value['value_issued'] for value in stock_movement.values()]
 
     # Get items expiring and depreciating soon
-    expiring_soon = Quantity.objects.filter(expiry_date__lte=today + timezone.timedelta(days=30)).select_related('item', 'department')
-    depreciating_soon = Quantity.objects.filter(depreciation_date__lte=today + timezone.timedelta(days=30)).select_related('item', 'department')
+    expiring_soon = list(quantities.filter(expiry_date__lte=today + timezone.timedelta(days=30)).select_related('item', 'department'))
+    depreciating_soon = list(quantities.filter(depreciation_date__lte=today + timezone.timedelta(days=30)).select_related('item', 'department'))
 
     # Summarize suppliers and deliveries
-    supplier_summary = StockHistory.objects.values('supplied_by').annotate(
+    supplier_summary = list(stock.values('supplied_by').annotate(
         total_quantity=Sum('quantity'),
         total_cost=Sum('total_cost')
-    ).order_by('-total_quantity')
+    ).order_by('-total_quantity'))
 
-    delivery_summary = StockHistory.objects.values('delivery_number', 'supplied_by').annotate(
+    delivery_summary = list(stock.values('delivery_number', 'supplied_by').annotate(
         total_quantity=Sum('quantity'),
         total_cost=Sum('total_cost')
-    ).order_by('-total_quantity')
+    ).order_by('-total_quantity'))
 
     # Prepare data for supplier chart
     labels = [entry['supplied_by'] for entry in supplier_summary]
     data = [entry['total_quantity'] for entry in supplier_summary]
 
-    # Summarize departmental usage and inflow
-    departmental_usage = IssuedOutHistory.objects.values('department__Department_name').annotate(
+    # Summarize departmental usage and inflow, costing issued stock under the valuation method
+    departmental_usage = list(issued.values('department__Department_name').annotate(
         total_issued=Sum('quantity_issued_out'),
-        total_value=Coalesce(Sum(F('quantity_issued_out') * F('item__stockhistory__unit_cost')), 0, output_field=DecimalField())
-    ).order_by('-total_issued')
+        total_value=Coalesce(Sum(issued_cost(valuation)), 0, output_field=DecimalField())
+    ).order_by('-total_issued'))
 
-    departmental_inflow = StockHistory.objects.values('department__Department_name').annotate(
+    departmental_inflow = list(stock.values('department__Department_name').annotate(
         total_added=Sum('quantity'),
         total_cost=Sum('total_cost')
-    ).order_by('-total_added')
+    ).order_by('-total_added'))
 
     # Prepare chart data
     chart_data = {
@@ -265,7 +379,7 @@ def get_combined_report_context():
     }
     return context
 
-def get_department_report_context(department_id, decimal_default=None):
+def get_department_report_context(department_id, decimal_default=None, start=None, end=None, valuation=None):
     """
     Generate context data for reporting a department, including details about item
     distribution, stock movement, issued items, and related charts.
@@ -274,44 +388,43 @@ def get_department_report_context(department_id, decimal_default=None):
                           should be generated.
     :param decimal_default: Optional default function for serializing decimal values
                             to JSON.
+    :param start: Optional first date of the reported period; current holdings are not
+                  restricted by it.
+    :param end: Optional last date of the reported period.
+    :param valuation: Optional valuation method of the held and issued items, see
+                      `inventory.valuation.get_valuation_method`.
     :return: The context dictionary containing department details, stock movement,
              item distributions, issued items distributions, and serialized chart
              data.
     """
     department = get_object_or_404(StaffDepartment, pk=department_id)
-    items_in_department = Quantity.objects.filter(department=department)
-    stock_history = StockHistory.objects.filter(department=department)
-    issued_history = IssuedOutHistory.objects.filter(department=department)
+    items_in_department = Quantity.objects.filter(department=department).select_related('item__cost_snapshot')
+    stock_history = scope_report_queryset(StockHistory.objects.all(), start, end, department).select_related('item')
+    issued_history = scope_report_queryset(IssuedOutHistory.objects.all(), start, end, department).select_related('item', 'issued_to')
 
     item_distribution = defaultdict(lambda: {'quantity': 0, 'value': 0})
-    stock_movement = defaultdict(lambda: {'added': 0, 'issued': 0, 'value_added': 0, 'value_issued': 0})
     issued_items_distribution = defaultdict(lambda: {'quantity': 0, 'value': 0})
 
-    for quantity in items_in_department:
-        item_name = quantity.item.item_name
-        item_distribution[item_name]['quantity'] += quantity.quantity
-        latest_stock = StockHistory.objects.filter(item=quantity.item).order_by('-date_added').first()
-        if latest_stock:
-            item_distribution[item_name]['value'] += quantity.quantity * latest_stock.unit_cost
-
-    for stock in stock_history:
-        date_key = stock.date_added.strftime("%Y-%m-%d")
-        stock_movement[date_key]['added'] += stock.quantity
-        stock_movement[date_key]['value_added'] += stock.total_cost
-
-    for issued in issued_history:
-        date_key = issued.date.strftime("%Y-%m-%d")
-        stock_movement[date_key]['issued'] += issued.quantity_issued_out
-        latest_stock = StockHistory.objects.filter(item=issued.item).order_by('-date_added').first()
-        if latest_stock:
-            stock_movement[date_key]['value_issued'] += issued.quantity_issued_out * latest_stock.unit_cost
-
-    for issued in issued_history:
-        item_name = issued.item.item_name
-        issued_items_distribution[item_name]['quantity'] += issued.quantity_issued_out
-        latest_stock = StockHistory.objects.filter(item=issued.item).order_by('-date_added').first()
-        if latest_stock:
-            issued_items_distribution[item_name]['value'] += issued.quantity_issued_out * latest_stock.unit_cost
+    # The value of every holding and the cost of every issue are computed by the database
+    # under the valuation method, so each table below is read with a single query of
+    # plain tuples and grouped in one pass
+    for item_name, quantity, value in items_in_department.annotate(value=holding_value(valuation)).values_list(
+        'item__item_name', 'quantity', 'value'
+    ):
+        item_distribution[item_name]['quantity'] += quantity
+        if value is not None:
+            item_distribution[item_name]['value'] += value
+
+    for item_name, quantity, value in issued_history.annotate(value=issued_cost(valuation)).values_list(
+        'item__item_name', 'quantity_issued_out', 'value'
+    ):
+        issued = issued_items_distribution[item_name]
+        issued['quantity'] += quantity
+        if value is not None:
+            issued['value'] += value
+
+    # Read stock movement per day from the daily rollup
+    stock_movement = get_daily_stock_movement(department, start, end)
 
     total_quantity = sum(item['quantity'] for item in item_distribution.values())
     total_value = sum(item['value'] for item in item_distribution.values())
@@ -358,7 +471,7 @@ def get_department_report_context(department_id, decimal_default=None):
     }
     return context
 
-def get_inflow_report_context():
+def get_inflow_report_context(start=None, end=None, department=None):
     """
     Generates a comprehensive context dictionary containing several metrics and summaries
     derived from stock history data. This includes various aggregated totals for quantities
@@ -368,6 +481,9 @@ def get_inflow_report_context():
     The returned context is also prepared for chart representation via JSON serialization
     for frontend consumption.
 
+    :param start: Optional first delivery date to include.
+    :param end: Optional last delivery date to include.
+    :param department: Optional department to restrict the deliveries to.
     :raises: Does not explicitly raise errors but assumes proper database connections and
              existence of the necessary data models.
 
@@ -389,9 +505,9 @@ def get_inflow_report_context():
         - `departmental_inflow_chart` (str): JSON-encoded representation of `departmental_inflow` for charts.
         - `overall_totals_chart` (str): JSON-encoded representation of `overall_totals` for charts.
     """
-    # Fetch all stock history records
-    stock_history = StockHistory.objects.all()
-    stock_history_table = StockHistory.objects.all().order_by('-date_added')
+    # Fetch the stock history records of the requested period and department
+    stock_history = scope_report_queryset(StockHistory.objects.all(), start, end, department)
+    stock_history_table = stock_history.select_related('item', 'department').order_by('-date_added')
 
     # Calculate total quantities and values for each item
     total_quantities = stock_history.values('item__item_name').annotate(
@@ -412,13 +528,13 @@ def get_inflow_report_context():
     )
 
     # Summarize deliveries by delivery number and supplier
-    delivery_summary = StockHistory.objects.values('delivery_number', 'supplied_by').annotate(
+    delivery_summary = stock_history.values('delivery_number', 'supplied_by').annotate(
         total_quantity=Sum('quantity'),
         total_value=Sum(F('quantity') * F('unit_cost'))
     ).order_by('-total_quantity')
 
     # Calculate quantities and values by supplier
-    quantities_by_supplier = StockHistory.objects.values('supplied_by').annotate(
+    quantities_by_supplier = stock_history.values('supplied_by').annotate(
         total_quantity=Sum('quantity'),
         total_value=Sum(F('quantity') * F('unit_cost'))
     )
@@ -429,7 +545,7 @@ def get_inflow_report_context():
     values = [float(entry['total_value']) for entry in quantities_by_supplier]
 
     # Calculate total added quantities and values for each department
-    departmental_inflow = StockHistory.objects.values('department__Department_name').annotate(
+    departmental_inflow = stock_history.values('department__Department_name').annotate(
         total_added=Sum('quantity'),
         total_value=Sum(F('quantity') * F('unit_cost'))
     ).order_by('-total_added')
@@ -461,7 +577,7 @@ def get_inflow_report_context():
     }
     return context
 
-def get_outflow_report_context():
+def get_outflow_report_context(start=None, end=None, department=None, valuation=None):
     """
     Generates a detailed context report related to the outflow of issued items, including
     statistics and aggregated data such as costs, departmental breakdown, and category
@@ -469,6 +585,11 @@ def get_outflow_report_context():
     the database, annotating and aggregating fields to prepare a comprehensive dictionary
     for reporting purposes.
 
+    :param start: Optional first issue date to include.
+    :param end: Optional last issue date to include.
+    :param department: Optional department to restrict the issues to.
+    :param valuation: Optional valuation method of the issued items, see
+        `inventory.valuation.get_valuation_method`.
     :return: Dictionary containing the following keys and their respective data:
              - total_cost: The total cost of all issued items after aggregation.
              - avg_cost_per_item: The average cost per single item issued out.
@@ -481,15 +602,10 @@ def get_outflow_report_context():
              - recent_items: The 5 most recent issued-out items with additional related
                information.
     """
-    # Get the latest stock for each item
-    latest_stock = StockHistory.objects.filter(
-        item=OuterRef('item')
-    ).order_by('-date_added')
-
-    # Annotate issued out history with unit cost and total cost
-    issued_out_with_cost = IssuedOutHistory.objects.annotate(
-        annotated_unit_cost=Subquery(latest_stock.values('unit_cost')[:1]),
-        calculated_total_cost=F('quantity_issued_out') * F('annotated_unit_cost')
+    # Annotate issued out history with the cost of each issue under the valuation method and its unit cost
+    issued_out_with_cost = scope_report_queryset(IssuedOutHistory.objects.all(), start, end, department).annotate(
+        annotated_unit_cost=issued_unit_cost(valuation),
+        calculated_total_cost=issued_cost(valuation)
     )
 
     # Calculate total cost of issued items
@@ -524,7 +640,7 @@ def get_outflow_report_context():
     top_categories = category_data[:5]
 
     # Get the 5 most recent issued items
-    recent_items = issued_out_with_cost.select_related('item', 'issued_to', 'department').order_by('-date')[:5]
+    recent_items = issued_out_with_cost.select_related('item__cost_snapshot', 'issued_to', 'department').order_by('-date')[:5]
 
     # Prepare context dictionary
     context = {
@@ -558,7 +674,7 @@ def get_department_dashboard_context(department_id):
     current_date = timezone.now().date()
 
     # Fetch items in the department
-    department_items = InventoryItem.objects.filter(quantity__department=department)
+    department_items = InventoryItem.objects.filter(quantity__department=department).select_related('added_by')
     total_items = department_items.distinct().count()
     total_quantity = Quantity.objects.filter(department=department).aggregate(total_quantity=Sum('quantity'))['total_quantity'] or 0
 
@@ -628,7 +744,7 @@ def get_department_item_details_context(item_id, department_id=None):
     employee_form = EmployeeForm()
 
     # Fetch quantities for the item, filtered by department if provided
-    quantities = Quantity.objects.filter(item=item)
+    quantities = Quantity.objects.filter(item=item).select_related('department')
     if department:
         quantities = quantities.filter(department=department)
 
@@ -642,9 +758,9 @@ def get_department_item_details_context(item_id, department_id=None):
         stock_history = stock_history.filter(department=department)
         issued_out_history = issued_out_history.filter(department=department)
 
-    # Order stock history and issued out history by date
-    stock_history = stock_history.order_by('date_added')
-    issued_out_history = issued_out_history.order_by('date')
+    # Order stock history and issued out history by date, with the records the tables render
+    stock_history = stock_history.select_related('department', 'added_by').order_by('date_added')
+    issued_out_history = issued_out_history.select_related('department', 'issued_to', 'issued_by').order_by('date')
 
     # Prepare context dictionary
     context = {
@@ -659,7 +775,7 @@ def get_department_item_details_context(item_id, department_id=None):
     }
     return context
 
-def get_outflow_dashboard_context():
+def get_outflow_dashboard_context(valuation=None):
     """
     Generates a context dictionary containing various aggregated and annotated data
     related to issued out stock items. The function calculates financial metrics,
@@ -667,6 +783,8 @@ def get_outflow_dashboard_context():
     for recent transactions. This is useful for constructing a dashboard interface
     for outflow reporting and analysis.
 
+    :param valuation: Optional valuation method of the issued items, see
+        `inventory.valuation.get_valuation_method`.
     :return: A dictionary with the aggregated data, including:
 
         - Total cost of all issued items.
@@ -677,15 +795,10 @@ def get_outflow_dashboard_context():
         - Top 5 categories by total cost.
         - The 5 most recent issued items.
     """
-    # Get the latest stock for each item
-    latest_stock = StockHistory.objects.filter(
-        item=OuterRef('item')
-    ).order_by('-date_added')
-
-    # Annotate issued out history with unit cost and total cost
+    # Annotate issued out history with the cost of each issue under the valuation method and its unit cost
     issued_out_with_cost = IssuedOutHistory.objects.annotate(
-        annotated_unit_cost=Subquery(latest_stock.values('unit_cost')[:1]),
-        calculated_total_cost=F('quantity_issued_out') * F('annotated_unit_cost')
+        annotated_unit_cost=issued_unit_cost(valuation),
+        calculated_total_cost=issued_cost(valuation)
     )
 
     # Calculate total cost of issued items
@@ -720,7 +833,7 @@ def get_outflow_dashboard_context():
     top_categories = category_data[:5]
 
     # Get the 5 most recent issued items
-    recent_items = issued_out_with_cost.select_related('item', 'issued_to', 'department').order_by('-date')[:5]
+    recent_items = issued_out_with_cost.select_related('item__cost_snapshot', 'issued_to', 'department').order_by('-date')[:5]
 
     # Prepare context dictionary
     context = {
@@ -734,7 +847,30 @@ def get_outflow_dashboard_context():
     }
     return context
 
-def get_cost_report_context():
+def scope_departments(department=None):
+    """
+    Returns the departments a report lists: the given department only, or all of them.
+
+    :param department: Optional department to restrict the list to.
+    :return: A list of StaffDepartment records.
+    """
+    if department is not None:
+        return [department]
+    return get_departments()
+
+def _group_totals(queryset, key, field):
+    """
+    Sums a field of a queryset grouped by a key in a single GROUP BY query.
+
+    :param queryset: The queryset to aggregate.
+    :param key: The field to group by, such as a foreign key column.
+    :param field: The numeric field or expression to sum.
+    :return: A dictionary mapping each key value to the sum of the field.
+    """
+    rows = queryset.order_by().values(key).annotate(total=Sum(field)).values_list(key, 'total')
+    return {group: total or 0 for group, total in rows}
+
+def get_cost_report_context(start=None, end=None, department=None, valuation=None):
     """
     Fetches and prepares context data for a cost report, including information about departments,
     categories, items, and the total inventory cost. The data is aggregated from various
@@ -746,75 +882,127 @@ def get_cost_report_context():
     - Total cost and issued out value for each category.
     - Total cost and issued out value for each item.
     - Total inventory cost across all records.
-
-    Additionally, the function organizes and formats the retrieved data into a dictionary
-    suitable for further use or reporting.
-
+    - Value on hand and cost of the issued items for each department, category and
+      item under the valuation method, and their totals.
+
+    All totals are computed with a fixed number of grouped queries and merged in memory,
+    so the number of queries does not grow with the number of departments, categories or
+    items. Additionally, the function organizes and formats the retrieved data into a
+    dictionary suitable for further use or reporting.
+
+    :param start: Optional first date of the deliveries and issues to include.
+    :param end: Optional last date of the deliveries and issues to include.
+    :param department: Optional department to restrict the report to.
+    :param valuation: Optional valuation method of the stock on hand and the issued items,
+        see `inventory.valuation.get_valuation_method`.
     :return: A dictionary containing aggregated and organized context data. The structure includes:
         - 'department_data': A list of dictionaries, each containing:
             - 'department': Department instance.
             - 'total_cost': Total cost for stocks associated with the department.
             - 'issued_out_value': Total issued out value for items associated with the department.
-            - 'items': Queryset of InventoryItems associated with the department.
+            - 'issued_out_cost': Cost of the items issued by the department.
+            - 'on_hand_value': Value of the items the department holds.
+            - 'items': List of InventoryItems associated with the department, annotated with
+              `total_item_cost`.
         - 'category_data': A list of dictionaries, each containing:
             - 'category': Category instance.
             - 'total_cost': Total cost for items belonging to the category.
             - 'issued_out_value': Total issued out value for items belonging to the category.
-            - 'items': Queryset of InventoryItems belonging to the category.
+            - 'issued_out_cost': Cost of the issued items belonging to the category.
+            - 'on_hand_value': Value of the held items belonging to the category.
+            - 'items': List of InventoryItems belonging to the category.
         - 'item_data': A list of dictionaries, each containing:
             - 'item': Item instance.
             - 'total_cost': Total cost for the specific item.
             - 'issued_out_value': Total issued out value for the specific item.
+            - 'issued_out_cost': Cost of the issued units of the item.
+            - 'on_hand_value': Value of the held units of the item.
         - 'total_inventory_cost': The aggregate total cost of all inventory items.
+        - 'total_on_hand_value': The value of all stock on hand.
+        - 'total_issued_out_cost': The cost of all issued items.
+        - 'valuation': The valuation method used.
     """
-    # Fetch all departments
-    departments = StaffDepartment.objects.all()
-    department_data = []
+    valuation = get_valuation_method(valuation)
+    # Aggregate stock costs and issued quantities per department and per item, one GROUP BY query each
+    stock = scope_report_queryset(StockHistory.objects.all(), start, end, department)
+    issued = scope_report_queryset(IssuedOutHistory.objects.all(), start, end, department)
+    department_costs = _group_totals(stock, 'department_id', 'total_cost')
+    department_issued = _group_totals(issued, 'department_id', 'quantity_issued_out')
+    item_costs = _group_totals(stock, 'item_id', 'total_cost')
+    item_issued = _group_totals(issued, 'item_id', 'quantity_issued_out')
+
+    # Value the stock on hand from the holdings and open cost layers, and the issues from
+    # the costs recorded on them, without replaying the stock history. Each is read with one
+    # query grouped by department and item and rolled up in memory
+    department_values, item_values = defaultdict(int), defaultdict(int)
+    department_issued_costs, item_issued_costs = defaultdict(int), defaultdict(int)
+    for queryset, expression, by_department, by_item in (
+        (scope_report_queryset(Quantity.objects.all(), department=department), holding_value(valuation),
+         department_values, item_values),
+        (issued, issued_cost(valuation), department_issued_costs, item_issued_costs),
+    ):
+        for department_id, item_id, total in queryset.order_by().values('department_id', 'item_id').annotate(
+            total=Sum(expression)
+        ).values_list('department_id', 'item_id', 'total'):
+            by_department[department_id] += total or 0
+            by_item[item_id] += total or 0
+
+    # Fetch all items once and attach their total stock cost
+    items = list(InventoryItem.objects.all())
+    items_by_id = {}
+    for item in items:
+        item.total_item_cost = item_costs.get(item.id)
+        items_by_id[item.id] = item
+
+    # Map each department to the items it holds quantities of
+    department_items = defaultdict(list)
+    for department_id, item_id in scope_report_queryset(Quantity.objects.all(), department=department).values_list('department_id', 'item_id').distinct().order_by('department_id', 'item_id'):
+        department_items[department_id].append(items_by_id[item_id])
 
-    # Calculate total cost and issued out value for each department
-    for department in departments:
-        total_cost = StockHistory.objects.filter(department=department).aggregate(total_cost=Sum('total_cost'))['total_cost'] or 0
-        issued_out_value = IssuedOutHistory.objects.filter(department=department).aggregate(total_issued_value=Sum('quantity_issued_out'))['total_issued_value'] or 0
-        items = InventoryItem.objects.filter(quantity__department=department).annotate(total_item_cost=Sum('stockhistory__total_cost'))
-        department_data.append({
+    # Build department totals from the grouped results
+    department_data = [
+        {
             'department': department,
-            'total_cost': total_cost,
-            'issued_out_value': issued_out_value,
-            'items': items,
-        })
+            'total_cost': department_costs.get(department.id, 0),
+            'issued_out_value': department_issued.get(department.id, 0),
+            'issued_out_cost': department_issued_costs.get(department.id, 0),
+            'on_hand_value': department_values.get(department.id, 0),
+            'items': department_items[department.id],
+        }
+        for department in scope_departments(department)
+    ]
 
-    # Fetch all categories
-    categories = ItemCategory.objects.all()
-    category_data = []
+    # Roll item totals up into their categories in memory
+    category_items = defaultdict(list)
+    for item in items:
+        category_items[item.category].append(item)
 
-    # Calculate total cost and issued out value for each category
-    for category in categories:
-        items = InventoryItem.objects.filter(category=category.Category_name)
-        total_cost = StockHistory.objects.filter(item__in=items).aggregate(total_cost=Sum('total_cost'))['total_cost'] or 0
-        issued_out_value = IssuedOutHistory.objects.filter(item__in=items).aggregate(total_issued_value=Sum('quantity_issued_out'))['total_issued_value'] or 0
+    category_data = []
+    for category in ItemCategory.objects.all():
+        members = category_items[category.Category_name]
         category_data.append({
             'category': category,
-            'total_cost': total_cost,
-            'issued_out_value': issued_out_value,
-            'items': items,
+            'total_cost': sum((item_costs.get(item.id, 0) for item in members), 0),
+            'issued_out_value': sum((item_issued.get(item.id, 0) for item in members), 0),
+            'issued_out_cost': sum((item_issued_costs.get(item.id, 0) for item in members), 0),
+            'on_hand_value': sum((item_values.get(item.id, 0) for item in members), 0),
+            'items': members,
         })
 
-    # Fetch all items
-    items = InventoryItem.objects.all()
-    item_data = []
-
-    # Calculate total cost and issued out value for each item
-    for item in items:
-        total_cost = StockHistory.objects.filter(item=item).aggregate(total_cost=Sum('total_cost'))['total_cost'] or 0
-        issued_out_value = IssuedOutHistory.objects.filter(item=item).aggregate(total_issued_value=Sum('quantity_issued_out'))['total_issued_value'] or 0
-        item_data.append({
+    # Build item totals from the grouped results
+    item_data = [
+        {
             'item': item,
-            'total_cost': total_cost,
-            'issued_out_value': issued_out_value,
-        })
+            'total_cost': item_costs.get(item.id, 0),
+            'issued_out_value': item_issued.get(item.id, 0),
+            'issued_out_cost': item_issued_costs.get(item.id, 0),
+            'on_hand_value': item_values.get(item.id, 0),
+        }
+        for item in items
+    ]
 
     # Calculate total inventory cost
-    total_inventory_cost = StockHistory.objects.aggregate(total_cost=Sum('total_cost'))['total_cost'] or 0
+    total_inventory_cost = sum(item_costs.values(), 0)
 
     # Prepare context dictionary
     context = {
@@ -822,26 +1010,49 @@ def get_cost_report_context():
         'category_data': category_data,
         'item_data': item_data,
         'total_inventory_cost': total_inventory_cost,
+        'total_on_hand_value': sum(item_values.values(), 0),
+        'total_issued_out_cost': sum(item_issued_costs.values(), 0),
+        'valuation': valuation,
     }
     return context
 
-def get_all_delivered_view_context():
+def filter_delivered_items(queryset, filters=None):
     """
-    Fetches and prepares a detailed context containing information about delivered items,
-    their related data, and aggregated totals, including remaining quantities, costs, and
-    associated metadata for category and department information.
-
-    The function performs the following:
-    1. Calculates the total issued quantity for each stock item up to the point of addition.
-    2. Annotates delivered stock items with the issued quantity, remaining quantity, and
-       total calculated costs.
-    3. Aggregates overall totals for delivered stock items regarding quantity, cost, and
-       leftover inventory.
-    4. Retrieves all item categories and staff departments for contextual reference.
-    5. Compiles these results into a comprehensive dictionary format for usage in views.
+    Applies the delivered items register filters to a stock history queryset, so that
+    filtering happens in SQL rather than in the browser.
+
+    :param queryset: A queryset of StockHistory records.
+    :param filters: Optional dictionary of filters, usually the cleaned data of a
+        `DeliveredItemsFilterForm`. Supported keys are `category`, `department`,
+        `supplied_by`, `lpo`, `delivery_number`, `start_date` and `end_date`; empty
+        values are ignored.
+    :return: The filtered queryset.
+    """
+    filters = filters or {}
+    if filters.get('category'):
+        queryset = queryset.filter(item__category=filters['category'])
+    if filters.get('department'):
+        queryset = queryset.filter(department=filters['department'])
+    if filters.get('supplied_by'):
+        queryset = queryset.filter(supplied_by__icontains=filters['supplied_by'])
+    if filters.get('lpo'):
+        queryset = queryset.filter(lpo__icontains=filters['lpo'])
+    if filters.get('delivery_number'):
+        queryset = queryset.filter(delivery_number__icontains=filters['delivery_number'])
+    if filters.get('start_date'):
+        queryset = queryset.filter(date_added__gte=filters['start_date'])
+    if filters.get('end_date'):
+        queryset = queryset.filter(date_added__lte=filters['end_date'])
+    return queryset
+
+def get_delivered_items_queryset(filters=None):
+    """
+    Builds the queryset of delivered stock items annotated with their calculated total
+    cost, the quantity of the item issued up to the delivery date and the remaining
+    quantity. Shared by the all-delivered view, its JSON endpoint and its streaming exports.
 
-    :return: A dictionary containing lists of detailed information about delivered items,
-        aggregated totals, categories, and departments.
+    :param filters: Optional dictionary of filters, see `filter_delivered_items`.
+    :return: A queryset of StockHistory records ordered by most recent delivery first.
     """
     # Calculate the total issued quantity for each item up to the date added
     issued_quantity = IssuedOutHistory.objects.filter(
@@ -852,7 +1063,7 @@ def get_all_delivered_view_context():
     ).values('total_issued')
 
     # Fetch delivered items and annotate with calculated total cost, issued quantity, and remaining quantity
-    delivered_items = StockHistory.objects.select_related(
+    return filter_delivered_items(StockHistory.objects.all(), filters).select_related(
         'item', 'department', 'added_by'
     ).annotate(
         calculated_total_cost=F('quantity') * F('unit_cost'),
@@ -860,40 +1071,169 @@ def get_all_delivered_view_context():
         remaining_quantity=F('quantity') - Coalesce(Subquery(issued_quantity), 0)
     ).order_by('-date_added')
 
+def get_all_delivered_view_context(filters=None):
+    """
+    Fetches and prepares the context of the delivered items register, including the
+    filtered delivered items, their aggregated totals and the categories and departments
+    available as filters.
+
+    The function performs the following:
+    1. Annotates the delivered stock items matching the filters with the issued quantity,
+       remaining quantity, and total calculated costs.
+    2. Aggregates totals for the filtered stock items regarding quantity, cost, and
+       leftover inventory in a single query.
+    3. Retrieves all item categories and staff departments for contextual reference.
+
+    The delivered items are returned as a lazy queryset; the page fetches them one page
+    at a time through `get_all_delivered_page_context`.
+
+    :param filters: Optional dictionary of filters, see `filter_delivered_items`.
+    :return: A dictionary containing the delivered items queryset, aggregated totals,
+        categories, and departments.
+    """
+    # Fetch delivered items annotated with issued and remaining quantities
+    delivered_items = get_delivered_items_queryset(filters)
+
     # Aggregate totals for delivered items
     totals = delivered_items.aggregate(
-        total_items=Sum('quantity'),
-        total_cost=Sum('total_cost'),
-        total_remaining=Sum('remaining_quantity')
+        total_items=Coalesce(Sum('quantity'), 0),
+        total_cost=Coalesce(Sum('total_cost'), 0, output_field=DecimalField()),
+        total_remaining=Coalesce(Sum('remaining_quantity'), 0)
     )
 
-    # Fetch all categories and departments
+    # Fetch all categories and departments; the department list is only loaded if rendered
     categories = ItemCategory.objects.all()
-    departments = StaffDepartment.objects.all()
+    departments = SimpleLazyObject(get_departments)
 
-    # Prepare context dictionary with detailed information about delivered items
     context = {
-        'delivered_items': [
-            {
-                'stock': item,
-                'item_name': item.item.item_name,
-                'category': item.item.category,
-                'department': item.department.Department_name,
-                'engraved_number': item.engraved_number,
-                'quantity': item.quantity,
-                'unit_cost': item.unit_cost,
-                'total_cost': item.total_cost,
-                'remaining_quantity': item.remaining_quantity,
-                'date_added': item.date_added,
-                'added_by': item.added_by.username,
-                'lpo': item.lpo,
-                'supplied_by': item.supplied_by,
-                'delivery_number': item.delivery_number,
-            }
-            for item in delivered_items
-        ],
+        'delivered_items': delivered_items,
         'totals': totals,
         'categories': categories,
         'departments': departments,
     }
     return context
+
+def get_all_delivered_page_context(filters=None, page=1, page_size=25, sort='-date_added'):
+    """
+    Fetches one page of the delivered items register for server-side paging.
+
+    Stock history lines are grouped per delivery of an item, matching how the register is
+    displayed: lines of the same item, department, delivery number, LPO, supplier, date
+    and clerk are summed, and the engraved numbers of the groups on the page are fetched
+    in one additional query. Totals are aggregated over every row matching the filters,
+    not only the current page.
+
+    :param filters: Optional dictionary of filters, see `filter_delivered_items`.
+    :param page: The 1-based page number; out of range pages return the last page.
+    :param page_size: The number of grouped rows per page.
+    :param sort: A key of `DeliveredItemsFilterForm.SORT_FIELDS`, prefixed with '-' for
+        descending order.
+    :return: A JSON-serializable dictionary with the rows of the page, the filtered
+        totals and the paging metadata.
+    """
+    totals = get_all_delivered_view_context(filters)['totals']
+
+    prefix = '-' if sort.startswith('-') else ''
+    ordering = f"{prefix}{DeliveredItemsFilterForm.SORT_FIELDS[sort.lstrip('-')]}"
+    group_fields = ('item_id', 'item__item_name', 'item__category', 'department_id', 'department__Department_name',
+                    'date_added', 'delivery_number', 'lpo', 'supplied_by', 'added_by__username')
+    groups = filter_delivered_items(StockHistory.objects.all(), filters).values(*group_fields).annotate(
+        group_quantity=Sum('quantity'),
+        group_total_cost=Sum('total_cost'),
+    ).order_by(ordering, '-date_added', 'item_id', 'delivery_number', 'department_id')
+
+    page_obj = Paginator(groups, page_size).get_page(page)
+    rows = list(page_obj.object_list)
+
+    # Fetch the engraved numbers of every group on the page in one query
+    engraved_numbers = defaultdict(list)
+    if rows:
+        group_filter = Q()
+        for row in rows:
+            group_filter |= Q(item_id=row['item_id'], department_id=row['department_id'], date_added=row['date_added'],
+                              delivery_number=row['delivery_number'], lpo=row['lpo'], supplied_by=row['supplied_by'])
+        engraved = StockHistory.objects.filter(group_filter).exclude(engraved_number__isnull=True).exclude(
+            engraved_number='').values_list('item_id', 'department_id', 'date_added', 'delivery_number', 'lpo',
+                                            'supplied_by', 'engraved_number').order_by('engraved_number')
+        for *key, engraved_number in engraved:
+            engraved_numbers[tuple(key)].append(engraved_number)
+
+    return {
+        'rows': [
+            {
+                'item_name': row['item__item_name'],
+                'category': row['item__category'],
+                'department': row['department__Department_name'],
+                'quantity': row['group_quantity'],
+                'unit_cost': float(row['group_total_cost'] / row['group_quantity']) if row['group_quantity'] else 0.0,
+                'total_cost': float(row['group_total_cost']),
+                'date_added': row['date_added'],
+                'added_by': row['added_by__username'],
+                'lpo': row['lpo'],
+                'supplied_by': row['supplied_by'],
+                'delivery_number': row['delivery_number'],
+                'engraved_numbers': sorted(set(engraved_numbers[(
+                    row['item_id'], row['department_id'], row['date_added'], row['delivery_number'], row['lpo'],
+                    row['supplied_by'],
+                )])),
+            }
+            for row in rows
+        ],
+        'totals': {
+            'total_items': totals['total_items'],
+            'total_cost': float(totals['total_cost']),
+            'total_remaining': totals['total_remaining'],
+        },
+        'page': page_obj.number,
+        'num_pages': page_obj.paginator.num_pages,
+        'count': page_obj.paginator.count,
+        'has_next': page_obj.has_next(),
+        'has_previous': page_obj.has_previous(),
+    }
+
+def get_stock_as_of_context(day=None, department=None):
+    """
+    Looks up the quantities every department held of every item at the end of a day.
+
+    The balances are computed from the latest stock snapshot taken on or before the
+    day plus the daily stock movements since, so the cost of the lookup does not grow
+    with the length of the stock history.
+
+    :param day: Optional day to look up; today by default.
+    :param department: Optional department to restrict the balances to.
+    :return: A dictionary containing:
+        - 'date': The day looked up.
+        - 'snapshot_date': The date of the snapshot the balances were computed from, or
+          None if no snapshot was taken before the day.
+        - 'balances': A list of dictionaries with the 'item_id', 'item_name',
+          'department_id', 'department' and 'quantity' of every non-zero balance, ordered
+          by department and item name.
+        - 'total_quantity': The sum of the balances.
+    """
+    day = day or timezone.localdate()
+    snapshot_date, balances = StockSnapshot.balances_as_of(
+        day, department_id=department.pk if department is not None else None
+    )
+    # Resolve item names in one query and department names from the cached department list
+    item_names = dict(InventoryItem.objects.filter(id__in={item_id for item_id, _ in balances}).values_list(
+        'id', 'item_name'))
+    department_names = {department.pk: department.Department_name for department in get_departments()}
+    rows = sorted(
+        (
+            {
+                'item_id': item_id,
+                'item_name': item_names.get(item_id),
+                'department_id': department_id,
+                'department': department_names.get(department_id),
+                'quantity': quantity,
+            }
+            for (item_id, department_id), quantity in balances.items()
+        ),
+        key=lambda row: (row['department'] or '', row['item_name'] or ''),
+    )
+    return {
+        'date': day,
+        'snapshot_date': snapshot_date,
+        'balances': rows,
+        'total_quantity': sum(balances.values()),
+    }
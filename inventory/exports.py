@@ -0,0 +1,168 @@
+import csv
+import tempfile
+from decimal import Decimal
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+# Columns of the delivered items register exports, as (header, row key) pairs
+DELIVERED_EXPORT_COLUMNS = [
+    ('Item Name', 'item__item_name'),
+    ('Category', 'item__category'),
+    ('Department', 'department__Department_name'),
+    ('Engraved Number', 'engraved_number'),
+    ('Quantity', 'quantity'),
+    ('Unit Cost (UGX)', 'unit_cost'),
+    ('Total Cost (UGX)', 'total_cost'),
+    ('Issued Quantity', 'issued_quantity'),
+    ('Remaining Quantity', 'remaining_quantity'),
+    ('Date Added', 'date_added'),
+    ('Added By', 'added_by__username'),
+    ('LPO', 'lpo'),
+    ('Supplied By', 'supplied_by'),
+    ('Delivery Number', 'delivery_number'),
+]
+
+EXPORT_CHUNK_SIZE = 2000
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Size of the byte chunks an XLSX workbook is streamed in
+XLSX_STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class Echo:
+    """
+    A file-like object that returns what is written to it instead of buffering it,
+    so that `csv.writer` can feed a `StreamingHttpResponse` row by row.
+    """
+    def write(self, value):
+        return value
+
+
+def iter_export_rows(queryset, columns, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Iterates over a queryset in chunks, yielding one tuple of values per record in
+    the order of the given columns. Records are fetched with a server-side cursor where
+    the database supports it, so memory use does not grow with the size of the queryset.
+
+    :param queryset: The queryset to export.
+    :param columns: A list of (header, row key) pairs; the keys are passed to `values_list`.
+    :param chunk_size: The number of records fetched from the database at a time.
+    :return: A generator of value tuples.
+    """
+    keys = [key for _, key in columns]
+    return queryset.values_list(*keys).iterator(chunk_size=chunk_size)
+
+
+def stream_csv(rows, columns):
+    """
+    Encodes rows as CSV, one line at a time, starting with a header line.
+
+    :param rows: An iterable of value tuples.
+    :param columns: A list of (header, row key) pairs.
+    :return: A generator of CSV lines.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow([header for header, _ in columns])
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _xlsx_cell(sheet, value):
+    if not isinstance(value, str):
+        return value
+    # Control characters are not allowed in XML, and openpyxl rejects them
+    cell = WriteOnlyCell(sheet, ILLEGAL_CHARACTERS_RE.sub('', value))
+    # Text starting with '=' would otherwise be written as a formula
+    cell.data_type = 's'
+    return cell
+
+
+def stream_xlsx(rows, columns, sheet_name='Sheet1', chunk_size=XLSX_STREAM_CHUNK_SIZE):
+    """
+    Encodes rows as a single-sheet XLSX workbook and streams the finished file.
+
+    The workbook is written with openpyxl in write-only mode, which spools the rows of
+    the worksheet to a temporary file instead of keeping them in memory. The workbook
+    itself is saved to a temporary file as well and streamed from there in chunks, so
+    memory use stays constant regardless of the number of rows. Text is always written
+    as a string, never as a formula.
+
+    :param rows: An iterable of value tuples.
+    :param columns: A list of (header, row key) pairs.
+    :param sheet_name: The name of the worksheet.
+    :param chunk_size: The size in bytes of the chunks the file is streamed in.
+    :return: A generator of byte chunks forming the XLSX file.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_name)
+    sheet.append([_xlsx_cell(sheet, header) for header, _ in columns])
+    for row in rows:
+        sheet.append([_xlsx_cell(sheet, value) for value in row])
+
+    with tempfile.TemporaryFile() as file:
+        workbook.save(file)
+        file.seek(0)
+        while chunk := file.read(chunk_size):
+            yield chunk
+
+
+def format_cell(value):
+    """
+    Formats a report value for display: amounts with two decimals and thousands
+    separators, empty values as blanks and everything else as text.
+
+    :param value: The value to format.
+    :return: The formatted value as a string.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'Yes' if value else 'No'
+    if isinstance(value, (float, Decimal)):
+        return f'{value:,.2f}'
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def write_csv_sections(file, sections):
+    """
+    Writes report sections to a CSV file, each section as its title, a header line and
+    its rows, separated by blank lines.
+
+    :param file: A text file opened for writing with `newline=''`.
+    :param sections: A list of (title, headers, rows) tuples.
+    """
+    writer = csv.writer(file)
+    for index, (title, headers, rows) in enumerate(sections):
+        if index:
+            writer.writerow([])
+        writer.writerow([title])
+        writer.writerow(headers)
+        writer.writerows(rows)
+
+
+def write_xlsx_sections(file, title, sections):
+    """
+    Writes report sections to a single-sheet XLSX workbook, laid out like the CSV
+    artifacts: the report title, then each section as its title, a header row and its
+    rows, separated by blank rows. Values are written unformatted, so amounts stay
+    numbers in the spreadsheet.
+
+    :param file: A binary file opened for writing.
+    :param title: The title written in the first row.
+    :param sections: A list of (title, headers, rows) tuples.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title='Report')
+    sheet.append([_xlsx_cell(sheet, title)])
+    for section_title, headers, rows in sections:
+        sheet.append([])
+        sheet.append([_xlsx_cell(sheet, section_title)])
+        sheet.append([_xlsx_cell(sheet, header) for header in headers])
+        for row in rows:
+            sheet.append([_xlsx_cell(sheet, value) for value in row])
+    workbook.save(file)
@@ -1,6 +1,7 @@
 # inventory/forms.py
 from django import forms
-from .models import InventoryItem, ItemCategory, StaffDepartment, Employee, StockHistory
+from django.utils import timezone
+from .models import InventoryItem, ItemCategory, StaffDepartment, Employee, StockHistory, ReportJob
 
 
 class InventoryItemForm(forms.ModelForm):
@@ -127,19 +128,46 @@ class EmployeeForm(forms.ModelForm):
 
 class DateRangeForm(forms.Form):
     """
-    Represents a form for selecting a date range.
+    Represents a form for selecting a date range and department.
 
-    This class is used to create a form for selecting a date range with start and
-    end dates using `forms.DateField` fields. It utilizes `forms.SelectDateWidget`
-    for both fields to enable a user-friendly date selection interface. The form
-    can be used in scenarios where users are required to input a date range for
-    filtering or searching data.
+    This class is used to scope the reports to a period and, optionally, a single
+    department. Every field is optional: an empty form selects the whole history of
+    every department. The report views read it from the GET parameters and pass the
+    cleaned values to the report context builders, which filter in SQL.
 
-    :ivar start_date: The start date of the date range.
-    :ivar end_date: The end date of the date range.
+    :ivar start_date: The start date of the date range, inclusive.
+    :ivar end_date: The end date of the date range, inclusive.
+    :ivar department: The department to restrict the report to.
     """
-    start_date = forms.DateField(widget=forms.SelectDateWidget)
-    end_date = forms.DateField(widget=forms.SelectDateWidget)
+    start_date = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}))
+    end_date = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}))
+    department = forms.ModelChoiceField(queryset=StaffDepartment.objects.all(), required=False,
+                                        widget=forms.Select(attrs={'class': 'form-select'}))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date, end_date = cleaned_data.get('start_date'), cleaned_data.get('end_date')
+        if start_date and end_date and start_date > end_date:
+            raise forms.ValidationError('The start date must not be after the end date.')
+        return cleaned_data
+
+class StockAsOfForm(forms.Form):
+    """
+    Represents a form for selecting the day and, optionally, the department whose
+    stock balances are looked up. An empty day selects today.
+
+    :ivar date: The day whose closing balances are looked up.
+    :ivar department: The department to restrict the balances to.
+    """
+    date = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}))
+    department = forms.ModelChoiceField(queryset=StaffDepartment.objects.all(), required=False,
+                                        widget=forms.Select(attrs={'class': 'form-select'}))
+
+    def clean_date(self):
+        day = self.cleaned_data.get('date')
+        if day and day > timezone.localdate():
+            raise forms.ValidationError('The date must not be in the future.')
+        return day
 
 class EmployeeListForm(forms.ModelForm):
     """
@@ -159,3 +187,73 @@ class EmployeeListForm(forms.ModelForm):
         model = Employee
         fields = ['name', 'department', 'Title', 'office']
 
+
+
+class DeliveredItemsFilterForm(forms.Form):
+    """
+    Represents the filters, sorting and paging options of the delivered items register.
+
+    The form validates the query parameters sent by the all-delivered page and its
+    exports, so that filtering, sorting and paging happen on the server instead of in
+    the browser. Every field is optional; an empty form selects the whole register.
+
+    :ivar category: Filter by the category name of the delivered item.
+    :ivar department: Filter by the department the stock was delivered to.
+    :ivar supplied_by: Filter by supplier name (case-insensitive substring match).
+    :ivar lpo: Filter by LPO number (case-insensitive substring match).
+    :ivar delivery_number: Filter by delivery number (case-insensitive substring match).
+    :ivar start_date: Only include deliveries added on or after this date.
+    :ivar end_date: Only include deliveries added on or before this date.
+    :ivar sort: The column to sort by, prefixed with '-' for descending order.
+    :ivar page: The page number to return.
+    :ivar page_size: The number of rows per page.
+    """
+    # Sortable columns of the grouped register rows
+    SORT_FIELDS = {
+        'item_name': 'item__item_name',
+        'category': 'item__category',
+        'department': 'department__Department_name',
+        'quantity': 'group_quantity',
+        'total_cost': 'group_total_cost',
+        'date_added': 'date_added',
+        'lpo': 'lpo',
+        'supplied_by': 'supplied_by',
+        'delivery_number': 'delivery_number',
+    }
+
+    category = forms.CharField(required=False)
+    department = forms.ModelChoiceField(queryset=StaffDepartment.objects.all(), required=False)
+    supplied_by = forms.CharField(required=False)
+    lpo = forms.CharField(required=False)
+    delivery_number = forms.CharField(required=False)
+    start_date = forms.DateField(required=False)
+    end_date = forms.DateField(required=False)
+    sort = forms.CharField(required=False)
+    page = forms.IntegerField(required=False, min_value=1)
+    page_size = forms.IntegerField(required=False, min_value=1, max_value=200)
+
+    def clean_sort(self):
+        sort = self.cleaned_data.get('sort') or '-date_added'
+        if sort.lstrip('-') not in self.SORT_FIELDS:
+            raise forms.ValidationError('Unsupported sort column.')
+        return sort
+
+
+class ReportJobForm(forms.ModelForm):
+    """
+    Handles the creation of a background report job.
+
+    The form validates the report kind, the artifact format and the optional period
+    and department the report is restricted to. The period follows the same rules as
+    `DateRangeForm`.
+    """
+    class Meta:
+        model = ReportJob
+        fields = ['kind', 'format', 'start_date', 'end_date', 'department']
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date, end_date = cleaned_data.get('start_date'), cleaned_data.get('end_date')
+        if start_date and end_date and start_date > end_date:
+            raise forms.ValidationError('The start date must not be after the end date.')
+        return cleaned_data
@@ -1,19 +1,28 @@
-from inventory.models import StaffDepartment
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+
+from inventory.cache import get_data_version, get_departments, get_departments_version
 
 
 def global_context(request):
     """
-    Fetches all staff departments and returns them in a dictionary format.
+    Provides the list of all staff departments and the cache versions of template
+    fragments to every template.
 
-    The method retrieves all instances of the StaffDepartment model from the
-    database and provides them in a context dictionary, which can be used
-    in templates or other parts of the application.
+    The list is evaluated lazily, so responses that never render it do not load it,
+    and is served from the process-wide department cache, so rendering it costs no
+    query once the cache is warm. The version tokens are lazy as well and are meant as
+    `vary_on` arguments of `{% cache %}` tags: a fragment rendering departments varies
+    on `departments_version`, a fragment rendering stock data on `data_version`.
 
     :param request: The HTTP request object that triggers this function.
-    :return: A dictionary containing a key 'departments' with a queryset of
-        all StaffDepartment instances.
+    :return: A dictionary containing a lazy list of all StaffDepartment instances under
+        'departments', the lazy 'departments_version' and 'data_version' tokens, and the
+        'fragment_timeout' of cached fragments in seconds.
     """
-    departments = StaffDepartment.objects.all()
     return {
-        'departments': departments,
-    }
\ No newline at end of file
+        'departments': SimpleLazyObject(get_departments),
+        'departments_version': SimpleLazyObject(get_departments_version),
+        'data_version': SimpleLazyObject(get_data_version),
+        'fragment_timeout': getattr(settings, 'INVENTORY_FRAGMENT_TIMEOUT', 300),
+    }
@@ -0,0 +1,237 @@
+import logging
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from inventory.context import get_combined_report_context, get_cost_report_context, get_inflow_report_context, \
+    get_outflow_report_context
+from inventory.exports import format_cell, write_csv_sections, write_xlsx_sections
+from inventory.models import ReportJob
+
+logger = logging.getLogger(__name__)
+
+
+def _combined_sections(context):
+    return [
+        ('Executive Summary', ['Metric', 'Value'], [
+            ('Total Items', context['total_items']),
+            ('Total Quantity', context['total_quantity']),
+            ('Total Value (UGX)', context['total_value']),
+            ('Total Cost (UGX)', context['total_cost']),
+        ]),
+        ('Categories', ['Category', 'Quantity', 'Value (UGX)'], [
+            (row['category'], row['total_quantity'], row['total_value']) for row in context['category_summary']
+        ]),
+        ('Departments', ['Department', 'Quantity', 'Value (UGX)'], [
+            (row['department__Department_name'], row['total_quantity'], row['total_value'])
+            for row in context['department_summary']
+        ]),
+        ('Stock Movement', ['Date', 'Added', 'Issued', 'Value Added (UGX)', 'Value Issued (UGX)'], list(zip(
+            context['stock_dates'], context['stock_added'], context['stock_issued'],
+            context['value_added'], context['value_issued'],
+        ))),
+        ('Suppliers', ['Supplier', 'Quantity', 'Cost (UGX)'], [
+            (row['supplied_by'], row['total_quantity'], row['total_cost']) for row in context['supplier_summary']
+        ]),
+        ('Deliveries', ['Delivery Number', 'Supplier', 'Quantity', 'Cost (UGX)'], [
+            (row['delivery_number'], row['supplied_by'], row['total_quantity'], row['total_cost'])
+            for row in context['delivery_summary']
+        ]),
+        ('Departmental Usage', ['Department', 'Issued', 'Value (UGX)'], [
+            (row['department__Department_name'], row['total_issued'], row['total_value'])
+            for row in context['departmental_usage']
+        ]),
+        ('Departmental Inflow', ['Department', 'Added', 'Cost (UGX)'], [
+            (row['department__Department_name'], row['total_added'], row['total_cost'])
+            for row in context['departmental_inflow']
+        ]),
+    ]
+
+
+def _cost_sections(context):
+    return [
+        ('Summary', ['Metric', 'Value'], [
+            ('Total Inventory Cost (UGX)', context['total_inventory_cost']),
+            ('Value On Hand (UGX)', context['total_on_hand_value']),
+            ('Cost of Issued Items (UGX)', context['total_issued_out_cost']),
+            ('Valuation Method', context['valuation']),
+        ]),
+        ('Departments', ['Department', 'Total Cost (UGX)', 'Issued Out', 'Issued Cost (UGX)', 'Value On Hand (UGX)'], [
+            (row['department'].Department_name, row['total_cost'], row['issued_out_value'], row['issued_out_cost'],
+             row['on_hand_value'])
+            for row in context['department_data']
+        ]),
+        ('Categories', ['Category', 'Total Cost (UGX)', 'Issued Out', 'Issued Cost (UGX)', 'Value On Hand (UGX)'], [
+            (row['category'].Category_name, row['total_cost'], row['issued_out_value'], row['issued_out_cost'],
+             row['on_hand_value'])
+            for row in context['category_data']
+        ]),
+        ('Items', ['Item', 'Total Cost (UGX)', 'Issued Out', 'Issued Cost (UGX)', 'Value On Hand (UGX)'], [
+            (row['item'].item_name, row['total_cost'], row['issued_out_value'], row['issued_out_cost'],
+             row['on_hand_value'])
+            for row in context['item_data']
+        ]),
+    ]
+
+
+def _inflow_sections(context):
+    return [
+        ('Overall Summary', ['Metric', 'Value'], [
+            ('Total Quantity', context['overall_totals']['total_quantity']),
+            ('Total Value (UGX)', context['overall_totals']['total_value']),
+        ]),
+        ('Items', ['Item', 'Quantity', 'Value (UGX)'], [
+            (row['item__item_name'], row['total_quantity'], row['total_value']) for row in context['total_quantities']
+        ]),
+        ('Categories', ['Category', 'Quantity', 'Value (UGX)'], [
+            (row['item__category'], row['total_quantity'], row['total_value']) for row in context['categories']
+        ]),
+        ('Suppliers', ['Supplier', 'Quantity', 'Value (UGX)'], [
+            (row['supplied_by'], row['total_quantity'], row['total_value']) for row in context['suppliers']
+        ]),
+        ('Deliveries', ['Delivery Number', 'Supplier', 'Quantity', 'Value (UGX)'], [
+            (row['delivery_number'], row['supplied_by'], row['total_quantity'], row['total_value'])
+            for row in context['delivery_summary']
+        ]),
+        ('Departmental Inflow', ['Department', 'Added', 'Value (UGX)'], [
+            (row['department__Department_name'], row['total_added'], row['total_value'])
+            for row in context['departmental_inflow']
+        ]),
+    ]
+
+
+def _outflow_sections(context):
+    return [
+        ('Cost Overview', ['Metric', 'Value'], [
+            ('Total Cost (UGX)', context['total_cost']),
+            ('Average Cost per Item (UGX)', context['avg_cost_per_item']),
+            ('Highest Single Item Cost (UGX)', context['highest_single_item_cost']),
+        ]),
+        ('Departments', ['Department', 'Issued', 'Cost (UGX)', 'Last Issued'], [
+            (row['department__Department_name'], row['total_outflow'], row['total_cost'], row['last_issue_date'])
+            for row in context['department_data']
+        ]),
+        ('Categories', ['Category', 'Issued', 'Cost (UGX)'], [
+            (row['item__category'], row['total_outflow'], row['total_cost']) for row in context['category_data']
+        ]),
+    ]
+
+
+# The context builder and section layout of every report kind a job can generate
+REPORT_BUILDERS = {
+    'combined': (get_combined_report_context, _combined_sections),
+    'cost': (get_cost_report_context, _cost_sections),
+    'inflow': (get_inflow_report_context, _inflow_sections),
+    'outflow': (get_outflow_report_context, _outflow_sections),
+}
+
+
+def get_artifacts_dir():
+    """
+    Returns the directory report artifacts are written to, creating it if needed.
+
+    :return: The directory as a Path, from the `REPORT_ARTIFACTS_DIR` setting.
+    """
+    directory = Path(getattr(settings, 'REPORT_ARTIFACTS_DIR', Path(settings.BASE_DIR) / 'report_artifacts'))
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def claim_report_jobs(limit):
+    """
+    Marks up to `limit` of the oldest pending report jobs as running and returns them.
+
+    Each job is claimed with a conditional UPDATE on its status, so several workers can
+    poll the same queue without picking up the same job twice.
+
+    :param limit: The maximum number of jobs to claim.
+    :return: A list of the claimed job IDs.
+    """
+    if limit <= 0:
+        return []
+    claimed = []
+    pending = ReportJob.objects.filter(status=ReportJob.PENDING).order_by('created_at', 'id')
+    for job_id in pending.values_list('id', flat=True)[:limit]:
+        if ReportJob.objects.filter(pk=job_id, status=ReportJob.PENDING).update(
+            status=ReportJob.RUNNING, started_at=timezone.now(), progress=0
+        ):
+            claimed.append(job_id)
+    return claimed
+
+
+def _set_progress(job, progress):
+    job.progress = progress
+    ReportJob.objects.filter(pk=job.pk).update(progress=progress)
+
+
+def _write_artifact(job, title, sections, path):
+    if job.format == 'csv':
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            write_csv_sections(file, sections)
+    elif job.format == 'xlsx':
+        with open(path, 'wb') as file:
+            write_xlsx_sections(file, title, sections)
+    elif job.format == 'html':
+        html = render_to_string('reports/report_job_artifact.html', {
+            'title': title,
+            'job': job,
+            'generated_at': timezone.localtime(),
+            'sections': [
+                (section_title, headers, [[format_cell(value) for value in row] for row in rows])
+                for section_title, headers, rows in sections
+            ],
+        })
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(html)
+    else:
+        # Jobs queued as PDF before that format was dropped
+        raise ValueError(f'Unsupported report format: {job.format}')
+
+
+def run_report_job(job_id):
+    """
+    Generates the report of a claimed job and stores it in the artifacts directory.
+
+    The report is built with the same context builder as the report page, restricted
+    to the job's period and department, then laid out as sections and written in the
+    job's format. The artifact is written to a temporary file and moved into place, so
+    a download never sees a partial file. Failures are recorded on the job instead of
+    being raised.
+
+    :param job_id: The ID of a job claimed with `claim_report_jobs`.
+    :return: The final status of the job.
+    """
+    job = ReportJob.objects.select_related('department').get(pk=job_id)
+    try:
+        builder, layout = REPORT_BUILDERS[job.kind]
+        _set_progress(job, 10)
+        context = builder(start=job.start_date, end=job.end_date, department=job.department)
+        _set_progress(job, 60)
+        sections = layout(context)
+        _set_progress(job, 80)
+
+        title = job.get_kind_display()
+        if job.department:
+            title += f' - {job.department.Department_name}'
+        if job.start_date or job.end_date:
+            title += f" ({job.start_date or 'start'} to {job.end_date or 'today'})"
+
+        artifact = f'report-{job.pk}-{job.kind}.{job.format}'
+        path = get_artifacts_dir() / artifact
+        temporary_path = path.with_name(path.name + '.tmp')
+        _write_artifact(job, title, sections, temporary_path)
+        os.replace(temporary_path, path)
+
+        ReportJob.objects.filter(pk=job.pk).update(
+            status=ReportJob.DONE, progress=100, artifact=artifact, finished_at=timezone.now()
+        )
+        return ReportJob.DONE
+    except Exception as error:
+        logger.exception('Report job %s failed', job_id)
+        ReportJob.objects.filter(pk=job.pk).update(
+            status=ReportJob.FAILED, error=str(error) or error.__class__.__name__, finished_at=timezone.now()
+        )
+        return ReportJob.FAILED
@@ -0,0 +1,137 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.db.models import Sum
+from django.test.utils import override_settings
+
+from inventory.models import InventoryItem, StaffDepartment, Employee, Quantity, StockHistory, IssuedOutHistory, \
+    StockLedgerEntry, CostLayer
+from inventory.seeding import seed_inventory
+from inventory.services import StockMovementError, issue_stock, receive_stock
+
+
+def issue_concurrently(quantity, employee, user, threads, issues):
+    """
+    Issues one unit at a time from a single Quantity record in several threads at once.
+
+    Every thread opens its own database connection and waits for the others before its
+    first issue, so the issues contend for the same row.
+
+    :param quantity: The Quantity record the stock is issued from.
+    :param employee: The employee receiving the stock.
+    :param user: The user issuing the stock.
+    :param threads: The number of threads issuing.
+    :param issues: The number of issues attempted per thread.
+    :return: A list of (issued, rejected, errors) tuples, one per thread.
+    """
+    barrier = threading.Barrier(threads)
+
+    def run(worker):
+        issued = rejected = 0
+        errors = []
+        try:
+            barrier.wait()
+            for number in range(issues):
+                try:
+                    issue_stock(quantity.pk, quantity.item, quantity.department, employee, 1,
+                                f'STRESS-{worker:02d}-{number:04d}', user)
+                    issued += 1
+                except StockMovementError:
+                    rejected += 1
+                except OperationalError as error:
+                    errors.append(str(error))
+        finally:
+            # Connections are per thread and would otherwise stay open until the process exits
+            connections.close_all()
+        return issued, rejected, errors
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(run, range(threads)))
+
+
+class Command(BaseCommand):
+    help = (
+        "Issues stock from one Quantity record in several threads at once on a throwaway test "
+        "database, then fails if the final quantity, the issued-out history, the stock ledger "
+        "or the cost layers disagree with the number of successful issues. The configured "
+        "database is never touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Number of threads issuing at once.')
+        parser.add_argument('--issues', type=int, default=25, help='Number of issues attempted per thread.')
+        parser.add_argument('--stock', type=int, default=150,
+                            help='Number of units received before issuing; fewer than the attempted issues '
+                                 'also exercises the availability check.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic dataset.')
+
+    def handle(self, *args, **options):
+        logging.getLogger('inventory.metrics').disabled = True
+        with tempfile.TemporaryDirectory() as database_dir, override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        ):
+            # An in-memory SQLite test database cannot be shared by the connections of several threads
+            if connection.vendor == 'sqlite':
+                connection.settings_dict['TEST']['NAME'] = os.path.join(database_dir, 'stress.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                failures = self.check_holding(options)
+            finally:
+                connections.close_all()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if failures:
+            raise CommandError(f'{len(failures)} concurrency violations:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('Concurrent issues kept the stock consistent.'))
+
+    def check_holding(self, options):
+        user = User.objects.create_superuser('stress', 'stress@example.com', 'stress')
+        seed_inventory(200, user, seed=options['seed'])
+        # Stock a holding that was empty, so it starts with exactly --stock units
+        item = InventoryItem.objects.filter(engraved=False).order_by('id').first()
+        department = StaffDepartment.objects.exclude(
+            id__in=Quantity.objects.filter(item=item).values('department_id')
+        ).order_by('id').first()
+        receive_stock(StockHistory(
+            item=item, department=department, quantity=options['stock'], unit_cost=Decimal('10.00'),
+            lpo='STRESS', supplied_by='Stress test', delivery_number='STRESS', added_by=user,
+        ))
+        quantity = Quantity.objects.select_related('item', 'department').get(item=item, department=department)
+        employee = Employee.objects.filter(department=quantity.department).first()
+        initial = quantity.quantity
+
+        start = time.perf_counter()
+        results = issue_concurrently(quantity, employee, user, options['threads'], options['issues'])
+        elapsed = time.perf_counter() - start
+        issued = sum(result[0] for result in results)
+        rejected = sum(result[1] for result in results)
+        errors = [error for result in results for error in result[2]]
+        self.stdout.write(f'{options["threads"]} threads, {initial} units: {issued} issued, {rejected} rejected, '
+                          f'{len(errors)} database errors in {elapsed:.1f}s')
+
+        holding_filter = {'item_id': quantity.item_id, 'department_id': quantity.department_id}
+        final = Quantity.objects.get(pk=quantity.pk).quantity
+        history = IssuedOutHistory.objects.filter(issue_voucher_number__startswith='STRESS-', **holding_filter)
+        ledger = StockLedgerEntry.objects.filter(**holding_filter).aggregate(balance=Sum('change'))['balance']
+        remaining = CostLayer.objects.filter(**holding_filter).aggregate(units=Sum('remaining'))['units']
+
+        failures = [f'database error: {error}' for error in sorted(set(errors))]
+        if final != initial - issued:
+            failures.append(f'final quantity {final} != {initial} - {issued} issued')
+        if issued > initial:
+            failures.append(f'{issued} units issued from {initial} available')
+        if history.count() != issued:
+            failures.append(f'{history.count()} issued-out records for {issued} issues')
+        if ledger != final:
+            failures.append(f'stock ledger balance {ledger} != quantity {final}')
+        if remaining != final:
+            failures.append(f'{remaining} units left in the cost layers != quantity {final}')
+        return failures
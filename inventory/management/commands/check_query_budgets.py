@@ -0,0 +1,367 @@
+import itertools
+import json
+import logging
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, \
+    teardown_test_environment
+from django.urls import URLPattern, reverse
+
+from inventory import urls as inventory_urls
+from inventory.jobs import run_report_job
+from inventory.models import InventoryItem, Quantity, Employee, StockHistory, IssuedOutHistory, ReportJob
+from inventory.seeding import seed_inventory
+
+# Maximum number of queries per view. Budgets do not depend on the dataset size: a view
+# whose query count grows with the number of rows has an N+1 pattern, and the count of
+# every view must also stay the same across the dataset sizes checked.
+QUERY_BUDGETS = {
+    'dashboard': 14,
+    'inventory': 16,
+    'add_item': 16,
+    'add_category': 3,
+    'add_department': 3,
+    'item_details': 13,
+    'add_stock': 13,
+    'add_engraved_stock': 1,
+    'add_employee': 2,
+    'issue_out': 2,
+    'issue_out_engraved': 25,
+    'issue_out_voucher': 2,
+    'combined_report': 16,
+    'department_report': 7,
+    'in_flow_report': 10,
+    'outflow_report': 9,
+    'cost-report': 11,
+    'report_job_create': 2,
+    'report_job_status': 3,
+    'report_job_download': 3,
+    'stock_as_of': 6,
+    'department_dashboard': 13,
+    'department_item_details': 9,
+    'outflow_dashboard': 8,
+    'ivn_list': 2,
+    'ivn_detail': 3,
+    'all_delivered': 3,
+    'all_delivered_data': 4,
+    'all_delivered_export': 3,
+    'delivery_numbers_list': 2,
+    'get_delivery_details': 3,
+    'lpo_numbers_list': 2,
+    'get_lpo_details': 5,
+    'all_issued_out': 5,
+    'asset_register': 5,
+    'employee_list': 1,
+    'employee_create': 1,
+    'employee_update': 2,
+    'employee_delete': 1,
+    'metrics': 2,
+}
+
+# Maximum number of queries per write, requested with the POST scenarios of `post_scenarios`.
+# The stock movement services write in bulk, so these do not depend on the dataset size either.
+POST_QUERY_BUDGETS = {
+    'add_stock': 24,
+    'add_engraved_stock': 22,
+    'issue_out': 23,
+    'issue_out_engraved': 25,
+    'issue_out_voucher': 24,
+}
+
+# Latency ceiling in seconds per dataset size, for views without their own ceiling
+LATENCY_CEILINGS = {1000: 0.5, 10000: 0.5, 100000: 1.5}
+
+# Views rendering every row of a table, allowed more time on the largest dataset. The
+# ceilings are about 1.5 times the median measured on the reference machine, so a
+# regression fails the run; lower them when a view is paginated or moved onto a rollup.
+VIEW_LATENCY_CEILINGS = {
+    'cost-report': {100000: 2.5},
+    'ivn_list': {100000: 4.0},
+    'all_delivered_export': {100000: 2.5},
+    'delivery_numbers_list': {100000: 4.5},
+    'lpo_numbers_list': {100000: 4.5},
+}
+
+# Query strings the views need to render their main content
+QUERY_STRINGS = {
+    'ivn_detail': 'ivn={issue_voucher_number}',
+}
+
+
+def url_arguments(user):
+    """
+    Picks seeded records to fill in the URL parameters of the inventory views.
+
+    A finished report job is generated so that its status and download views have an
+    artifact to serve.
+
+    :param user: The user the requests are made as.
+    :return: A dict of URL parameter values, keyed by parameter name.
+    """
+    quantity = Quantity.objects.filter(quantity__gt=0).order_by('id').first()
+    stock = StockHistory.objects.order_by('id').first()
+    issue = IssuedOutHistory.objects.order_by('id').first()
+    job = ReportJob.objects.create(kind='combined', format='csv', created_by=user, status=ReportJob.RUNNING)
+    run_report_job(job.pk)
+    return {
+        'item_id': quantity.item_id,
+        'department_id': quantity.department_id,
+        'pk': Employee.objects.order_by('id').values_list('id', flat=True).first(),
+        'job_id': job.pk,
+        'delivery_number': stock.delivery_number,
+        'lpo_number': stock.lpo,
+        'issue_voucher_number': issue.issue_voucher_number,
+        'engraved_item_id': InventoryItem.objects.filter(engraved=True).values_list('id', flat=True).first(),
+    }
+
+
+def named_urls(arguments):
+    """
+    Resolves every named URL of the inventory app with the seeded records.
+
+    :param arguments: URL parameter values from `url_arguments`.
+    :return: A list of (name, url) pairs.
+    """
+    resolved = []
+    for pattern in inventory_urls.urlpatterns:
+        if not isinstance(pattern, URLPattern) or not pattern.name:
+            continue
+        kwargs = {name: arguments[name] for name in pattern.pattern.converters}
+        if pattern.name == 'add_engraved_stock':
+            kwargs['item_id'] = arguments['engraved_item_id'] or arguments['item_id']
+        url = reverse(pattern.name, kwargs=kwargs)
+        if pattern.name in QUERY_STRINGS:
+            url += '?' + QUERY_STRINGS[pattern.name].format(**arguments)
+        resolved.append((pattern.name, url))
+    return resolved
+
+
+def post_scenarios(arguments):
+    """
+    Builds a POST request for every write view, run in order after the GET requests.
+
+    Every request must succeed, and each is sent several times, so the payloads are
+    built anew per request: stock is added before it is issued, engraved numbers are
+    unique and the engraved units issued are the ones added by `add_engraved_stock`.
+    Payloads are built before the queries are captured, so their lookups are not
+    counted.
+
+    :param arguments: URL parameter values from `url_arguments`.
+    :return: A list of (name, url, payload) tuples; `payload` returns the data and the
+        content type of the next request.
+    """
+    holding = Quantity.objects.filter(item__engraved=False).order_by('-quantity', 'id').first()
+    engraved_item = InventoryItem.objects.get(pk=arguments['engraved_item_id'])
+    department_id = holding.department_id
+    employee_id = Employee.objects.filter(department_id=department_id).values_list('id', flat=True).first()
+    counter = itertools.count()
+
+    def engraved_quantity():
+        return Quantity.objects.get(item=engraved_item, department_id=department_id)
+
+    def next_unit():
+        return StockHistory.objects.filter(
+            item=engraved_item, department_id=department_id, engraved_number__startswith='BENCH-', issued=False
+        ).order_by('id').values_list('engraved_number', flat=True).first()
+
+    def add_stock():
+        return {
+            'quantity': 100, 'unit_cost': '10.00', 'lpo': 'BENCH', 'supplied_by': 'Benchmark',
+            'delivery_number': 'BENCH', 'department': department_id, 'date_added': '2024-01-15',
+            'expiry_date': '2030-01-01', 'depreciation_date': '2030-01-01',
+        }, None
+
+    def add_engraved_stock():
+        numbers = [f'BENCH-{next(counter):06d}' for _ in range(3)]
+        return {
+            'quantity': len(numbers), 'engraved_numbers[]': numbers, 'department': department_id,
+            'unit_cost': '10.00', 'lpo': 'BENCH', 'supplied_by': 'Benchmark', 'delivery_number': 'BENCH',
+        }, None
+
+    def issue_out():
+        return {
+            'item_id': holding.item_id, 'quantity_id': holding.pk, 'department_id': department_id, 'quantity': 1,
+            'issue_voucher_number': 'BENCH', 'issued_to': employee_id,
+        }, None
+
+    def issue_out_engraved():
+        return {
+            'item_id': engraved_item.pk, 'engraved_number': next_unit(), 'quantity_id': engraved_quantity().pk,
+            'department_id': department_id, 'quantity': 1, 'issue_voucher_number': 'BENCH', 'issued_to': employee_id,
+        }, None
+
+    def issue_out_voucher():
+        return json.dumps({
+            'issue_voucher_number': 'BENCH', 'department_id': department_id, 'issued_to': employee_id,
+            'lines': [
+                {'item_id': holding.item_id, 'quantity': 1},
+                {'item_id': engraved_item.pk, 'engraved_numbers': [next_unit()]},
+            ],
+        }), 'application/json'
+
+    return [
+        ('add_stock', reverse('add_stock', kwargs={'item_id': holding.item_id}), add_stock),
+        ('add_engraved_stock', reverse('add_engraved_stock', kwargs={'item_id': engraved_item.pk}),
+         add_engraved_stock),
+        ('issue_out', reverse('issue_out'), issue_out),
+        ('issue_out_engraved', reverse('issue_out_engraved'), issue_out_engraved),
+        ('issue_out_voucher', reverse('issue_out_voucher'), issue_out_voucher),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway test database with synthetic datasets of increasing size, requests "
+        "every named inventory URL and fails if a view exceeds its query budget or latency "
+        "ceiling, or if its query count changes with the dataset size. The configured "
+        "database is never touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help='Dataset sizes to check, in stock history records.')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Number of timed requests per view; the median is compared to the ceiling.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic datasets.')
+        parser.add_argument('--latency-factor', type=float, default=1.0,
+                            help='Multiplies every latency ceiling, for slower build machines.')
+
+    def handle(self, *args, **options):
+        # The request metrics middleware would log every request of the run
+        logging.getLogger('inventory.metrics').disabled = True
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with tempfile.TemporaryDirectory() as artifacts_dir, override_settings(
+                CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                REPORT_ARTIFACTS_DIR=artifacts_dir,
+            ):
+                failures = []
+                self.query_counts = defaultdict(dict)
+                for rows in sorted(options['rows']):
+                    failures += self.check_dataset(rows, options)
+                failures += self.check_flat_query_counts()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if failures:
+            raise CommandError(f'{len(failures)} budget violations:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('All views are within their query budgets and latency ceilings.'))
+
+    def check_dataset(self, rows, options):
+        # Start every dataset from an empty database
+        call_command('flush', interactive=False, verbosity=0)
+        cache.clear()
+        user = User.objects.create_superuser('benchmark', 'benchmark@example.com', 'benchmark')
+        start = time.perf_counter()
+        counts = seed_inventory(rows, user, seed=options['seed'])
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{rows} rows: " + ', '.join(f'{count} {model}' for model, count in counts.items())
+            + f' (seeded in {time.perf_counter() - start:.1f}s)'
+        ))
+
+        client = Client()
+        client.force_login(user)
+        ceiling = LATENCY_CEILINGS.get(rows, max(LATENCY_CEILINGS.values()))
+        failures = []
+        arguments = url_arguments(user)
+        requests = [(name, url, None) for name, url in named_urls(arguments)]
+        requests += [(f'{name} POST', url, payload) for name, url, payload in post_scenarios(arguments)]
+        for name, url, payload in requests:
+            budget = POST_QUERY_BUDGETS.get(name[:-len(' POST')]) if payload else QUERY_BUDGETS.get(name)
+            if budget is None:
+                failures.append(f'{rows} rows: {name} has no query budget')
+                continue
+            queries, durations, status, error = self.measure(client, url, options['repeat'], payload)
+            self.query_counts[name][rows] = queries
+            view_ceiling = VIEW_LATENCY_CEILINGS.get(name, {}).get(rows, ceiling) * options['latency_factor']
+            latency = statistics.median(durations)
+            problems = []
+            # Every view should render for a superuser, without redirecting to the login page
+            if status >= 300:
+                problems.append(f'status {status}')
+            # Every write should be applied
+            if error:
+                problems.append(f'error {error!r}')
+            if queries > budget:
+                problems.append(f'{queries} queries > budget {budget}')
+            if latency > view_ceiling:
+                problems.append(f'{latency * 1000:.0f}ms > ceiling {view_ceiling * 1000:.0f}ms')
+            line = f'{name:<26} {status} {queries:>4} queries {latency * 1000:>8.1f}ms  {url}'
+            if problems:
+                failures.append(f"{rows} rows: {name}: {', '.join(problems)}")
+                self.stdout.write(self.style.ERROR(f'FAIL  {line}  ({", ".join(problems)})'))
+            else:
+                self.stdout.write(f'OK    {line}')
+        return failures
+
+    def check_flat_query_counts(self):
+        """
+        Compares the query counts of every view across the dataset sizes. A count that
+        changes with the number of rows is a per-row query, even while it is still
+        within the budget, such as a report looping over the catalogue.
+
+        :return: A list of failure messages.
+        """
+        failures = []
+        for name, counts in self.query_counts.items():
+            if len(set(counts.values())) > 1:
+                growth = ', '.join(f'{queries} at {rows} rows' for rows, queries in sorted(counts.items()))
+                failures.append(f'{name}: query count changes with the dataset size ({growth})')
+                self.stdout.write(self.style.ERROR(f'FAIL  {name} query count is not flat: {growth}'))
+        return failures
+
+    def measure(self, client, url, repeat, payload=None):
+        """
+        Requests a URL with a cold cache and returns its query count, the durations of
+        `repeat` timed requests, the response status and the error reported by the last
+        write, if any. A first untimed request warms up templates and URL resolution.
+        URLs with a payload are posted to, with a new payload per request.
+        """
+        self.request(client, url, payload)
+        durations = []
+        queries = error = None
+        for attempt in range(max(repeat, 1)):
+            cache.clear()
+            data = payload() if payload else None
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                status, error = self.request(client, url, data)
+                durations.append(time.perf_counter() - start)
+            if queries is None:
+                queries = len(captured)
+        return queries, durations, status, error
+
+    def request(self, client, url, data=None):
+        if callable(data):
+            data = data()
+        if data is None:
+            response = client.get(url)
+        else:
+            body, content_type = data
+            if content_type:
+                response = client.post(url, body, content_type=content_type)
+            else:
+                response = client.post(url, body)
+        # Streamed exports only run their queries while the body is consumed
+        if response.streaming:
+            for chunk in response.streaming_content:
+                pass
+        response.close()
+        # The write views answer with JSON reporting whether the write was applied
+        error = None
+        if data is not None and response.get('Content-Type', '').startswith('application/json'):
+            result = response.json()
+            if not result.get('success'):
+                error = result.get('error') or 'form errors'
+        return response.status_code, error
@@ -0,0 +1,74 @@
+import re
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from inventory.models import StockHistory, IssuedOutHistory, Quantity, DailyStockMovement
+
+
+def hot_queries():
+    """
+    Returns the query shapes the reports, detail endpoints and lists rely on, as
+    (name, queryset) pairs. The parameter values do not matter for the plan.
+    """
+    today = date.today()
+    now = timezone.now()
+    return [
+        ('latest cost of an item',
+         StockHistory.objects.filter(item_id=1).order_by('-date_added', '-id')[:1]),
+        ('stock history of an item by date',
+         StockHistory.objects.filter(item_id=1, date_added__gte=today - timedelta(days=30))),
+        ('department deliveries by date',
+         StockHistory.objects.filter(department_id=1, date_added__gte=today - timedelta(days=30))),
+        ('delivery details',
+         StockHistory.objects.filter(delivery_number='DN-1')),
+        ('LPO details',
+         StockHistory.objects.filter(lpo='LPO-1')),
+        ('engraved stock by engraved number',
+         StockHistory.objects.filter(engraved_number='SN-1')),
+        ('unissued engraved numbers of an item',
+         StockHistory.objects.filter(item_id=1, issued=False).values_list('engraved_number', flat=True)),
+        ('quantity of an item in a department',
+         Quantity.objects.filter(item_id=1, department_id=1)),
+        ('stock expiring soon',
+         Quantity.objects.filter(expiry_date__lte=today + timedelta(days=30))),
+        ('stock depreciating soon',
+         Quantity.objects.filter(depreciation_date__lte=today + timedelta(days=30))),
+        ('department issues by date',
+         IssuedOutHistory.objects.filter(department_id=1, date__gte=now - timedelta(days=30))),
+        ('issue voucher details',
+         IssuedOutHistory.objects.filter(issue_voucher_number='IVN-1')),
+        ('issued quantity of an item up to a date',
+         IssuedOutHistory.objects.filter(item_id=1, date__lte=now)),
+        ('issued-out list keyset page',
+         IssuedOutHistory.objects.filter(date__lt=now).order_by('-date', '-id')[:21]),
+        ('department stock movement by date',
+         DailyStockMovement.objects.filter(department_id=1).order_by('date')),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs EXPLAIN on the hot report, detail and list queries and fails if any of them "
+        "scans a whole table instead of using an index. Only enforced on SQLite."
+    )
+
+    def handle(self, *args, **options):
+        failures = []
+        for name, queryset in hot_queries():
+            plan = queryset.explain()
+            # SQLite reports full table scans as "SCAN <table>" without an index
+            full_scans = [line for line in plan.splitlines()
+                          if re.search(r'\bSCAN \w+$', line.strip()) and 'USING' not in line]
+            if connection.vendor == 'sqlite' and full_scans:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f'FULL SCAN  {name}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'OK         {name}'))
+            if options['verbosity'] > 1:
+                self.stdout.write(plan)
+
+        if failures:
+            raise CommandError(f"{len(failures)} hot queries do not use an index: {', '.join(failures)}")
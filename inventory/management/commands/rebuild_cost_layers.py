@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from inventory.cache import bump_data_version
+from inventory.models import CostLayer, ItemCostSnapshot, InventoryItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the cost layers, the moving average costs of the holdings and the costs "
+        "of the issued-out records by replaying the stock history. Run it after importing "
+        "or editing data outside the application."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--item', type=int, nargs='+', dest='items',
+                            help='IDs of the inventory items to rebuild; all items by default.')
+
+    def handle(self, *args, **options):
+        item_ids = options['items']
+        count = CostLayer.rebuild(item_ids)
+        if item_ids is None:
+            item_ids = InventoryItem.objects.values_list('id', flat=True)
+        ItemCostSnapshot.refresh_for_items(item_ids)
+        bump_data_version()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} cost layers.'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.models import StockLedgerEntry
+
+
+class Command(BaseCommand):
+    help = (
+        "Verifies the quantity of every holding against the stock ledger and rebuilds the "
+        "quantities that drifted from it. Run it with --check to only report discrepancies."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report discrepancies, and exit with an error if there are any.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of records read or written per query.')
+
+    def handle(self, *args, **options):
+        discrepancies = StockLedgerEntry.reconcile(apply=not options['check'], batch_size=options['batch_size'])
+        for item_id, department_id, recorded, balance in discrepancies:
+            note = ' (negative balance, cannot be applied)' if balance < 0 else ''
+            self.stdout.write(f'item {item_id}, department {department_id}: '
+                              f'quantity {recorded}, ledger {balance}{note}')
+
+        if options['check']:
+            if discrepancies:
+                raise CommandError(f'{len(discrepancies)} quantities differ from the stock ledger.')
+            self.stdout.write(self.style.SUCCESS('All quantities match the stock ledger.'))
+            return
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(discrepancies)} quantities from the stock ledger.'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from inventory.cache import bump_data_version
+from inventory.models import DailyStockMovement
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the daily stock movement rollup from the stock history and issued-out "
+        "history. Run it after importing or editing data outside the application."
+    )
+
+    def handle(self, *args, **options):
+        count = DailyStockMovement.rebuild()
+        bump_data_version()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} daily stock movement rows.'))
@@ -0,0 +1,60 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from inventory.jobs import claim_report_jobs, run_report_job
+from inventory.models import ReportJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the background report worker: picks up pending report jobs and generates "
+        "them in a pool of worker processes, so heavy reports never block web workers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1),
+                            help='Number of worker processes generating reports in parallel.')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait between two looks at the queue when it is idle.')
+        parser.add_argument('--once', action='store_true',
+                            help='Process the jobs pending now and exit instead of running forever.')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        # Worker processes are spawned fresh and set Django up themselves, so they never
+        # share a database connection with this process
+        context = multiprocessing.get_context('spawn')
+        self.stdout.write(f'Report worker started with {workers} processes.')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=django.setup) as pool:
+            running = {}
+            while True:
+                for job_id in claim_report_jobs(workers - len(running)):
+                    running[pool.submit(run_report_job, job_id)] = job_id
+                    self.stdout.write(f'Job {job_id} started.')
+                if not running:
+                    if options['once']:
+                        break
+                    connections.close_all()
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                done, _ = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        status = future.result()
+                    except Exception as error:
+                        # The worker process itself died; record the failure on its behalf
+                        ReportJob.objects.filter(pk=job_id).update(
+                            status=ReportJob.FAILED, error=str(error) or error.__class__.__name__,
+                            finished_at=timezone.now()
+                        )
+                        status = ReportJob.FAILED
+                    self.stdout.write(f'Job {job_id} {status}.')
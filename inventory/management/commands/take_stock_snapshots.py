@@ -0,0 +1,60 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from inventory.models import DailyStockMovement, StockSnapshot
+
+
+def month_ends(first, last):
+    """
+    Returns the last day of every month from the month of `first` up to `last`.
+
+    :param first: A day in the first month.
+    :param last: The latest day to return.
+    :return: A list of dates in ascending order.
+    """
+    days = []
+    month = first.replace(day=1)
+    while True:
+        following = (month + timedelta(days=32)).replace(day=1)
+        end = following - timedelta(days=1)
+        if end > last:
+            return days
+        days.append(end)
+        month = following
+
+
+class Command(BaseCommand):
+    help = (
+        "Takes point-in-time snapshots of the quantity every department holds of every "
+        "item. By default the snapshot of the last day of the previous month is taken; "
+        "schedule it monthly so balances on any past day are computed from one snapshot "
+        "and at most a month of stock movements."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, nargs='+', dest='dates',
+                            help='Days to take snapshots of, as YYYY-MM-DD.')
+        parser.add_argument('--backfill', action='store_true',
+                            help='Take the missing snapshot of every month end since the first stock movement.')
+
+    def handle(self, *args, **options):
+        last_month_end = timezone.localdate().replace(day=1) - timedelta(days=1)
+        if options['dates']:
+            days = sorted(set(options['dates']))
+            if days[-1] >= timezone.localdate():
+                raise CommandError('Snapshots can only be taken of days that have ended.')
+        elif options['backfill']:
+            first = DailyStockMovement.objects.aggregate(first=Min('date'))['first']
+            taken = set(StockSnapshot.objects.values_list('date', flat=True).distinct())
+            days = [day for day in month_ends(first, last_month_end) if day not in taken] if first else []
+        else:
+            days = [last_month_end]
+
+        # Take the snapshots in date order, each building on the previous one
+        for day in days:
+            count = StockSnapshot.take(day)
+            self.stdout.write(f'{day}: {count} balances')
+        self.stdout.write(self.style.SUCCESS(f'Took {len(days)} stock snapshots.'))
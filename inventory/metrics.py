@@ -0,0 +1,273 @@
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import FileResponse
+
+logger = logging.getLogger('inventory.metrics')
+
+# Upper bounds in seconds of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Placeholder lists of varying length, such as IN (%s, %s, %s), collapse into one fingerprint
+_PLACEHOLDER_LIST = re.compile(r'\((?:%s|\?)(?:,\s*(?:%s|\?))+\)')
+
+
+def query_fingerprint(sql):
+    """
+    Reduces an SQL statement to the shape shared by every execution of the same query.
+
+    Django passes parameters separately from the statement, so only placeholder lists
+    of varying length, such as those of `__in` lookups, need to be normalized.
+
+    :param sql: The SQL statement with parameter placeholders.
+    :return: The fingerprint as a string.
+    """
+    return _PLACEHOLDER_LIST.sub('(...)', sql)
+
+
+class QueryRecorder:
+    """
+    A database execute wrapper counting and timing the queries of one request and
+    counting how often each query fingerprint is executed.
+
+    :ivar count: The number of queries executed.
+    :ivar duration: The total time spent in the database, in seconds.
+    :ivar fingerprints: A Counter of executions per SQL statement.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[sql] += 1
+
+    def repeated(self):
+        """
+        Groups the executed statements by fingerprint.
+
+        :return: A tuple of the number of queries repeating an already executed
+            fingerprint, and a Counter of executions per fingerprint.
+        """
+        grouped = Counter()
+        for sql, count in self.fingerprints.items():
+            grouped[query_fingerprint(sql)] += count
+        return sum(count - 1 for count in grouped.values()), grouped
+
+
+class MetricsRegistry:
+    """
+    Accumulates request metrics per view in memory for the `/metrics` endpoint.
+
+    The registry is per process; with several server processes each one reports its
+    own counters, which Prometheus aggregates across scrape targets.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def observe(self, view, method, status, duration, db_duration, queries, duplicates):
+        """
+        Records one request.
+
+        :param view: The name of the view that handled the request.
+        :param method: The HTTP method of the request.
+        :param status: The HTTP status code of the response.
+        :param duration: The wall time of the request in seconds.
+        :param db_duration: The time spent in the database in seconds.
+        :param queries: The number of queries executed.
+        :param duplicates: The number of queries repeating an already executed fingerprint.
+        """
+        with self._lock:
+            stats = self._views.get(view)
+            if stats is None:
+                stats = self._views[view] = {
+                    'requests': Counter(),
+                    'buckets': [0] * len(DURATION_BUCKETS),
+                    'duration': 0.0,
+                    'db_duration': 0.0,
+                    'queries': 0,
+                    'duplicates': 0,
+                    'count': 0,
+                }
+            stats['requests'][(method, status)] += 1
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    stats['buckets'][index] += 1
+            stats['duration'] += duration
+            stats['db_duration'] += db_duration
+            stats['queries'] += queries
+            stats['duplicates'] += duplicates
+            stats['count'] += 1
+
+    def render(self):
+        """
+        Renders the accumulated metrics in the Prometheus text exposition format.
+
+        :return: The metrics as a string.
+        """
+        with self._lock:
+            views = {view: {**stats, 'requests': Counter(stats['requests']), 'buckets': list(stats['buckets'])}
+                     for view, stats in self._views.items()}
+
+        lines = [
+            '# HELP inventory_http_requests_total Requests handled per view, method and status.',
+            '# TYPE inventory_http_requests_total counter',
+        ]
+        for view, stats in sorted(views.items()):
+            for (method, status), count in sorted(stats['requests'].items()):
+                lines.append(f'inventory_http_requests_total{{view="{_label(view)}",method="{method}",status="{status}"}} {count}')
+
+        lines += [
+            '# HELP inventory_http_request_duration_seconds Wall time of requests per view.',
+            '# TYPE inventory_http_request_duration_seconds histogram',
+        ]
+        for view, stats in sorted(views.items()):
+            label = _label(view)
+            for bound, count in zip(DURATION_BUCKETS, stats['buckets']):
+                lines.append(f'inventory_http_request_duration_seconds_bucket{{view="{label}",le="{bound}"}} {count}')
+            lines.append(f'inventory_http_request_duration_seconds_bucket{{view="{label}",le="+Inf"}} {stats["count"]}')
+            lines.append(f'inventory_http_request_duration_seconds_sum{{view="{label}"}} {stats["duration"]:.6f}')
+            lines.append(f'inventory_http_request_duration_seconds_count{{view="{label}"}} {stats["count"]}')
+
+        for name, key, help_text, fmt in (
+            ('inventory_db_duration_seconds_total', 'db_duration', 'Time spent in database queries per view.', '.6f'),
+            ('inventory_db_queries_total', 'queries', 'Database queries executed per view.', 'd'),
+            ('inventory_db_duplicate_queries_total', 'duplicates',
+             'Queries repeating a fingerprint already executed in the same request, per view.', 'd'),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for view, stats in sorted(views.items()):
+                lines.append(f'{name}{{view="{_label(view)}"}} {stats[key]:{fmt}}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """
+        Forgets every recorded request.
+        """
+        with self._lock:
+            self._views.clear()
+
+
+def _label(value):
+    # Escape a Prometheus label value
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+class RequestMetricsMiddleware:
+    """
+    Records the wall time, database time, query count and repeated query fingerprints
+    of every request handled by a view.
+
+    Each request is logged as one JSON line on the `inventory.metrics` logger, added to
+    the per-view counters served by the `metrics` view, and reported to the browser in
+    a `Server-Timing` header, where the network panel of the developer tools shows it.
+    Requests repeating a query fingerprint at least `INVENTORY_DUPLICATE_QUERY_THRESHOLD`
+    times are logged as warnings with the offending fingerprints.
+
+    Queries are observed through database execute wrappers, which work with DEBUG off
+    and add only a timer and a counter increment per query. Streamed responses are
+    observed until their body has been sent.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.duplicate_threshold = getattr(settings, 'INVENTORY_DUPLICATE_QUERY_THRESHOLD', 5)
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with self.recording(recorder):
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        view = match.view_name if match and match.view_name else 'unresolved'
+        if view == 'metrics':
+            return response
+
+        # Streamed exports run their queries while the body is sent, after get_response
+        # returns, so they are recorded once the stream is exhausted or closed. Files are
+        # left alone so servers can still send them with wsgi.file_wrapper.
+        if response.streaming and not response.is_async and not isinstance(response, FileResponse):
+            response.streaming_content = self.stream(response.streaming_content, request, view, response,
+                                                     recorder, start)
+            return response
+
+        duration = time.perf_counter() - start
+        self.record(request, view, response, recorder, duration)
+        response['Server-Timing'] = (
+            f'app;dur={duration * 1000:.1f}, db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries"'
+        )
+        return response
+
+    @staticmethod
+    def recording(recorder):
+        # Wrap the connections of the current thread with the recorder until the context exits
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        return stack
+
+    def stream(self, content, request, view, response, recorder, start):
+        """
+        Yields the chunks of a streamed response while recording its queries.
+
+        The `Server-Timing` header is sent before the body, so streamed responses do not
+        get one; their totals are only logged and added to the registry.
+        """
+        try:
+            with self.recording(recorder):
+                yield from content
+        finally:
+            self.record(request, view, response, recorder, time.perf_counter() - start, streamed=True)
+
+    def record(self, request, view, response, recorder, duration, streamed=False):
+        """
+        Logs one request and adds it to the registry.
+
+        :param request: The HTTP request.
+        :param view: The name of the view that handled the request.
+        :param response: The response returned by the view.
+        :param recorder: The QueryRecorder of the request.
+        :param duration: The wall time of the request in seconds, including the streamed
+            body of streaming responses.
+        :param streamed: Whether the response body was streamed.
+        """
+        repeated, grouped = recorder.repeated()
+        duplicates = [(fingerprint, count) for fingerprint, count in grouped.most_common()
+                      if count >= self.duplicate_threshold]
+        registry.observe(view, request.method, response.status_code, duration, recorder.duration,
+                         recorder.count, repeated)
+
+        record = {
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'db_ms': round(recorder.duration * 1000, 2),
+            'queries': recorder.count,
+            'repeated_queries': repeated,
+        }
+        if streamed:
+            record['streamed'] = True
+        if duplicates:
+            record['duplicates'] = [{'count': count, 'sql': fingerprint[:300]} for fingerprint, count in duplicates[:5]]
+            logger.warning(json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.7 on 2026-10-18 13:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_cost_snapshots(apps, schema_editor):
+    StockHistory = apps.get_model('inventory', 'StockHistory')
+    ItemCostSnapshot = apps.get_model('inventory', 'ItemCostSnapshot')
+    latest = {}
+    for stock in StockHistory.objects.order_by('item_id', 'date_added', 'id').values('id', 'item_id', 'unit_cost', 'date_added').iterator():
+        latest[stock['item_id']] = stock
+    ItemCostSnapshot.objects.bulk_create([
+        ItemCostSnapshot(item_id=item_id, stock_id=stock['id'], unit_cost=stock['unit_cost'], date_purchased=stock['date_added'])
+        for item_id, stock in latest.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemCostSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unit_cost', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('date_purchased', models.DateField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='cost_snapshot', to='inventory.inventoryitem')),
+                ('stock', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='inventory.stockhistory')),
+            ],
+        ),
+        migrations.RunPython(backfill_cost_snapshots, migrations.RunPython.noop),
+    ]
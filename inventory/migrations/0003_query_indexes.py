@@ -0,0 +1,67 @@
+# Generated by Django 5.0.7 on 2026-10-18 13:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0002_itemcostsnapshot'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='issuedouthistory',
+            index=models.Index(fields=['date', 'id'], name='issued_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='issuedouthistory',
+            index=models.Index(fields=['department', 'date'], name='issued_department_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='issuedouthistory',
+            index=models.Index(fields=['item', 'date'], name='issued_item_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='issuedouthistory',
+            index=models.Index(fields=['issue_voucher_number', 'date'], name='issued_voucher_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quantity',
+            index=models.Index(fields=['item', 'department'], name='quantity_item_department_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quantity',
+            index=models.Index(condition=models.Q(('expiry_date__isnull', False)), fields=['expiry_date'], name='quantity_expiry_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quantity',
+            index=models.Index(condition=models.Q(('depreciation_date__isnull', False)), fields=['depreciation_date'], name='quantity_depreciation_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockhistory',
+            index=models.Index(fields=['item', 'date_added', 'id'], name='stock_item_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockhistory',
+            index=models.Index(fields=['department', 'date_added'], name='stock_department_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockhistory',
+            index=models.Index(fields=['delivery_number'], name='stock_delivery_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockhistory',
+            index=models.Index(fields=['lpo'], name='stock_lpo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockhistory',
+            index=models.Index(condition=models.Q(('engraved_number__isnull', False)), fields=['engraved_number'], name='stock_engraved_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockhistory',
+            index=models.Index(condition=models.Q(('issued', False)), fields=['item', 'engraved_number'], name='stock_unissued_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.0.7 on 2026-10-18 13:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_daily_stock_movements(apps, schema_editor):
+    StockHistory = apps.get_model('inventory', 'StockHistory')
+    IssuedOutHistory = apps.get_model('inventory', 'IssuedOutHistory')
+    DailyStockMovement = apps.get_model('inventory', 'DailyStockMovement')
+    totals = {}
+    added = StockHistory.objects.exclude(date_added=None).values_list('date_added', 'item_id', 'department_id').annotate(
+        quantity=Sum('quantity'), value=Sum('total_cost')).order_by()
+    for day, item_id, department_id, quantity, value in added.iterator():
+        totals[(day, item_id, department_id)] = [quantity, value, 0]
+    issued = IssuedOutHistory.objects.values_list(TruncDate('date'), 'item_id', 'department_id').annotate(
+        quantity=Sum('quantity_issued_out')).order_by()
+    for day, item_id, department_id, quantity in issued.iterator():
+        totals.setdefault((day, item_id, department_id), [0, 0, 0])[2] = quantity
+    DailyStockMovement.objects.bulk_create([
+        DailyStockMovement(date=day, item_id=item_id, department_id=department_id,
+                           quantity_added=quantity_added, value_added=value_added, quantity_issued=quantity_issued)
+        for (day, item_id, department_id), (quantity_added, value_added, quantity_issued) in totals.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0003_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('quantity_added', models.PositiveIntegerField(default=0)),
+                ('value_added', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('quantity_issued', models.PositiveIntegerField(default=0)),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inventory.staffdepartment')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inventory.inventoryitem')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['department', 'date'], name='daily_movement_department_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailystockmovement',
+            constraint=models.UniqueConstraint(fields=('date', 'item', 'department'), name='daily_movement_unique'),
+        ),
+        migrations.RunPython(backfill_daily_stock_movements, migrations.RunPython.noop),
+    ]
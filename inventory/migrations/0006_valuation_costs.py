@@ -0,0 +1,69 @@
+# Generated by Django 5.0.7 on 2026-10-18 14:11
+
+from decimal import Decimal, ROUND_HALF_UP
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def item_costs(receipts, on_hand):
+    # Latest, weighted average and FIFO unit cost of an item from its receipts, newest first
+    latest = None
+    received, received_cost = 0, Decimal(0)
+    remaining, layered, layered_cost = max(on_hand, 0), 0, Decimal(0)
+    for quantity, cost in receipts:
+        if latest is None:
+            latest = cost
+        received += quantity
+        received_cost += quantity * cost
+        taken = min(quantity, remaining)
+        remaining -= taken
+        layered += taken
+        layered_cost += taken * cost
+    cent = Decimal('0.01')
+    return {
+        'latest': latest,
+        'average': (received_cost / received).quantize(cent, ROUND_HALF_UP) if received else latest,
+        'fifo': (layered_cost / layered).quantize(cent, ROUND_HALF_UP) if layered else latest,
+    }
+
+
+def backfill_valuation_costs(apps, schema_editor):
+    StockHistory = apps.get_model('inventory', 'StockHistory')
+    Quantity = apps.get_model('inventory', 'Quantity')
+    ItemCostSnapshot = apps.get_model('inventory', 'ItemCostSnapshot')
+    on_hand = dict(Quantity.objects.values('item_id').annotate(total=Sum('quantity')).order_by()
+                   .values_list('item_id', 'total'))
+    snapshots = {snapshot.item_id: snapshot for snapshot in ItemCostSnapshot.objects.all()}
+    stock = StockHistory.objects.order_by('item_id', '-date_added', '-id').values_list('item_id', 'quantity', 'unit_cost')
+    for item_id, rows in groupby(stock.iterator(chunk_size=2000), key=itemgetter(0)):
+        snapshot = snapshots.get(item_id)
+        if snapshot is None:
+            continue
+        costs = item_costs([(quantity, cost) for _, quantity, cost in rows], on_hand.get(item_id) or 0)
+        snapshot.average_cost = costs['average']
+        snapshot.fifo_cost = costs['fifo']
+    ItemCostSnapshot.objects.bulk_update(snapshots.values(), ['average_cost', 'fifo_cost'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0005_reportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemcostsnapshot',
+            name='average_cost',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='itemcostsnapshot',
+            name='fifo_cost',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.RunPython(backfill_valuation_costs, migrations.RunPython.noop),
+    ]
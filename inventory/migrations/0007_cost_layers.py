@@ -0,0 +1,163 @@
+# Generated by Django 5.0.7 on 2026-10-18 14:16
+
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, Sum
+from django.utils import timezone
+
+CENT = Decimal('0.01')
+
+
+def moving_average(quantity, average, received, cost):
+    # Moving average unit cost of a holding after a receipt
+    quantity = max(quantity, 0)
+    if quantity + received <= 0:
+        return Decimal(average)
+    return (quantity * Decimal(average) + received * Decimal(cost)) / (quantity + received)
+
+
+def consume_layers(layers, quantity, stock_id=None):
+    # Cost of issuing units from the layers oldest first, or from the layer of an engraved unit;
+    # units beyond the open layers are costed at the newest layer
+    cost = Decimal(0)
+    if stock_id is not None:
+        candidates = [layer for layer in layers if layer['stock_id'] == stock_id and layer['remaining'] > 0]
+        candidates += [layer for layer in layers if layer['stock_id'] != stock_id]
+    else:
+        candidates = layers
+    for layer in candidates:
+        if quantity <= 0:
+            break
+        taken = min(layer['remaining'], quantity)
+        if taken <= 0:
+            continue
+        layer['remaining'] -= taken
+        quantity -= taken
+        cost += taken * layer['unit_cost']
+    if quantity > 0 and layers:
+        cost += quantity * layers[-1]['unit_cost']
+    return cost.quantize(CENT, ROUND_HALF_UP)
+
+
+def replay_costs(receipts, issues):
+    # Replays the history of every holding in date order, receipts before the issues of the
+    # same day, into the remaining units per receipt, the costs per issue and the averages
+    events = defaultdict(list)
+    engraved_units = {}
+    for stock_id, item_id, department_id, day, quantity, cost, engraved_number in receipts:
+        events[(item_id, department_id)].append((day, 0, stock_id, quantity, Decimal(cost)))
+        if engraved_number:
+            engraved_units[(item_id, engraved_number)] = stock_id
+    for issue_id, item_id, department_id, day, quantity, engraved_number in issues:
+        stock_id = engraved_units.get((item_id, engraved_number)) if engraved_number else None
+        events[(item_id, department_id)].append((day, 1, issue_id, quantity, stock_id))
+
+    remaining = {}
+    issue_costs = {}
+    averages = {}
+    for holding, holding_events in events.items():
+        layers = []
+        held = 0
+        average = Decimal(0)
+        for day, kind, record_id, quantity, detail in sorted(holding_events, key=lambda event: event[:3]):
+            if kind == 0:
+                average = moving_average(held, average, quantity, detail)
+                held += quantity
+                layers.append({'stock_id': record_id, 'remaining': quantity, 'unit_cost': detail})
+            else:
+                fifo_cost = consume_layers(layers, quantity, detail)
+                issue_costs[record_id] = (fifo_cost, (quantity * average).quantize(CENT, ROUND_HALF_UP))
+                held = max(held - quantity, 0)
+        remaining.update((layer['stock_id'], layer['remaining']) for layer in layers)
+        averages[holding] = average
+    return remaining, issue_costs, averages
+
+
+def backfill_cost_layers(apps, schema_editor):
+    StockHistory = apps.get_model('inventory', 'StockHistory')
+    IssuedOutHistory = apps.get_model('inventory', 'IssuedOutHistory')
+    Quantity = apps.get_model('inventory', 'Quantity')
+    CostLayer = apps.get_model('inventory', 'CostLayer')
+    ItemCostSnapshot = apps.get_model('inventory', 'ItemCostSnapshot')
+    receipts = list(StockHistory.objects.exclude(date_added=None).values_list(
+        'id', 'item_id', 'department_id', 'date_added', 'quantity', 'unit_cost', 'engraved_number').iterator())
+    issues = [
+        (issue_id, item_id, department_id, timezone.localtime(issued_at).date(), quantity, engraved_number)
+        for issue_id, item_id, department_id, issued_at, quantity, engraved_number in IssuedOutHistory.objects.values_list(
+            'id', 'item_id', 'department_id', 'date', 'quantity_issued_out', 'engraved_number').iterator()
+    ]
+    remaining, issue_costs, averages = replay_costs(receipts, issues)
+
+    CostLayer.objects.bulk_create([
+        CostLayer(stock_id=stock_id, item_id=item_id, department_id=department_id, date_added=day,
+                  quantity=quantity, remaining=remaining[stock_id], unit_cost=cost)
+        for stock_id, item_id, department_id, day, quantity, cost, _ in receipts
+    ], batch_size=1000)
+    IssuedOutHistory.objects.bulk_update([
+        IssuedOutHistory(id=issue_id, fifo_cost=fifo_cost, average_cost=average_cost)
+        for issue_id, (fifo_cost, average_cost) in issue_costs.items()
+    ], ['fifo_cost', 'average_cost'], batch_size=100)
+    entries = list(Quantity.objects.only('id', 'item_id', 'department_id'))
+    for entry in entries:
+        entry.average_cost = round(averages.get((entry.item_id, entry.department_id), 0), 4)
+    Quantity.objects.bulk_update(entries, ['average_cost'], batch_size=1000)
+
+    # Derive the item costs of the snapshots from the holdings and the open layers
+    def weighted(queryset, quantity_field, cost_field):
+        rows = queryset.order_by().values('item_id').annotate(
+            units=Sum(quantity_field), value=Sum(F(quantity_field) * F(cost_field), output_field=models.DecimalField())
+        ).values_list('item_id', 'units', 'value')
+        return {item_id: round(value / units, 2) for item_id, units, value in rows if units}
+
+    average_costs = weighted(Quantity.objects.filter(quantity__gt=0), 'quantity', 'average_cost')
+    fifo_costs = weighted(CostLayer.objects.filter(remaining__gt=0), 'remaining', 'unit_cost')
+    snapshots = list(ItemCostSnapshot.objects.all())
+    for snapshot in snapshots:
+        snapshot.average_cost = average_costs.get(snapshot.item_id, snapshot.unit_cost)
+        snapshot.fifo_cost = fifo_costs.get(snapshot.item_id, snapshot.unit_cost)
+    ItemCostSnapshot.objects.bulk_update(snapshots, ['average_cost', 'fifo_cost'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0006_valuation_costs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='issuedouthistory',
+            name='average_cost',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='issuedouthistory',
+            name='fifo_cost',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='quantity',
+            name='average_cost',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=14),
+        ),
+        migrations.CreateModel(
+            name='CostLayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_added', models.DateField()),
+                ('quantity', models.PositiveIntegerField()),
+                ('remaining', models.PositiveIntegerField()),
+                ('unit_cost', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inventory.staffdepartment')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inventory.inventoryitem')),
+                ('stock', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='cost_layer', to='inventory.stockhistory')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('remaining__gt', 0)), fields=['item', 'department', 'date_added', 'stock'], name='cost_layer_open_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_cost_layers, migrations.RunPython.noop),
+    ]
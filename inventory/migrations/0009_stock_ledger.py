@@ -0,0 +1,71 @@
+# Generated by Django 5.0.7 on 2026-10-18 14:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_stock_ledger(apps, schema_editor):
+    # Open the ledger with the receipts and issues recorded so far
+    StockHistory = apps.get_model('inventory', 'StockHistory')
+    IssuedOutHistory = apps.get_model('inventory', 'IssuedOutHistory')
+    Quantity = apps.get_model('inventory', 'Quantity')
+    StockLedgerEntry = apps.get_model('inventory', 'StockLedgerEntry')
+    StockLedgerEntry.objects.bulk_create((
+        StockLedgerEntry(item_id=item_id, department_id=department_id, change=quantity, kind='receipt', stock_id=pk)
+        for pk, item_id, department_id, quantity in StockHistory.objects.values_list(
+            'id', 'item_id', 'department_id', 'quantity').iterator(chunk_size=2000)
+    ), batch_size=1000)
+    StockLedgerEntry.objects.bulk_create((
+        StockLedgerEntry(item_id=item_id, department_id=department_id, change=-quantity, kind='issue', issue_id=pk)
+        for pk, item_id, department_id, quantity in IssuedOutHistory.objects.values_list(
+            'id', 'item_id', 'department_id', 'quantity_issued_out').iterator(chunk_size=2000)
+    ), batch_size=1000)
+
+    # The quantities are the balances in use, so where they drifted from the history the
+    # difference is recorded as an opening adjustment instead of becoming a lasting mismatch
+    balances = dict(((item_id, department_id), balance) for item_id, department_id, balance in (
+        StockLedgerEntry.objects.values_list('item_id', 'department_id').annotate(balance=models.Sum('change'))
+        .order_by()
+    ))
+    quantities = dict(((item_id, department_id), quantity) for item_id, department_id, quantity in (
+        Quantity.objects.values_list('item_id', 'department_id').annotate(quantity=models.Sum('quantity'))
+        .order_by()
+    ))
+    StockLedgerEntry.objects.bulk_create((
+        StockLedgerEntry(item_id=item_id, department_id=department_id, change=change, kind='adjustment',
+                         note='Opening balance: quantity recorded before the stock ledger')
+        for (item_id, department_id), change in (
+            (holding, quantities.get(holding, 0) - balances.get(holding, 0))
+            for holding in sorted(balances.keys() | quantities.keys())
+        )
+        if change
+    ), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0008_stock_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockLedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('change', models.IntegerField()),
+                ('kind', models.CharField(choices=[('receipt', 'Receipt'), ('issue', 'Issue'), ('adjustment', 'Adjustment')], max_length=10)),
+                ('note', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inventory.staffdepartment')),
+                ('issue', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='inventory.issuedouthistory')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inventory.inventoryitem')),
+                ('stock', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='inventory.stockhistory')),
+            ],
+            options={
+                'verbose_name_plural': 'stock ledger entries',
+                'indexes': [models.Index(fields=['item', 'department'], name='stock_ledger_holding_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_stock_ledger, migrations.RunPython.noop),
+    ]
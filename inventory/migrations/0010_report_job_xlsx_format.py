@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 15:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0009_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reportjob',
+            name='format',
+            field=models.CharField(choices=[('html', 'HTML'), ('csv', 'CSV'), ('xlsx', 'XLSX')], default='html', max_length=10),
+        ),
+    ]
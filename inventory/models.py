@@ -1,9 +1,36 @@
+from collections import defaultdict
 from datetime import date
 
 from django.utils import timezone
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models.functions import TruncDate
 
+from inventory.cache import bump_data_version
+from inventory.valuation import consume_layers, replay_costs
+
+
+
+def stock_condition(date_added):
+    """
+    Derives the condition of a stock item from the date it was added.
+
+    :param date_added: The date the stock item was added, or None if unknown.
+    :return: 'Newly Purchased' for stock younger than a year, 'Functional' for stock
+        younger than five years, 'Obsolete' otherwise and 'No Stock History' if the
+        date is unknown.
+    """
+    if date_added is None:
+        return 'No Stock History'
+    # Calculate the age of the stock item in days
+    age = (date.today() - date_added).days
+    # Determine the condition based on the age
+    if age < 365:
+        return 'Newly Purchased'
+    elif age < 1825:
+        return 'Functional'
+    else:
+        return 'Obsolete'
 
 
 class InventoryItem(models.Model):
@@ -104,6 +131,10 @@ class Quantity(models.Model):
     item quantities, depreciation, and expiration. It is used as a key component in inventory
     management systems to ensure reliable tracking of stock levels and associated details.
 
+    The quantity is a projection of the append-only `StockLedgerEntry` ledger, kept up to
+    date by the stock movement services and rebuilt from it by the `rebuild_quantities`
+    management command.
+
     :ivar item: The inventory item associated with this quantity.
     :type item: ForeignKey to InventoryItem
     :ivar department: The department associated with this quantity record.
@@ -116,14 +147,29 @@ class Quantity(models.Model):
     :type depreciation_date: DateField, optional
     :ivar engraved_number: An optional engraved identification number for the inventory item.
     :type engraved_number: CharField, optional
+    :ivar average_cost: The moving weighted average unit cost of the units held, updated
+        on every receipt.
+    :type average_cost: Decimal
     """
     item = models.ForeignKey(InventoryItem, on_delete=models.CASCADE)
     department = models.ForeignKey(StaffDepartment, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
+    average_cost = models.DecimalField(max_digits=14, decimal_places=4, default=0)
     expiry_date = models.DateField(null=True, blank=True)
     depreciation_date = models.DateField(null=True, blank=True)
     engraved_number = models.CharField(max_length=100, null=True, blank=True, verbose_name="Engraved Number")
 
+    class Meta:
+        indexes = [
+            # Quantity of an item held by a department
+            models.Index(fields=['item', 'department'], name='quantity_item_department_idx'),
+            # Expiring and depreciating stock
+            models.Index(fields=['expiry_date'], name='quantity_expiry_date_idx',
+                         condition=models.Q(expiry_date__isnull=False)),
+            models.Index(fields=['depreciation_date'], name='quantity_depreciation_idx',
+                         condition=models.Q(depreciation_date__isnull=False)),
+        ]
+
     def __str__(self):
         return f"{self.quantity}"
 
@@ -187,6 +233,19 @@ class StockHistory(models.Model):
             models.Index(fields=['item']),
             models.Index(fields=['department']),
             models.Index(fields=['date_added']),
+            # Latest cost per item and per-item history ordered by date
+            models.Index(fields=['item', 'date_added', 'id'], name='stock_item_date_idx'),
+            # Department reports filtered and grouped by date
+            models.Index(fields=['department', 'date_added'], name='stock_department_date_idx'),
+            # Delivery and LPO detail endpoints
+            models.Index(fields=['delivery_number'], name='stock_delivery_number_idx'),
+            models.Index(fields=['lpo'], name='stock_lpo_idx'),
+            # Engraved stock issued out by its engraved number
+            models.Index(fields=['engraved_number'], name='stock_engraved_number_idx',
+                         condition=models.Q(engraved_number__isnull=False)),
+            # Engraved numbers still available for issuing
+            models.Index(fields=['item', 'engraved_number'], name='stock_unissued_idx',
+                         condition=models.Q(issued=False)),
         ]
         constraints = [
             models.CheckConstraint(check=models.Q(quantity__gte=0), name='quantity_gte_0'),
@@ -205,15 +264,263 @@ class StockHistory(models.Model):
 
     @property
     def condition(self):
-        # Calculate the age of the stock item in days
-        age = (date.today() - self.date_added).days
-        # Determine the condition based on the age
-        if age < 365:
-            return 'Newly Purchased'
-        elif age < 1825:
-            return 'Functional'
-        else:
-            return 'Obsolete'
+        return stock_condition(self.date_added)
+
+
+class ItemCostSnapshot(models.Model):
+    """
+    Represents the current cost snapshot of an inventory item, derived from its most
+    recent stock history record.
+
+    This model materializes the "latest unit cost per item" lookup so that reports and
+    issued-out records can read the current cost, purchase date and condition of an item
+    without querying the stock history. It also holds the item's weighted average and FIFO
+    unit costs over all departments, derived from the holdings and their open cost
+    layers. It is kept in sync by the stock history, issued-out and quantity signal
+    handlers in `inventory.signals` and should not be edited by hand.
+
+    :ivar item: The inventory item this snapshot describes.
+    :type item: OneToOneField to InventoryItem
+    :ivar stock: The stock history record the snapshot was taken from.
+    :type stock: ForeignKey to StockHistory
+    :ivar unit_cost: The unit cost of the latest stock history record.
+    :type unit_cost: Decimal
+    :ivar average_cost: The moving average unit cost of the units on hand.
+    :type average_cost: Decimal
+    :ivar fifo_cost: The unit cost of the units left in open cost layers.
+    :type fifo_cost: Decimal
+    :ivar date_purchased: The date the latest stock history record was added.
+    :type date_purchased: date or None
+    :ivar updated_at: Timestamp of the last refresh of the snapshot.
+    :type updated_at: datetime
+    """
+    item = models.OneToOneField(InventoryItem, on_delete=models.CASCADE, related_name='cost_snapshot')
+    stock = models.ForeignKey(StockHistory, on_delete=models.SET_NULL, null=True, related_name='+')
+    unit_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    average_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    fifo_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    date_purchased = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.item_id} - {self.unit_cost} - {self.date_purchased}"
+
+    @property
+    def condition(self):
+        return stock_condition(self.date_purchased)
+
+    @classmethod
+    def refresh_for_items(cls, item_ids):
+        """
+        Recomputes the snapshots of the given items from their latest stock history
+        records, their holdings and their open cost layers. Items without any stock
+        history lose their snapshot.
+
+        :param item_ids: Iterable of inventory item IDs to refresh.
+        """
+        item_ids = set(item_ids)
+        if not item_ids:
+            return
+        # Resolve the latest stock history row of every item in a single correlated subquery
+        latest_stock = StockHistory.objects.filter(item=models.OuterRef('pk')).order_by('-date_added', '-id')
+        latest_ids = InventoryItem.objects.filter(id__in=item_ids).annotate(
+            latest_stock_id=models.Subquery(latest_stock.values('id')[:1])
+        ).exclude(latest_stock_id=None).values_list('latest_stock_id', flat=True)
+        latest = {
+            stock['item_id']: stock
+            for stock in StockHistory.objects.filter(id__in=list(latest_ids)).values('id', 'item_id', 'unit_cost', 'date_added')
+        }
+
+        # Weigh the moving average costs of the holdings and the costs of the open layers, one GROUP BY query each
+        average_costs = _weighted_costs(Quantity.objects.filter(item_id__in=item_ids, quantity__gt=0),
+                                        'quantity', 'average_cost')
+        fifo_costs = _weighted_costs(CostLayer.objects.filter(item_id__in=item_ids, remaining__gt=0),
+                                     'remaining', 'unit_cost')
+
+        cls.objects.filter(item_id__in=item_ids - latest.keys()).delete()
+        # Upsert every snapshot at once instead of one update_or_create per item
+        cls.objects.bulk_create([
+            cls(item_id=item_id, stock_id=stock['id'], unit_cost=stock['unit_cost'],
+                average_cost=average_costs.get(item_id, stock['unit_cost']),
+                fifo_cost=fifo_costs.get(item_id, stock['unit_cost']), date_purchased=stock['date_added'])
+            for item_id, stock in latest.items()
+        ], batch_size=1000, update_conflicts=True, unique_fields=['item'],
+            update_fields=['stock', 'unit_cost', 'average_cost', 'fifo_cost', 'date_purchased', 'updated_at'])
+
+
+def _weighted_costs(queryset, quantity_field, cost_field):
+    # Average a unit cost per item, weighted by a quantity, in one GROUP BY query
+    rows = queryset.order_by().values('item_id').annotate(
+        units=models.Sum(quantity_field),
+        value=models.Sum(models.F(quantity_field) * models.F(cost_field), output_field=models.DecimalField()),
+    ).values_list('item_id', 'units', 'value')
+    return {item_id: round(value / units, 2) for item_id, units, value in rows if units}
+
+
+# Number of items whose history `CostLayer.rebuild` replays at a time
+COST_REBUILD_ITEMS = 200
+
+
+def _write_issue_costs(issue_costs):
+    # Every issue gets its own costs, which bulk_update would compile into one CASE
+    # expression per batch at a large cost in Python; a parameterized UPDATE run with
+    # executemany writes them in a fraction of the time
+    table = connection.ops.quote_name(IssuedOutHistory._meta.db_table)
+    adapt = connection.ops.adapt_decimalfield_value
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'UPDATE {table} SET fifo_cost = %s, average_cost = %s WHERE id = %s',
+            [(adapt(fifo_cost, 14, 2), adapt(average_cost, 14, 2), issue_id)
+             for issue_id, (fifo_cost, average_cost) in issue_costs.items()],
+        )
+
+
+class CostLayer(models.Model):
+    """
+    Represents the units of one stock intake that are still held, at their unit cost.
+
+    Every stock history record opens a layer holding its quantity. Issues consume the
+    layers of their holding oldest first, or the layer of the engraved unit issued, and
+    record the cost of the consumed units on the issued-out record. Valuing the stock on
+    hand or the cost of goods issued therefore only reads the open layers and the issue
+    records, never the whole history. Layers are maintained by the stock movement
+    services and `CostLayer.rebuild`.
+
+    :ivar stock: The stock history record that opened the layer.
+    :type stock: OneToOneField to StockHistory
+    :ivar item: The inventory item of the layer.
+    :type item: ForeignKey to InventoryItem
+    :ivar department: The department holding the layer.
+    :type department: ForeignKey to StaffDepartment
+    :ivar date_added: The date of the intake, which orders the layers of a holding.
+    :type date_added: date
+    :ivar quantity: The number of units received.
+    :type quantity: int
+    :ivar remaining: The number of units not issued yet.
+    :type remaining: int
+    :ivar unit_cost: The unit cost of the intake.
+    :type unit_cost: Decimal
+    """
+    stock = models.OneToOneField(StockHistory, on_delete=models.CASCADE, related_name='cost_layer')
+    item = models.ForeignKey(InventoryItem, on_delete=models.CASCADE, related_name='+')
+    department = models.ForeignKey(StaffDepartment, on_delete=models.CASCADE, related_name='+')
+    date_added = models.DateField()
+    quantity = models.PositiveIntegerField()
+    remaining = models.PositiveIntegerField()
+    unit_cost = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            # Open layers of a holding, oldest first
+            models.Index(fields=['item', 'department', 'date_added', 'stock'], name='cost_layer_open_idx',
+                         condition=models.Q(remaining__gt=0)),
+        ]
+
+    def __str__(self):
+        return f"{self.item_id} - {self.remaining}/{self.quantity} at {self.unit_cost}"
+
+    @classmethod
+    def open_for(cls, stocks, batch_size=1000):
+        """
+        Opens a layer for each of the given stock history records.
+
+        :param stocks: Saved StockHistory records.
+        :param batch_size: The number of layers written per query.
+        """
+        cls.objects.bulk_create([
+            cls(stock_id=stock.pk, item_id=stock.item_id, department_id=stock.department_id,
+                date_added=stock.date_added, quantity=stock.quantity, remaining=stock.quantity,
+                unit_cost=stock.unit_cost)
+            for stock in stocks
+        ], batch_size=batch_size)
+
+    @classmethod
+    def consume(cls, issues, batch_size=1000):
+        """
+        Consumes the open layers of the given issues and returns their FIFO costs.
+
+        The open layers of every holding involved are read in one query and updated in
+        bulk. Must be called inside the transaction that decrements the quantities, which
+        serializes concurrent issues from the same holding.
+
+        :param issues: A list of (item_id, department_id, quantity, stock_id) tuples;
+            `stock_id` is the stock history record of an engraved unit, or None.
+        :param batch_size: The number of layers updated per query.
+        :return: A list of the FIFO costs of the issues, in the order given.
+        """
+        lookup = models.Q()
+        for item_id, department_id in {(item_id, department_id) for item_id, department_id, _, _ in issues}:
+            lookup |= models.Q(item_id=item_id, department_id=department_id)
+        layers = defaultdict(list)
+        for layer in cls.objects.filter(lookup, remaining__gt=0).order_by('date_added', 'stock_id').values(
+            'id', 'item_id', 'department_id', 'stock_id', 'remaining', 'unit_cost'
+        ):
+            layers[(layer['item_id'], layer['department_id'])].append(layer)
+
+        costs = []
+        changed = {}
+        for item_id, department_id, quantity, stock_id in issues:
+            cost, consumed = consume_layers(layers[(item_id, department_id)], quantity, stock_id)
+            costs.append(cost)
+            changed.update((layer['id'], layer) for layer in consumed)
+
+        cls.objects.bulk_update([cls(id=layer['id'], remaining=layer['remaining']) for layer in changed.values()],
+                                ['remaining'], batch_size=batch_size)
+        return costs
+
+    @classmethod
+    def rebuild(cls, item_ids=None, batch_size=1000):
+        """
+        Rebuilds the cost layers, the moving average costs of the holdings and the costs
+        of the issues of the given items by replaying their history in date order.
+
+        Day-to-day movements maintain the layers incrementally; this is meant for
+        existing data, bulk imports and repairs. The items are replayed
+        `COST_REBUILD_ITEMS` at a time, so memory use does not grow with the history.
+
+        :param item_ids: Optional iterable of inventory item IDs; all items by default.
+        :param batch_size: The number of records written per query.
+        :return: The number of layers written.
+        """
+        if item_ids is None:
+            item_ids = InventoryItem.objects.order_by('id').values_list('id', flat=True)
+        item_ids = list(item_ids)
+        count = 0
+        for offset in range(0, len(item_ids), COST_REBUILD_ITEMS):
+            with transaction.atomic():
+                count += cls._rebuild_items(item_ids[offset:offset + COST_REBUILD_ITEMS], batch_size)
+        return count
+
+    @classmethod
+    def _rebuild_items(cls, item_ids, batch_size):
+        # Replay the whole history of a batch of items, which holds every layer they consume
+        receipts = list(StockHistory.objects.filter(item_id__in=item_ids).exclude(date_added=None).values_list(
+            'id', 'item_id', 'department_id', 'date_added', 'quantity', 'unit_cost', 'engraved_number'
+        ))
+        issues = [
+            (issue_id, item_id, department_id, timezone.localtime(issued_at).date(), quantity, engraved_number)
+            for issue_id, item_id, department_id, issued_at, quantity, engraved_number in
+            IssuedOutHistory.objects.filter(item_id__in=item_ids).values_list(
+                'id', 'item_id', 'department_id', 'date', 'quantity_issued_out', 'engraved_number'
+            )
+        ]
+        remaining, issue_costs, averages = replay_costs(receipts, issues)
+
+        cls.objects.filter(item_id__in=item_ids).delete()
+        cls.objects.bulk_create([
+            cls(stock_id=stock_id, item_id=item_id, department_id=department_id, date_added=day,
+                quantity=quantity, remaining=remaining[stock_id], unit_cost=cost)
+            for stock_id, item_id, department_id, day, quantity, cost, _ in receipts
+        ], batch_size=batch_size)
+
+        _write_issue_costs(issue_costs)
+
+        entries = list(Quantity.objects.filter(item_id__in=item_ids).only('id', 'item_id', 'department_id'))
+        for entry in entries:
+            entry.average_cost = round(averages.get((entry.item_id, entry.department_id), 0), 4)
+        Quantity.objects.bulk_update(entries, ['average_cost'], batch_size=batch_size)
+        return len(receipts)
+
 
 class Employee(models.Model):
     """
@@ -271,6 +578,10 @@ class IssuedOutHistory(models.Model):
     :type date: datetime
     :ivar issued_by: Reference to the user who issued the items. Can be null if the user is not recorded.
     :type issued_by: ForeignKey
+    :ivar fifo_cost: Cost of the issued units taken from the oldest open cost layers.
+    :type fifo_cost: Decimal
+    :ivar average_cost: Cost of the issued units at the moving average cost of the holding.
+    :type average_cost: Decimal
     """
     item = models.ForeignKey(InventoryItem, on_delete=models.CASCADE)
     engraved_number = models.CharField(max_length=100, null=True, blank=True)
@@ -282,47 +593,631 @@ class IssuedOutHistory(models.Model):
     office = models.CharField(max_length=100, null=True)
     date = models.DateTimeField(auto_now_add=True)
     issued_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    fifo_cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    average_cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        indexes = [
+            # Issued-out lists ordered by date, including keyset pagination
+            models.Index(fields=['date', 'id'], name='issued_date_idx'),
+            # Department pages and reports filtered by date
+            models.Index(fields=['department', 'date'], name='issued_department_date_idx'),
+            # Issued quantities of an item up to a date
+            models.Index(fields=['item', 'date'], name='issued_item_date_idx'),
+            # IVN list and detail pages
+            models.Index(fields=['issue_voucher_number', 'date'], name='issued_voucher_idx'),
+        ]
 
     def __str__(self):
         return f"{self.item.item_name} - {self.quantity_issued_out} issued to {self.issued_to.name}"
 
     @property
-    def condition(self):
+    def cost_snapshot(self):
+        # Read the materialized cost snapshot; select_related('item__cost_snapshot') avoids a query
         try:
-            # Get the latest stock history for the item to determine its condition
-            stock_history = StockHistory.objects.filter(item=self.item).latest('date_added')
-            return stock_history.condition
-        except StockHistory.DoesNotExist:
-            return 'No Stock History'
+            return self.item.cost_snapshot
+        except ItemCostSnapshot.DoesNotExist:
+            return None
+
+    @property
+    def condition(self):
+        snapshot = self.cost_snapshot
+        return snapshot.condition if snapshot else 'No Stock History'
 
     @property
     def unit_cost(self):
-        try:
-            # Get the latest stock history for the item to determine its unit cost
-            stock_history = StockHistory.objects.filter(item=self.item).latest('date_added')
-            return stock_history.unit_cost
-        except StockHistory.DoesNotExist:
-            return 0
+        snapshot = self.cost_snapshot
+        return snapshot.unit_cost if snapshot else 0
 
     @property
     def date_purchased(self):
-        try:
-            # Get the latest stock history for the item to determine its purchase date
-            stock_history = StockHistory.objects.filter(item=self.item).latest('date_added')
-            return stock_history.date_added
-        except StockHistory.DoesNotExist:
-            return None
+        snapshot = self.cost_snapshot
+        return snapshot.date_purchased if snapshot else None
 
     @property
     def user_title(self):
-        try:
-            # Get the title of the employee to whom the item was issued
-            employee = Employee.objects.get(name=self.issued_to)
-            return employee.Title
-        except Employee.DoesNotExist:
-            return None
-        except Employee.MultipleObjectsReturned:
-            # Handle the case where multiple employees are found
-            return "Multiple employees found"
+        # Title of the employee the item was issued to; select_related('issued_to') avoids a query
+        return self.issued_to.Title
+
+
+
+
+class StockLedgerEntry(models.Model):
+    """
+    Represents one change to the quantity of an inventory item held by a department.
+
+    The ledger is append-only: the stock movement services add an entry in the same
+    transaction that changes a Quantity record, and entries are never updated or
+    deleted. The quantity of every holding is therefore the sum of its entries, and
+    `Quantity` is a projection of the ledger that `StockLedgerEntry.reconcile` and the
+    `rebuild_quantities` management command can verify and rebuild at any time.
+
+    :ivar item: The inventory item whose quantity changed.
+    :type item: ForeignKey to InventoryItem
+    :ivar department: The department holding the item.
+    :type department: ForeignKey to StaffDepartment
+    :ivar change: The number of units added, or removed when negative.
+    :type change: int
+    :ivar kind: Whether the change is a receipt, an issue or a manual adjustment.
+    :type kind: str
+    :ivar stock: The stock history record of a receipt, if any.
+    :type stock: ForeignKey to StockHistory
+    :ivar issue: The issued-out record of an issue, if any.
+    :type issue: ForeignKey to IssuedOutHistory
+    :ivar note: The reason of a manual adjustment.
+    :type note: str
+    :ivar created_at: When the entry was appended.
+    :type created_at: datetime
+    """
+    RECEIPT = 'receipt'
+    ISSUE = 'issue'
+    ADJUSTMENT = 'adjustment'
+    KIND_CHOICES = [
+        (RECEIPT, 'Receipt'),
+        (ISSUE, 'Issue'),
+        (ADJUSTMENT, 'Adjustment'),
+    ]
 
+    item = models.ForeignKey(InventoryItem, on_delete=models.CASCADE, related_name='+')
+    department = models.ForeignKey(StaffDepartment, on_delete=models.CASCADE, related_name='+')
+    change = models.IntegerField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    stock = models.ForeignKey(StockHistory, on_delete=models.SET_NULL, null=True, blank=True,
+                              related_name='ledger_entries')
+    issue = models.ForeignKey(IssuedOutHistory, on_delete=models.SET_NULL, null=True, blank=True,
+                              related_name='ledger_entries')
+    note = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        verbose_name_plural = 'stock ledger entries'
+        indexes = [
+            # Balances of every holding, summed in holding order
+            models.Index(fields=['item', 'department'], name='stock_ledger_holding_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.item_id} - {self.department_id}: {self.change:+d} ({self.kind})"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Stock ledger entries are append-only and cannot be changed.')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError('Stock ledger entries are append-only and cannot be deleted.')
+
+    @classmethod
+    def append_receipts(cls, stocks, batch_size=1000):
+        """
+        Appends an entry for each of the given stock intakes.
+
+        :param stocks: Saved StockHistory records.
+        :param batch_size: The number of entries written per query.
+        """
+        cls.objects.bulk_create([
+            cls(item_id=stock.item_id, department_id=stock.department_id, change=stock.quantity,
+                kind=cls.RECEIPT, stock_id=stock.pk)
+            for stock in stocks
+        ], batch_size=batch_size)
+
+    @classmethod
+    def append_issues(cls, issues, batch_size=1000):
+        """
+        Appends an entry for each of the given issues.
+
+        :param issues: Saved IssuedOutHistory records.
+        :param batch_size: The number of entries written per query.
+        """
+        cls.objects.bulk_create([
+            cls(item_id=issue.item_id, department_id=issue.department_id, change=-issue.quantity_issued_out,
+                kind=cls.ISSUE, issue_id=issue.pk)
+            for issue in issues
+        ], batch_size=batch_size)
+
+    @classmethod
+    def append_adjustment(cls, item_id, department_id, change, note):
+        """
+        Appends a manual adjustment of the quantity of a holding.
+
+        :param item_id: The ID of the inventory item adjusted.
+        :param department_id: The ID of the department holding the item.
+        :param change: The number of units added, or removed when negative.
+        :param note: The reason of the adjustment.
+        :return: The created entry.
+        """
+        entry, = cls.objects.bulk_create([
+            cls(item_id=item_id, department_id=department_id, change=change, kind=cls.ADJUSTMENT, note=note[:255])
+        ])
+        return entry
+
+    @classmethod
+    def backfill(cls, batch_size=1000):
+        """
+        Appends the entries of every stock history and issued-out record that has none,
+        such as records written by bulk imports or before the ledger existed. The records
+        are read in batches of `batch_size` in ID order, so memory use does not grow with
+        the history.
+
+        :param batch_size: The number of records read and entries written per query.
+        :return: The number of entries appended.
+        """
+        count = 0
+        for model, fields, append in (
+            (StockHistory, ('item_id', 'department_id', 'quantity'), cls.append_receipts),
+            (IssuedOutHistory, ('item_id', 'department_id', 'quantity_issued_out'), cls.append_issues),
+        ):
+            last_id = 0
+            while True:
+                records = list(model.objects.filter(ledger_entries=None, id__gt=last_id).order_by('id').only(
+                    *fields)[:batch_size])
+                if not records:
+                    break
+                append(records, batch_size=batch_size)
+                count += len(records)
+                last_id = records[-1].id
+        return count
+
+    @classmethod
+    def reconcile(cls, apply=False, batch_size=1000):
+        """
+        Compares every Quantity record with the balance of its holding in the ledger and
+        optionally rebuilds the quantities from the ledger.
+
+        The ledger balances and the quantities are both streamed in holding order and
+        merged in one pass, so memory use does not grow with the number of holdings.
+        When a holding has several Quantity records, the first one receives the balance
+        and the others are emptied. Negative balances cannot be stored and are reported
+        only. Applying the balances refreshes the cost snapshots of the items and the
+        stock snapshots of the holdings repaired, and bumps the inventory data version.
+
+        :param apply: Whether to write the ledger balances to the Quantity records.
+        :param batch_size: The number of records read or written per query.
+        :return: A list of (item ID, department ID, recorded quantity, ledger balance)
+            tuples of every holding whose quantity differs from the ledger.
+        """
+        balances = cls.objects.values_list('item_id', 'department_id').annotate(
+            balance=models.Sum('change')
+        ).order_by('item_id', 'department_id').iterator(chunk_size=batch_size)
+        quantities = Quantity.objects.values_list('item_id', 'department_id', 'id', 'quantity').order_by(
+            'item_id', 'department_id', 'id'
+        ).iterator(chunk_size=batch_size)
+
+        discrepancies = []
+        updates = []
+        creates = []
+        holding_balance = next(balances, None)
+        entry = next(quantities, None)
+        while holding_balance is not None or entry is not None:
+            # Take the next holding in order from either stream, with all its Quantity records
+            holding = min(row[:2] for row in (holding_balance, entry) if row is not None)
+            balance = 0
+            if holding_balance is not None and holding_balance[:2] == holding:
+                balance = holding_balance[2]
+                holding_balance = next(balances, None)
+            entries = []
+            while entry is not None and entry[:2] == holding:
+                entries.append(entry)
+                entry = next(quantities, None)
+
+            recorded = sum(quantity for _, _, _, quantity in entries)
+            if recorded == balance:
+                continue
+            discrepancies.append((*holding, recorded, balance))
+            if balance < 0:
+                continue
+            if entries:
+                updates.extend(Quantity(id=quantity_id, quantity=balance if index == 0 else 0)
+                               for index, (_, _, quantity_id, _) in enumerate(entries))
+            elif balance:
+                creates.append(Quantity(item_id=holding[0], department_id=holding[1], quantity=balance))
+
+        if apply and (updates or creates):
+            with transaction.atomic():
+                Quantity.objects.bulk_update(updates, ['quantity'], batch_size=batch_size)
+                Quantity.objects.bulk_create(creates, batch_size=batch_size)
+            # The bulk writes bypass the signals keeping the derived data and caches in sync
+            repaired = [(item_id, department_id) for item_id, department_id, _, balance in discrepancies
+                        if balance >= 0]
+            ItemCostSnapshot.refresh_for_items({item_id for item_id, _ in repaired})
+            first_snapshot = StockSnapshot.objects.aggregate(first=models.Min('date'))['first']
+            StockSnapshot.refresh([(first_snapshot, item_id, department_id) for item_id, department_id in repaired])
+            bump_data_version()
+        return discrepancies
+
+
+class DailyStockMovement(models.Model):
+    """
+    Represents the stock movement of an inventory item in a department on one day.
+
+    This model is a rollup of the stock history and issued-out history, so that reports
+    charting stock movement over time read one row per day, item and department instead
+    of every transaction. It is kept in sync by the signal handlers in `inventory.signals`
+    and by the bulk stock movements in `inventory.services`, and can be rebuilt from
+    scratch with the `rebuild_stock_movements` management command.
+
+    Only the value added is stored. Issued stock is valued at the item's latest unit
+    cost, which changes after the issuance, so reports value it when they are built.
+
+    :ivar date: The day of the movement.
+    :type date: date
+    :ivar item: The inventory item moved.
+    :type item: ForeignKey to InventoryItem
+    :ivar department: The department the item was delivered to or issued from.
+    :type department: ForeignKey to StaffDepartment
+    :ivar quantity_added: The quantity delivered on the day.
+    :type quantity_added: int
+    :ivar value_added: The total cost of the stock delivered on the day.
+    :type value_added: Decimal
+    :ivar quantity_issued: The quantity issued out on the day.
+    :type quantity_issued: int
+    """
+    date = models.DateField()
+    item = models.ForeignKey(InventoryItem, on_delete=models.CASCADE, related_name='+')
+    department = models.ForeignKey(StaffDepartment, on_delete=models.CASCADE, related_name='+')
+    quantity_added = models.PositiveIntegerField(default=0)
+    value_added = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    quantity_issued = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'item', 'department'], name='daily_movement_unique'),
+        ]
+        indexes = [
+            # Department reports charted by date
+            models.Index(fields=['department', 'date'], name='daily_movement_department_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.item_id} - {self.department_id}"
+
+    @classmethod
+    def refresh(cls, keys):
+        """
+        Recomputes the rollup rows of the given days, items and departments from the
+        stock history and issued-out history. Rows without any movement left are deleted.
+
+        :param keys: Iterable of (date, item ID, department ID) tuples to refresh.
+        """
+        keys = {(day, item_id, department_id) for day, item_id, department_id in keys if day is not None}
+        if not keys:
+            return
+        days = {day for day, _, _ in keys}
+        item_ids = {item_id for _, item_id, _ in keys}
+        department_ids = {department_id for _, _, department_id in keys}
+
+        # Aggregate every requested key with one grouped query per source table
+        totals = {key: [0, 0, 0] for key in keys}
+        added = StockHistory.objects.filter(
+            date_added__in=days, item_id__in=item_ids, department_id__in=department_ids
+        ).values_list('date_added', 'item_id', 'department_id').annotate(
+            quantity=models.Sum('quantity'), value=models.Sum('total_cost')
+        ).order_by()
+        for day, item_id, department_id, quantity, value in added:
+            if (day, item_id, department_id) in totals:
+                totals[(day, item_id, department_id)][:2] = [quantity, value]
+        issued = IssuedOutHistory.objects.filter(
+            date__date__in=days, item_id__in=item_ids, department_id__in=department_ids
+        ).values_list(TruncDate('date'), 'item_id', 'department_id').annotate(
+            quantity=models.Sum('quantity_issued_out')
+        ).order_by()
+        for day, item_id, department_id, quantity in issued:
+            if (day, item_id, department_id) in totals:
+                totals[(day, item_id, department_id)][2] = quantity
+
+        empty = models.Q()
+        for (day, item_id, department_id), (quantity_added, _, quantity_issued) in totals.items():
+            if not quantity_added and not quantity_issued:
+                empty |= models.Q(date=day, item_id=item_id, department_id=department_id)
+        if empty:
+            cls.objects.filter(empty).delete()
+        cls.objects.bulk_create([
+            cls(date=day, item_id=item_id, department_id=department_id,
+                quantity_added=quantity_added, value_added=value_added, quantity_issued=quantity_issued)
+            for (day, item_id, department_id), (quantity_added, value_added, quantity_issued) in totals.items()
+            if quantity_added or quantity_issued
+        ], batch_size=1000, update_conflicts=True, unique_fields=['date', 'item', 'department'],
+            update_fields=['quantity_added', 'value_added', 'quantity_issued'])
+        # Back-dated movements change the balances of the snapshots taken since
+        StockSnapshot.refresh(keys)
+
+    @classmethod
+    def rebuild(cls, batch_size=1000):
+        """
+        Rebuilds the whole rollup from the stock history and issued-out history, and
+        retakes the stock snapshots derived from it.
+
+        The daily totals of both histories are streamed in key order and merged in one
+        pass, and the rows are written in batches, so memory use does not grow with the
+        history.
+
+        :param batch_size: The number of rows written per query.
+        :return: The number of rollup rows written.
+        """
+        added = StockHistory.objects.exclude(date_added=None).values_list(
+            'date_added', 'item_id', 'department_id'
+        ).annotate(quantity=models.Sum('quantity'), value=models.Sum('total_cost')).order_by(
+            'date_added', 'item_id', 'department_id'
+        ).iterator(chunk_size=batch_size)
+        issued = IssuedOutHistory.objects.annotate(day=TruncDate('date')).values_list(
+            'day', 'item_id', 'department_id'
+        ).annotate(quantity=models.Sum('quantity_issued_out')).order_by(
+            'day', 'item_id', 'department_id'
+        ).iterator(chunk_size=batch_size)
+
+        count = 0
+        with transaction.atomic():
+            cls.objects.all().delete()
+            rows = []
+            receipt = next(added, None)
+            issue = next(issued, None)
+            while receipt is not None or issue is not None:
+                # Take the next key in order from either stream
+                key = min(row[:3] for row in (receipt, issue) if row is not None)
+                quantity_added, value_added, quantity_issued = 0, 0, 0
+                if receipt is not None and receipt[:3] == key:
+                    quantity_added, value_added = receipt[3:]
+                    receipt = next(added, None)
+                if issue is not None and issue[:3] == key:
+                    quantity_issued = issue[3]
+                    issue = next(issued, None)
+                rows.append(cls(date=key[0], item_id=key[1], department_id=key[2], quantity_added=quantity_added,
+                                value_added=value_added, quantity_issued=quantity_issued))
+                if len(rows) == batch_size:
+                    cls.objects.bulk_create(rows)
+                    count += len(rows)
+                    rows = []
+            cls.objects.bulk_create(rows)
+            count += len(rows)
+            StockSnapshot.retake()
+        return count
+
+
+class StockSnapshot(models.Model):
+    """
+    Represents the quantity of an inventory item held by a department at the end of a
+    day, typically a month end.
+
+    Snapshots answer "what did a department hold on a given day" without replaying the
+    stock history: the balance on any day is the balance in the latest snapshot taken
+    on or before it plus the daily stock movements since, which is at most a month of
+    rollup rows when snapshots are taken monthly. Only non-zero balances are stored.
+    Snapshots are taken with the `take_stock_snapshots` management command and kept in
+    sync with back-dated movements by `DailyStockMovement.refresh`.
+
+    :ivar date: The day whose closing balance is recorded.
+    :type date: date
+    :ivar item: The inventory item held.
+    :type item: ForeignKey to InventoryItem
+    :ivar department: The department holding the item.
+    :type department: ForeignKey to StaffDepartment
+    :ivar quantity: The quantity held at the end of the day, according to the stock
+        history and issued-out history.
+    :type quantity: int
+    """
+    date = models.DateField()
+    item = models.ForeignKey(InventoryItem, on_delete=models.CASCADE, related_name='+')
+    department = models.ForeignKey(StaffDepartment, on_delete=models.CASCADE, related_name='+')
+    quantity = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'item', 'department'], name='stock_snapshot_unique'),
+        ]
+        indexes = [
+            # Balances of one department as of a date
+            models.Index(fields=['department', 'date'], name='stock_snapshot_department_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.item_id} - {self.department_id}: {self.quantity}"
+
+    @classmethod
+    def balances_as_of(cls, day, department_id=None, item_id=None):
+        """
+        Computes the quantities held at the end of a day from the latest snapshot taken
+        on or before it and the daily stock movements since.
+
+        :param day: The day to compute the balances of.
+        :param department_id: Optional department to restrict the balances to.
+        :param item_id: Optional inventory item to restrict the balances to.
+        :return: A tuple of the date of the snapshot used, or None if there is none, and
+            a dictionary of non-zero quantities keyed by (item ID, department ID).
+        """
+        snapshot_date = cls.objects.filter(date__lte=day).aggregate(latest=models.Max('date'))['latest']
+        return snapshot_date, cls._balances(day, snapshot_date, department_id, item_id)
+
+    @classmethod
+    def _balances(cls, day, snapshot_date, department_id=None, item_id=None):
+        # Start from the snapshot and add the movements after it, one grouped query each
+        scope = {}
+        if department_id is not None:
+            scope['department_id'] = department_id
+        if item_id is not None:
+            scope['item_id'] = item_id
+        balances = defaultdict(int)
+        movements = DailyStockMovement.objects.filter(date__lte=day, **scope)
+        if snapshot_date is not None:
+            for item, department, quantity in cls.objects.filter(date=snapshot_date, **scope).values_list(
+                'item_id', 'department_id', 'quantity'
+            ):
+                balances[(item, department)] = quantity
+            movements = movements.filter(date__gt=snapshot_date)
+        for item, department, added, issued in movements.values_list('item_id', 'department_id').annotate(
+            added=models.Sum('quantity_added'), issued=models.Sum('quantity_issued')
+        ).order_by():
+            balances[(item, department)] += added - issued
+        return {key: quantity for key, quantity in balances.items() if quantity}
+
+    @classmethod
+    def take(cls, day, batch_size=1000):
+        """
+        Takes the snapshot of every holding at the end of a day, replacing any snapshot
+        already taken that day. The balances are built from the previous snapshot and
+        the movements since, so taking snapshots in date order never reads more than
+        the movements between two snapshots.
+
+        :param day: The day to take the snapshot of.
+        :param batch_size: The number of balances written per query.
+        :return: The number of balances written.
+        """
+        previous = cls.objects.filter(date__lt=day).aggregate(latest=models.Max('date'))['latest']
+        balances = cls._balances(day, previous)
+        with transaction.atomic():
+            cls.objects.filter(date=day).delete()
+            cls.objects.bulk_create([
+                cls(date=day, item_id=item_id, department_id=department_id, quantity=quantity)
+                for (item_id, department_id), quantity in balances.items()
+            ], batch_size=batch_size)
+        return len(balances)
+
+    @classmethod
+    def retake(cls):
+        """
+        Retakes every snapshot in date order, after the daily stock movements were
+        rebuilt.
+
+        :return: The number of snapshots retaken.
+        """
+        days = list(cls.objects.values_list('date', flat=True).distinct().order_by('date'))
+        for day in days:
+            cls.take(day)
+        return len(days)
+
+    @classmethod
+    def refresh(cls, keys):
+        """
+        Recomputes the snapshot balances of the given items and departments on every
+        snapshot taken on or after the earliest of the given days.
+
+        :param keys: Iterable of (date, item ID, department ID) tuples of the daily
+            stock movements that changed.
+        """
+        keys = [(day, item_id, department_id) for day, item_id, department_id in keys if day is not None]
+        if not keys:
+            return
+        days = list(cls.objects.filter(date__gte=min(day for day, _, _ in keys)).values_list(
+            'date', flat=True).distinct().order_by('date'))
+        if not days:
+            return
+
+        holdings = {(item_id, department_id) for _, item_id, department_id in keys}
+        lookup = models.Q()
+        for item_id, department_id in holdings:
+            lookup |= models.Q(item_id=item_id, department_id=department_id)
+        # Accumulate the movements of the holdings up to every snapshot day
+        balances = {(day, holding): 0 for day in days for holding in holdings}
+        for day, item_id, department_id, added, issued in DailyStockMovement.objects.filter(
+            lookup, date__lte=days[-1]
+        ).values_list('date', 'item_id', 'department_id', 'quantity_added', 'quantity_issued'):
+            for snapshot_day in days:
+                if day <= snapshot_day:
+                    balances[(snapshot_day, (item_id, department_id))] += added - issued
+
+        cls.objects.filter(lookup, date__in=days).delete()
+        cls.objects.bulk_create([
+            cls(date=day, item_id=item_id, department_id=department_id, quantity=quantity)
+            for (day, (item_id, department_id)), quantity in balances.items() if quantity
+        ], batch_size=1000)
+
+
+class ReportJob(models.Model):
+    """
+    Represents a report generated in the background by the report worker.
+
+    Heavy reports are queued as jobs instead of being built inside the request. The
+    `run_report_worker` management command picks up pending jobs, builds the report
+    with the same context builders as the report pages, and writes the result to the
+    report artifacts directory, updating the progress as it goes.
+
+    :ivar kind: The report to generate, one of `KIND_CHOICES`.
+    :type kind: str
+    :ivar format: The file format of the artifact, one of `FORMAT_CHOICES`.
+    :type format: str
+    :ivar start_date: Optional first date of the reported period.
+    :type start_date: date or None
+    :ivar end_date: Optional last date of the reported period.
+    :type end_date: date or None
+    :ivar department: Optional department the report is restricted to.
+    :type department: ForeignKey to StaffDepartment
+    :ivar status: The state of the job, one of `STATUS_CHOICES`.
+    :type status: str
+    :ivar progress: The completion of the job in percent.
+    :type progress: int
+    :ivar error: The error message of a failed job.
+    :type error: str
+    :ivar artifact: The file name of the generated report in the artifacts directory.
+    :type artifact: str
+    :ivar created_by: The user who requested the report.
+    :type created_by: ForeignKey to User
+    :ivar created_at: Timestamp when the job was queued.
+    :type created_at: datetime
+    :ivar started_at: Timestamp when a worker picked the job up.
+    :type started_at: datetime or None
+    :ivar finished_at: Timestamp when the job completed or failed.
+    :type finished_at: datetime or None
+    """
+    KIND_CHOICES = [
+        ('combined', 'Combined Report'),
+        ('cost', 'Cost Report'),
+        ('inflow', 'Inflow Report'),
+        ('outflow', 'Outflow Report'),
+    ]
+    FORMAT_CHOICES = [
+        ('html', 'HTML'),
+        ('csv', 'CSV'),
+        ('xlsx', 'XLSX'),
+    ]
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default='html')
+    start_date = models.DateField(null=True, blank=True)
+    end_date = models.DateField(null=True, blank=True)
+    department = models.ForeignKey(StaffDepartment, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    progress = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    artifact = models.CharField(max_length=255, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The worker picks up the oldest pending jobs first
+            models.Index(fields=['status', 'created_at'], name='report_job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} ({self.format}) - {self.status}"
@@ -0,0 +1,182 @@
+import base64
+import json
+
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    """
+    Raised when a keyset pagination cursor cannot be decoded.
+    """
+
+
+def encode_cursor(values, previous=False):
+    """
+    Encodes the keyset values of a boundary row into an opaque, URL-safe cursor.
+
+    :param values: A list of JSON-serializable values of the keyset fields.
+    :param previous: Whether the cursor points to the page before the boundary row.
+    :return: The cursor as a string.
+    """
+    payload = json.dumps({'v': values, 'p': previous}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor created by `encode_cursor`.
+
+    :param cursor: The cursor string.
+    :return: A tuple of the list of keyset values and the previous flag.
+    :raises InvalidCursor: If the cursor is malformed.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return list(payload['v']), bool(payload['p'])
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor('Invalid cursor.')
+
+
+class KeysetPage:
+    """
+    A page of results produced by `KeysetPaginator`.
+
+    Mirrors the parts of Django's `Page` interface used by templates, with cursors to
+    the neighbouring pages instead of page numbers.
+
+    :ivar object_list: The records of the page.
+    :ivar paginator: The paginator that produced the page.
+    :ivar next_cursor: Cursor of the following page, or None on the last page.
+    :ivar previous_cursor: Cursor of the preceding page, or None on the first page.
+    """
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Paginates a queryset by seeking past the keyset values of the last row shown
+    instead of using OFFSET.
+
+    The queryset is ordered by the keyset fields in descending order, the last field
+    being a unique tie-breaker such as the primary key. Every page, however deep, is
+    fetched with a single indexed range query of `per_page + 1` rows, and no COUNT(*) is
+    run unless `approximate_count` is requested.
+
+    :ivar queryset: The queryset to paginate.
+    :ivar per_page: The number of records per page.
+    :ivar keyset_fields: The fields defining the order, most significant first.
+    :ivar count_limit: The number of rows after which `approximate_count` stops counting.
+    """
+    def __init__(self, queryset, per_page, keyset_fields=('date', 'id'), count_limit=10000):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.keyset_fields = tuple(keyset_fields)
+        self.count_limit = count_limit
+
+    def _seek_filter(self, values, after):
+        # Build (a < x) OR (a = x AND b < y) ... for rows past the boundary in the given direction
+        lookup = 'lt' if after else 'gt'
+        condition = Q()
+        for index, field in enumerate(self.keyset_fields):
+            equal = {name: values[position] for position, name in enumerate(self.keyset_fields[:index])}
+            condition |= Q(**equal, **{f'{field}__{lookup}': values[index]})
+        return condition
+
+    def _to_python(self, values):
+        model = self.queryset.model
+        if len(values) != len(self.keyset_fields):
+            raise InvalidCursor('Invalid cursor.')
+        try:
+            return [model._meta.get_field(field).to_python(value) for field, value in zip(self.keyset_fields, values)]
+        except Exception:
+            raise InvalidCursor('Invalid cursor.')
+
+    def _cursor_values(self, record):
+        values = []
+        for field in self.keyset_fields:
+            value = getattr(record, model_attname(self.queryset.model, field))
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return values
+
+    def page(self, cursor=None):
+        """
+        Returns the page following (or preceding) the boundary encoded in `cursor`.
+
+        :param cursor: A cursor from a previous page, or None for the first page.
+        :return: A `KeysetPage`.
+        :raises InvalidCursor: If the cursor is malformed.
+        """
+        descending = [f'-{field}' for field in self.keyset_fields]
+        ascending = list(self.keyset_fields)
+
+        if cursor:
+            values, previous = decode_cursor(cursor)
+            values = self._to_python(values)
+            if previous:
+                queryset = self.queryset.filter(self._seek_filter(values, after=False)).order_by(*ascending)
+            else:
+                queryset = self.queryset.filter(self._seek_filter(values, after=True)).order_by(*descending)
+        else:
+            previous = False
+            queryset = self.queryset.order_by(*descending)
+
+        records = list(queryset[:self.per_page + 1])
+        has_more = len(records) > self.per_page
+        records = records[:self.per_page]
+        if previous:
+            records.reverse()
+
+        if not records:
+            return KeysetPage(records, self)
+
+        first, last = self._cursor_values(records[0]), self._cursor_values(records[-1])
+        if previous:
+            next_cursor = encode_cursor(last)
+            previous_cursor = encode_cursor(first, previous=True) if has_more else None
+        else:
+            next_cursor = encode_cursor(last) if has_more else None
+            previous_cursor = encode_cursor(first, previous=True) if cursor else None
+        return KeysetPage(records, self, next_cursor=next_cursor, previous_cursor=previous_cursor)
+
+    def approximate_count(self):
+        """
+        Counts the records of the queryset, stopping at `count_limit`.
+
+        :return: A tuple of the count and a flag telling whether it is exact. When the
+            limit is reached the count equals the limit and the flag is False.
+        """
+        count = self.queryset.order_by()[:self.count_limit + 1].count()
+        if count > self.count_limit:
+            return self.count_limit, False
+        return count, True
+
+
+def model_attname(model, field):
+    """
+    Returns the attribute name under which a field's value is stored on instances,
+    such as `department_id` for a `department` foreign key.
+
+    :param model: The model class.
+    :param field: The field name.
+    :return: The attribute name.
+    """
+    return model._meta.get_field(field).attname
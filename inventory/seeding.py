@@ -0,0 +1,346 @@
+import multiprocessing
+import random
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+import django
+from django.db import reset_queries, transaction
+from django.utils import timezone
+
+from inventory.cache import bump_data_version, invalidate_departments
+from inventory.models import InventoryItem, ItemCategory, StaffDepartment, Employee, Quantity, StockHistory, \
+    IssuedOutHistory, ItemCostSnapshot, DailyStockMovement, CostLayer, StockLedgerEntry
+from inventory.services import BULK_BATCH_SIZE
+
+CATEGORIES = ['Computers', 'Furniture', 'Stationery', 'Vehicles', 'Cleaning', 'Medical', 'Electrical', 'Uniforms']
+SUPPLIERS = [f'Supplier {index:02d}' for index in range(1, 21)]
+
+# Number of days of history the synthetic deliveries and issues are spread over
+HISTORY_DAYS = 730
+
+# Number of deliveries generated and written together, with the issues drawn on them
+CHUNK_SIZE = 10000
+
+
+def seed_scale(rows):
+    """
+    Derives the size of every table of a synthetic dataset from its number of rows.
+
+    :param rows: The number of stock history records, and roughly of issued-out records.
+    :return: A dict with the number of departments, items and employees.
+    """
+    return {
+        'departments': max(3, min(25, rows // 400)),
+        'items': max(20, rows // 20),
+        'employees': max(10, rows // 50),
+    }
+
+
+def seed_catalog(rows, added_by, seed=0, batch_size=BULK_BATCH_SIZE):
+    """
+    Creates the categories, departments, items and employees of a synthetic dataset.
+
+    :param rows: The number of deliveries the dataset is sized for.
+    :param added_by: The user recorded as having added the data.
+    :param seed: The seed of the random number generator.
+    :param batch_size: The number of records written per query.
+    :return: The catalog the deliveries and issues are generated from, as a picklable
+        dict of plain values.
+    """
+    rng = random.Random(f'{seed}:catalog')
+    scale = seed_scale(rows)
+    with transaction.atomic():
+        ItemCategory.objects.bulk_create(
+            [ItemCategory(Category_name=name, description=f'{name} and related supplies', added_by=added_by)
+             for name in CATEGORIES],
+            batch_size=batch_size,
+        )
+        departments = StaffDepartment.objects.bulk_create(
+            [StaffDepartment(Department_name=f'Department {index:02d}', added_by=added_by)
+             for index in range(1, scale['departments'] + 1)],
+            batch_size=batch_size,
+        )
+        items = InventoryItem.objects.bulk_create(
+            [InventoryItem(
+                item_name=f'Item {index:06d}',
+                description=f'Synthetic item {index}',
+                category=rng.choice(CATEGORIES),
+                added_by=added_by,
+                expires=rng.random() < 0.2,
+                depreciates=rng.random() < 0.3,
+                engraved=rng.random() < 0.1,
+            ) for index in range(1, scale['items'] + 1)],
+            batch_size=batch_size,
+        )
+        employees = Employee.objects.bulk_create(
+            [Employee(
+                name=f'Employee {index:06d}',
+                department=rng.choice(departments),
+                Title=rng.choice(['Attorney', 'Clerk', 'Officer', 'Manager']),
+                office=f'Office {rng.randint(1, 200)}',
+            ) for index in range(1, scale['employees'] + 1)],
+            batch_size=batch_size,
+        )
+        # bulk_create does not send the signal that refreshes the cached department list
+        invalidate_departments()
+
+    employees_by_department = defaultdict(list)
+    for employee in employees:
+        employees_by_department[employee.department_id].append((employee.id, employee.office))
+    return {
+        'added_by_id': added_by.id,
+        'departments': [department.id for department in departments],
+        'items': [
+            (item.id, item.description, item.engraved, item.expires, item.depreciates,
+             Decimal(rng.randint(5, 5000) * 100))
+            for item in items
+        ],
+        'employees': dict(employees_by_department),
+        'employee_count': len(employees),
+        'today': timezone.localdate(),
+    }
+
+
+def seed_movements(catalog, start, stop, seed=0, batch_size=BULK_BATCH_SIZE):
+    """
+    Generates and writes deliveries `start` to `stop` of a synthetic dataset, together
+    with issues drawn on them, in one transaction.
+
+    Issues only draw on deliveries of the same chunk, and the issues of every holding are
+    dated in order against the deliveries received by then, so no balance becomes
+    negative at any point of the history however the chunks are combined. Engraved units
+    are delivered one per record and issued at most once, after their delivery. The
+    generator is seeded from `seed` and `start`, so a chunk always produces the same data.
+
+    :param catalog: The catalog returned by `seed_catalog`.
+    :param start: The index of the first delivery to generate.
+    :param stop: The index after the last delivery to generate.
+    :param seed: The seed of the random number generator.
+    :param batch_size: The number of records written per query.
+    :return: A tuple of the number of deliveries, the number of issues, and a dict of
+        (item ID, department ID) to [balance, latest delivery date, expiry date,
+        depreciation date] for the quantities.
+    """
+    rng = random.Random(f'{seed}:movements:{start}')
+    today = catalog['today']
+    first_day = today - timedelta(days=HISTORY_DAYS)
+    items = catalog['items']
+    departments = catalog['departments']
+    added_by_id = catalog['added_by_id']
+
+    # Deliveries of about ten lines each, several deliveries per LPO
+    stock = []
+    holdings = {}
+    first_received = {}
+    deliveries = defaultdict(list)
+    descriptions = {}
+    for index in range(start, stop):
+        delivery = index // 10
+        item_id, description, engraved, expires, depreciates, base_cost = rng.choice(items)
+        department_id = rng.choice(departments)
+        day = first_day + timedelta(days=rng.randint(0, HISTORY_DAYS))
+        quantity = 1 if engraved else rng.randint(1, 50)
+        unit_cost = base_cost * Decimal(rng.randint(90, 110)) / 100
+        expiry_date = day + timedelta(days=rng.randint(30, 1095)) if expires else None
+        depreciation_date = day + timedelta(days=1825) if depreciates else None
+        record = StockHistory(
+            item_id=item_id,
+            department_id=department_id,
+            quantity=quantity,
+            unit_cost=unit_cost,
+            total_cost=quantity * unit_cost,
+            lpo=f'LPO-{delivery // 3:07d}',
+            supplied_by=SUPPLIERS[delivery % len(SUPPLIERS)],
+            delivery_number=f'DN-{delivery:07d}',
+            engraved_number=f'SN-{item_id}-{index}' if engraved else None,
+            expiry_date=expiry_date,
+            depreciation_date=depreciation_date,
+            date_added=day,
+            added_by_id=added_by_id,
+        )
+        stock.append(record)
+        key = (item_id, department_id)
+        descriptions[item_id] = description
+        first_received[key] = min(first_received.get(key, day), day)
+        holding = holdings.setdefault(key, [0, day, expiry_date, depreciation_date])
+        holding[0] += quantity
+        # The quantity carries the expiry and depreciation dates of the latest delivery
+        if holding[1] < day:
+            holding[1:] = [day, expiry_date, depreciation_date]
+        deliveries[key].append(record)
+
+    # Spread about one issue per delivery over the holdings of this chunk
+    stocked = [key for key in holdings if catalog['employees'].get(key[1])]
+    planned = defaultdict(int)
+    if stocked:
+        for _ in range(start, stop):
+            planned[rng.choice(stocked)] += 1
+
+    # Replay every holding in date order: an issue only draws on the deliveries received
+    # by its day, so it never overdraws the balance or issues a unit before its delivery
+    issues = []
+    issued_days = []
+    for key in stocked:
+        item_id, department_id = key
+        received = sorted(deliveries[key], key=lambda record: record.date_added)
+        days = sorted(first_received[key] + timedelta(days=rng.randint(0, (today - first_received[key]).days))
+                      for _ in range(planned[key]))
+        balance = 0
+        position = 0
+        engraved_units = []
+        for day in days:
+            while position < len(received) and received[position].date_added <= day:
+                balance += received[position].quantity
+                if received[position].engraved_number:
+                    engraved_units.append(received[position])
+                position += 1
+            if not balance:
+                continue
+            engraved_number = None
+            if engraved_units:
+                record = engraved_units.pop()
+                record.issued = True
+                engraved_number = record.engraved_number
+                quantity = 1
+            else:
+                quantity = min(balance, rng.randint(1, 5))
+            balance -= quantity
+            holdings[key][0] -= quantity
+            employee_id, office = rng.choice(catalog['employees'][department_id])
+            issued_days.append(day)
+            issues.append(IssuedOutHistory(
+                item_id=item_id,
+                engraved_number=engraved_number,
+                description=descriptions[item_id],
+                quantity_issued_out=quantity,
+                issue_voucher_number=f'IVN-{(start + len(issues)) // 5:07d}',
+                issued_to_id=employee_id,
+                department_id=department_id,
+                office=office,
+                issued_by_id=added_by_id,
+            ))
+
+    with transaction.atomic():
+        StockHistory.objects.bulk_create(stock, batch_size=batch_size)
+        issues = IssuedOutHistory.objects.bulk_create(issues, batch_size=batch_size)
+        StockLedgerEntry.append_receipts(stock, batch_size=batch_size)
+        StockLedgerEntry.append_issues(issues, batch_size=batch_size)
+        # The issue date is set by auto_now_add on insert, so spread it afterwards, one UPDATE per day
+        ids_by_day = defaultdict(list)
+        for issue, day in zip(issues, issued_days):
+            ids_by_day[day].append(issue.id)
+        for day, ids in sorted(ids_by_day.items()):
+            # Issues happen during office hours
+            issued_at = timezone.make_aware(datetime.combine(day, time(rng.randint(8, 16), rng.randint(0, 59))))
+            for offset in range(0, len(ids), batch_size):
+                IssuedOutHistory.objects.filter(id__in=ids[offset:offset + batch_size]).update(date=issued_at)
+    return len(stock), len(issues), holdings
+
+
+def finish_seeding(catalog, holdings, batch_size=BULK_BATCH_SIZE):
+    """
+    Writes the quantities of a synthetic dataset and rebuilds the data derived from its
+    stock history, which `bulk_create` does not maintain through signals. The stock
+    ledger is written with every chunk by `seed_movements`, and the rebuilds stream the
+    history, so memory use only grows with the number of holdings.
+
+    :param catalog: The catalog returned by `seed_catalog`.
+    :param holdings: The merged holdings returned by `seed_movements`.
+    :param batch_size: The number of records written per query.
+    :return: The number of quantities written.
+    """
+    with transaction.atomic():
+        # Write the quantities a batch at a time rather than building every record at once
+        keys = sorted(holdings)
+        for offset in range(0, len(keys), batch_size):
+            Quantity.objects.bulk_create([
+                Quantity(item_id=item_id, department_id=department_id, quantity=holdings[(item_id, department_id)][0],
+                         expiry_date=holdings[(item_id, department_id)][2],
+                         depreciation_date=holdings[(item_id, department_id)][3])
+                for item_id, department_id in keys[offset:offset + batch_size]
+            ])
+        CostLayer.rebuild(batch_size=batch_size)
+        item_ids = [item[0] for item in catalog['items']]
+        for offset in range(0, len(item_ids), batch_size):
+            ItemCostSnapshot.refresh_for_items(item_ids[offset:offset + batch_size])
+        DailyStockMovement.rebuild()
+        bump_data_version()
+    return len(holdings)
+
+
+def merge_holdings(merged, holdings):
+    """
+    Adds the holdings of one chunk to the holdings of the chunks merged so far.
+    """
+    for key, (balance, day, expiry_date, depreciation_date) in holdings.items():
+        current = merged.get(key)
+        if current is None:
+            merged[key] = [balance, day, expiry_date, depreciation_date]
+            continue
+        current[0] += balance
+        if current[1] < day:
+            current[1:] = [day, expiry_date, depreciation_date]
+
+
+def seed_inventory(rows, added_by, seed=0, batch_size=BULK_BATCH_SIZE, chunk_size=CHUNK_SIZE, workers=1,
+                   progress=None):
+    """
+    Seeds a realistic synthetic inventory of `rows` deliveries and up to `rows` issues.
+
+    The deliveries are generated in chunks of `chunk_size`, each written in its own
+    transaction, so memory use does not grow with `rows`. With more than one worker the
+    chunks are generated and written by a pool of processes. The data only depends on
+    `seed`, `rows` and `chunk_size`; with several workers the chunks may be written in a
+    different order, so only the primary keys differ between runs.
+
+    :param rows: The number of stock history records to create.
+    :param added_by: The user recorded as having added the data.
+    :param seed: The seed of the random number generator.
+    :param batch_size: The number of records written per query.
+    :param chunk_size: The number of deliveries generated and written together.
+    :param workers: The number of processes writing chunks in parallel.
+    :param progress: Optional callable receiving the number of deliveries written so far.
+    :return: A dict with the number of records created per model name.
+    """
+    catalog = seed_catalog(rows, added_by, seed=seed, batch_size=batch_size)
+    chunks = [(start, min(start + chunk_size, rows)) for start in range(0, rows, chunk_size)]
+    holdings = {}
+    deliveries = issues = 0
+
+    def collect(result):
+        nonlocal deliveries, issues
+        delivered, issued, chunk_holdings = result
+        deliveries += delivered
+        issues += issued
+        merge_holdings(holdings, chunk_holdings)
+        # Drop the queries logged under DEBUG, which would otherwise grow with every chunk
+        reset_queries()
+        if progress:
+            progress(deliveries)
+
+    if workers > 1 and len(chunks) > 1:
+        # Worker processes are spawned fresh and set Django up themselves, so they never
+        # share a database connection with this process
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=django.setup) as pool:
+            futures = [pool.submit(seed_movements, catalog, start, stop, seed=seed, batch_size=batch_size)
+                       for start, stop in chunks]
+            # Results are merged in chunk order, so the quantities do not depend on scheduling
+            for future in futures:
+                collect(future.result())
+    else:
+        for start, stop in chunks:
+            collect(seed_movements(catalog, start, stop, seed=seed, batch_size=batch_size))
+
+    quantities = finish_seeding(catalog, holdings, batch_size=batch_size)
+    return {
+        'ItemCategory': len(CATEGORIES),
+        'StaffDepartment': len(catalog['departments']),
+        'InventoryItem': len(catalog['items']),
+        'Employee': catalog['employee_count'],
+        'StockHistory': deliveries,
+        'IssuedOutHistory': issues,
+        'Quantity': quantities,
+    }
@@ -0,0 +1,483 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, Value, When
+from django.utils import timezone
+
+from inventory.cache import bump_data_version
+from inventory.valuation import moving_average
+from inventory.models import Employee, InventoryItem, Quantity, StockHistory, IssuedOutHistory, ItemCostSnapshot, \
+    DailyStockMovement, CostLayer, StockLedgerEntry
+
+# Number of rows written or looked up per query by the bulk stock movements
+BULK_BATCH_SIZE = 1000
+
+
+class StockMovementError(Exception):
+    """
+    Raised when a stock movement cannot be applied, for example because the issued
+    quantity exceeds the available quantity. The message is safe to show to users.
+    """
+
+
+def _locked_quantity(**lookup):
+    # select_for_update is a no-op on backends without row locks, such as SQLite,
+    # where the conditional UPDATE below still prevents lost updates
+    return Quantity.objects.select_for_update().filter(**lookup).first()
+
+
+def increment_quantity(item, department, amount, expiry_date=None, depreciation_date=None, unit_cost=None):
+    """
+    Adds `amount` to the quantity of an item held by a department, creating the
+    quantity record if it does not exist yet. Must be called inside a transaction.
+
+    The increment is applied with an F() expression, so concurrent intakes cannot
+    overwrite each other. When the unit cost of the received units is given, the moving
+    average cost of the holding is updated in the same UPDATE. It is computed with
+    `valuation.moving_average` from the locked record, like `CostLayer.rebuild` replays it.
+
+    :param item: The inventory item received.
+    :param department: The department receiving the item.
+    :param amount: The number of units received.
+    :param expiry_date: Optional new expiry date of the department's stock.
+    :param depreciation_date: Optional new depreciation date of the department's stock.
+    :param unit_cost: Optional unit cost of the received units.
+    :return: The updated Quantity record.
+    """
+    quantity_entry = _locked_quantity(item=item, department=department)
+    if quantity_entry is None:
+        return Quantity.objects.create(item=item, department=department, quantity=amount,
+                                       expiry_date=expiry_date, depreciation_date=depreciation_date,
+                                       average_cost=unit_cost or 0)
+
+    updates = {'quantity': F('quantity') + amount}
+    if unit_cost is not None and amount > 0:
+        average = moving_average(quantity_entry.quantity, quantity_entry.average_cost, amount, unit_cost)
+        updates['average_cost'] = average.quantize(Decimal('0.0001'), ROUND_HALF_UP)
+    if expiry_date is not None:
+        updates['expiry_date'] = expiry_date
+    if depreciation_date is not None:
+        updates['depreciation_date'] = depreciation_date
+    Quantity.objects.filter(pk=quantity_entry.pk).update(**updates)
+    quantity_entry.refresh_from_db()
+    return quantity_entry
+
+
+def decrement_quantity(quantity_entry_id, amount):
+    """
+    Removes `amount` from a quantity record. Must be called inside a transaction.
+
+    The record is locked where the backend supports it, and the decrement is a
+    conditional UPDATE that only succeeds while enough stock is available, so two
+    concurrent issues can never both pass the availability check.
+
+    :param quantity_entry_id: The ID of the Quantity record to decrement.
+    :param amount: The number of units issued.
+    :return: The updated Quantity record.
+    :raises StockMovementError: If the record does not exist or holds less than `amount`.
+    """
+    quantity_entry = _locked_quantity(pk=quantity_entry_id)
+    if quantity_entry is None:
+        raise StockMovementError('Stock record not found.')
+
+    updated = Quantity.objects.filter(pk=quantity_entry.pk, quantity__gte=amount).update(
+        quantity=F('quantity') - amount
+    )
+    if not updated:
+        raise StockMovementError('Issued quantity cannot exceed available quantity.')
+    quantity_entry.refresh_from_db()
+    return quantity_entry
+
+
+def receive_stock(stock, expiry_date=None, depreciation_date=None):
+    """
+    Records a stock intake, adds it to the department's quantity and appends it to the
+    stock ledger in one transaction.
+
+    :param stock: An unsaved StockHistory record with its item, department and quantity set.
+    :param expiry_date: Optional new expiry date of the department's stock.
+    :param depreciation_date: Optional new depreciation date of the department's stock.
+    :return: The saved StockHistory record.
+    :raises StockMovementError: If the unit cost is invalid; nothing is written then.
+    """
+    stock.unit_cost = clean_unit_cost(stock.unit_cost)
+    with transaction.atomic():
+        # Increment first, so the cost snapshot refreshed when the record is saved sees the new holdings
+        increment_quantity(stock.item, stock.department, stock.quantity,
+                           expiry_date=expiry_date, depreciation_date=depreciation_date, unit_cost=stock.unit_cost)
+        stock.save()
+        StockLedgerEntry.append_receipts([stock])
+    return stock
+
+
+def adjust_quantity(quantity_entry_id, quantity, note):
+    """
+    Sets the quantity of a holding after a stock count and appends the difference to
+    the stock ledger as an adjustment, in one transaction.
+
+    Adjustments only change the quantity: the cost layers and the stock history are
+    left as they are, since they record receipts and issues.
+
+    :param quantity_entry_id: The ID of the Quantity record adjusted.
+    :param quantity: The number of units counted.
+    :param note: The reason of the adjustment.
+    :return: The updated Quantity record.
+    :raises StockMovementError: If the record does not exist or the quantity is negative.
+    """
+    if quantity < 0:
+        raise StockMovementError('Quantity cannot be negative.')
+
+    with transaction.atomic():
+        quantity_entry = _locked_quantity(pk=quantity_entry_id)
+        if quantity_entry is None:
+            raise StockMovementError('Stock record not found.')
+        change = quantity - quantity_entry.quantity
+        if change:
+            # Saved rather than updated, so the signals refresh the cost snapshot and caches
+            quantity_entry.quantity = quantity
+            quantity_entry.save(update_fields=['quantity'])
+            StockLedgerEntry.append_adjustment(quantity_entry.item_id, quantity_entry.department_id, change, note)
+    return quantity_entry
+
+
+def validate_engraved_numbers(engraved_numbers, batch_size=BULK_BATCH_SIZE):
+    """
+    Cleans a list of engraved numbers and checks that they can be received.
+
+    :param engraved_numbers: The engraved numbers of the delivered units.
+    :param batch_size: The number of engraved numbers looked up per query.
+    :return: The engraved numbers with surrounding whitespace removed, in their original order.
+    :raises StockMovementError: If a number is blank, repeated in the list or already recorded.
+    """
+    cleaned = [str(number).strip() for number in engraved_numbers]
+    if not cleaned:
+        raise StockMovementError('No engraved numbers were provided.')
+    if not all(cleaned):
+        raise StockMovementError('Engraved numbers cannot be blank.')
+
+    seen, repeated = set(), set()
+    for number in cleaned:
+        if number in seen:
+            repeated.add(number)
+        seen.add(number)
+    if repeated:
+        raise StockMovementError(f"Duplicate engraved numbers: {_summarize(repeated)}.")
+
+    # Look up existing numbers in batches to stay below the backend's query parameter limit
+    existing = set()
+    for start in range(0, len(cleaned), batch_size):
+        existing.update(StockHistory.objects.filter(
+            engraved_number__in=cleaned[start:start + batch_size]
+        ).values_list('engraved_number', flat=True))
+    if existing:
+        raise StockMovementError(f"Engraved numbers already recorded: {_summarize(existing)}.")
+    return cleaned
+
+
+def clean_unit_cost(unit_cost):
+    """
+    Parses the unit cost of a delivery and checks that it can be stored.
+
+    :param unit_cost: The unit cost as a string, number or Decimal.
+    :return: The unit cost as a Decimal rounded to the field's decimal places.
+    :raises StockMovementError: If the unit cost is not a number, is not finite, is
+        negative or has more digits than `StockHistory.unit_cost` holds.
+    """
+    field = StockHistory._meta.get_field('unit_cost')
+    try:
+        unit_cost = Decimal(str(unit_cost).strip())
+    except InvalidOperation:
+        raise StockMovementError('Invalid unit cost.')
+    if not unit_cost.is_finite() or unit_cost < 0:
+        raise StockMovementError('Invalid unit cost.')
+    unit_cost = unit_cost.quantize(Decimal(1).scaleb(-field.decimal_places), ROUND_HALF_UP)
+    if unit_cost >= Decimal(10) ** (field.max_digits - field.decimal_places):
+        raise StockMovementError('Invalid unit cost.')
+    return unit_cost
+
+
+def _summarize(numbers, limit=10):
+    # Keep error messages readable when a large delivery has many offending numbers
+    numbers = sorted(numbers)
+    summary = ', '.join(numbers[:limit])
+    if len(numbers) > limit:
+        summary += f' and {len(numbers) - limit} more'
+    return summary
+
+
+def receive_engraved_stock(item, department, engraved_numbers, unit_cost, added_by, lpo, supplied_by,
+                           delivery_number, date_added=None, batch_size=BULK_BATCH_SIZE):
+    """
+    Records a delivery of engraved units, one StockHistory record per engraved number,
+    and adds them to the department's quantity in one transaction.
+
+    All engraved numbers are validated before anything is written. The records are
+    written with `bulk_create` and the quantity is incremented once for the whole
+    delivery, so the number of queries does not grow with the number of units.
+    `bulk_create` does not send `post_save` signals, so the item's cost snapshot and
+    daily stock movement are refreshed and the inventory data version is bumped here
+    instead.
+
+    :param item: The inventory item received.
+    :param department: The department receiving the units.
+    :param engraved_numbers: The engraved numbers of the delivered units.
+    :param unit_cost: The cost of a single unit.
+    :param added_by: The user recording the delivery.
+    :param lpo: The LPO number of the delivery.
+    :param supplied_by: The supplier of the delivery.
+    :param delivery_number: The delivery number of the delivery.
+    :param date_added: Optional delivery date. Defaults to today.
+    :param batch_size: The number of records written per query.
+    :return: The number of units received.
+    :raises StockMovementError: If an engraved number or the unit cost is invalid; nothing is
+        written then.
+    """
+    engraved_numbers = validate_engraved_numbers(engraved_numbers, batch_size=batch_size)
+    unit_cost = clean_unit_cost(unit_cost)
+    date_added = date_added or timezone.now().date()
+
+    # total_cost is normally computed in StockHistory.save(), which bulk_create skips
+    stock = [
+        StockHistory(
+            item=item,
+            department=department,
+            quantity=1,  # Each engraved unit has a quantity of 1
+            unit_cost=unit_cost,
+            total_cost=unit_cost,
+            lpo=lpo,
+            supplied_by=supplied_by,
+            delivery_number=delivery_number,
+            engraved_number=engraved_number,
+            date_added=date_added,
+            added_by=added_by,
+        )
+        for engraved_number in engraved_numbers
+    ]
+
+    with transaction.atomic():
+        StockHistory.objects.bulk_create(stock, batch_size=batch_size)
+        increment_quantity(item, department, len(stock), unit_cost=unit_cost)
+        CostLayer.open_for(stock, batch_size=batch_size)
+        StockLedgerEntry.append_receipts(stock, batch_size=batch_size)
+        ItemCostSnapshot.refresh_for_items([item.id])
+        DailyStockMovement.refresh([(date_added, item.id, department.id)])
+        bump_data_version()
+    return len(stock)
+
+
+def issue_stock(quantity_entry_id, item, department, issued_to, quantity, issue_voucher_number, issued_by,
+                engraved_number=None):
+    """
+    Issues stock to an employee: decrements the quantity, marks the engraved unit as
+    issued if one is given, records the issuance and appends it to the stock ledger,
+    all in one transaction.
+
+    :param quantity_entry_id: The ID of the Quantity record the stock is issued from.
+    :param item: The inventory item issued.
+    :param department: The department the stock is issued to.
+    :param issued_to: The employee receiving the stock.
+    :param quantity: The number of units issued.
+    :param issue_voucher_number: The issue voucher number of the transaction.
+    :param issued_by: The user issuing the stock.
+    :param engraved_number: Optional engraved number of the single unit issued.
+    :return: The created IssuedOutHistory record.
+    :raises StockMovementError: If the stock is not available or the quantity record belongs to
+        another item or department; nothing is written then.
+    """
+    if quantity <= 0:
+        raise StockMovementError('Issued quantity must be greater than zero.')
+
+    with transaction.atomic():
+        quantity_entry = decrement_quantity(quantity_entry_id, quantity)
+        # The decrement is rolled back with the transaction if the record belongs to another holding
+        if quantity_entry.item_id != item.id or quantity_entry.department_id != department.id:
+            raise StockMovementError('Stock record does not match the item and department issued.')
+
+        stock = None
+        if engraved_number is not None:
+            # Lock the engraved unit and make sure it has not been issued already
+            stock = StockHistory.objects.select_for_update().filter(
+                item=item, department=department, engraved_number=engraved_number, issued=False
+            ).first()
+            if stock is None:
+                raise StockMovementError('Engraved item is not available for issuing.')
+            StockHistory.objects.filter(pk=stock.pk).update(issued=True)
+
+        # Take the cost of the issued units from the open layers of the holding
+        fifo_cost, = CostLayer.consume([(item.id, quantity_entry.department_id, quantity, stock and stock.pk)])
+        record = IssuedOutHistory.objects.create(
+            item=item,
+            description=item.description,
+            engraved_number=engraved_number,
+            quantity_issued_out=quantity,
+            issue_voucher_number=issue_voucher_number,
+            issued_to=issued_to,
+            department=department,
+            office=issued_to.office,
+            issued_by=issued_by,
+            fifo_cost=fifo_cost,
+            average_cost=_average_cost(quantity_entry, quantity),
+        )
+        StockLedgerEntry.append_issues([record])
+    return record
+
+
+def _average_cost(quantity_entry, quantity):
+    # Cost of issued units at the moving average cost of the holding, which issues do not change
+    return (quantity * quantity_entry.average_cost).quantize(Decimal('0.01'), ROUND_HALF_UP)
+
+
+def _parse_voucher_line(index, line):
+    # Normalize one voucher line to (item ID, quantity, engraved numbers or None, employee ID or None)
+    if not isinstance(line, dict):
+        raise StockMovementError(f'Line {index}: invalid line.')
+    try:
+        item_id = int(line['item_id'])
+        issued_to_id = int(line['issued_to']) if line.get('issued_to') not in (None, '') else None
+        engraved_numbers = line.get('engraved_numbers')
+        if engraved_numbers is not None:
+            engraved_numbers = [str(number).strip() for number in engraved_numbers]
+            quantity = len(engraved_numbers)
+        else:
+            quantity = int(line['quantity'])
+    except (KeyError, TypeError, ValueError):
+        raise StockMovementError(f'Line {index}: item_id and quantity or engraved_numbers are required.')
+    if quantity <= 0:
+        raise StockMovementError(f'Line {index}: issued quantity must be greater than zero.')
+    return item_id, quantity, engraved_numbers, issued_to_id
+
+
+def issue_voucher(issue_voucher_number, department, lines, issued_by, issued_to=None, batch_size=BULK_BATCH_SIZE):
+    """
+    Issues every line of an issue voucher in one transaction.
+
+    Each line is a dict with an `item_id` and either a `quantity` or a list of
+    `engraved_numbers`, which engraved items require, and optionally an `issued_to` employee ID overriding the
+    voucher's employee. All referenced items, employees, quantity records and engraved
+    units are fetched up front in a few queries, and every line is validated before
+    anything is written, so either the whole voucher is issued or nothing is. The
+    quantities are decremented in a single conditional UPDATE, and the issuance records
+    are written with `bulk_create`; engraved units get one record each, and every
+    record is appended to the stock ledger.
+
+    :param issue_voucher_number: The issue voucher number shared by all lines.
+    :param department: The department the stock is issued to.
+    :param lines: A list of voucher lines.
+    :param issued_by: The user issuing the stock.
+    :param issued_to: Optional employee receiving the lines that do not name one.
+    :param batch_size: The number of records written or looked up per query.
+    :return: The created IssuedOutHistory records.
+    :raises StockMovementError: If any line is invalid or not available; the message
+        lists the offending lines and nothing is written then.
+    """
+    if not issue_voucher_number:
+        raise StockMovementError('An issue voucher number is required.')
+    if not lines:
+        raise StockMovementError('The voucher has no lines.')
+
+    parsed = [_parse_voucher_line(index, line) for index, line in enumerate(lines, start=1)]
+    item_ids = {item_id for item_id, _, _, _ in parsed}
+    employee_ids = {employee_id for _, _, _, employee_id in parsed if employee_id is not None}
+    engraved_numbers = [number for _, _, numbers, _ in parsed if numbers for number in numbers]
+
+    with transaction.atomic():
+        # Fetch everything the voucher refers to up front
+        items = InventoryItem.objects.in_bulk(item_ids)
+        employees = Employee.objects.filter(department=department).in_bulk(employee_ids)
+        quantities = {
+            entry.item_id: entry
+            for entry in Quantity.objects.select_for_update().filter(department=department, item_id__in=item_ids)
+        }
+        available_units = {}
+        for start in range(0, len(engraved_numbers), batch_size):
+            for stock in StockHistory.objects.select_for_update().filter(
+                department=department, item_id__in=item_ids,
+                engraved_number__in=engraved_numbers[start:start + batch_size], issued=False,
+            ).only('id', 'item_id', 'engraved_number'):
+                available_units[(stock.item_id, stock.engraved_number)] = stock.id
+
+        # Validate every line before writing anything
+        errors = []
+        requested = {}
+        seen_units = set()
+        for index, (item_id, quantity, numbers, employee_id) in enumerate(parsed, start=1):
+            if item_id not in items:
+                errors.append(f'Line {index}: item not found.')
+                continue
+            # Engraved units must be named, or the units marked available drift from the quantity
+            if items[item_id].engraved and numbers is None:
+                errors.append(f'Line {index}: {items[item_id].item_name} is engraved; list the engraved numbers '
+                              f'issued instead of a quantity.')
+            if employee_id is None and issued_to is None:
+                errors.append(f'Line {index}: no employee to issue to.')
+            elif employee_id is not None and employee_id not in employees:
+                errors.append(f'Line {index}: employee not found in the department.')
+            repeated, unavailable = set(), set()
+            for number in numbers or ():
+                if (item_id, number) in seen_units:
+                    repeated.add(number)
+                elif (item_id, number) not in available_units:
+                    unavailable.add(number)
+                seen_units.add((item_id, number))
+            if repeated:
+                errors.append(f'Line {index}: engraved numbers listed more than once: {_summarize(repeated)}.')
+            if unavailable:
+                errors.append(f'Line {index}: engraved items not available for issuing: {_summarize(unavailable)}.')
+            requested[item_id] = requested.get(item_id, 0) + quantity
+
+        for item_id, quantity in requested.items():
+            if item_id not in items:
+                continue
+            entry = quantities.get(item_id)
+            if entry is None or entry.quantity < quantity:
+                available = entry.quantity if entry else 0
+                errors.append(f'{items[item_id].item_name}: issued quantity {quantity} cannot exceed '
+                              f'available quantity {available}.')
+        if errors:
+            raise StockMovementError(' '.join(errors))
+
+        # Decrement every quantity in one UPDATE that only matches rows still holding enough stock
+        guard = Q()
+        for item_id, quantity in requested.items():
+            guard |= Q(pk=quantities[item_id].pk, quantity__gte=quantity)
+        updated = Quantity.objects.filter(guard).update(quantity=F('quantity') - Case(
+            *[When(pk=quantities[item_id].pk, then=Value(quantity)) for item_id, quantity in requested.items()],
+            output_field=PositiveIntegerField(),
+        ))
+        if updated != len(requested):
+            raise StockMovementError('Issued quantity cannot exceed available quantity.')
+
+        # Mark the engraved units as issued
+        unit_ids = [available_units[unit] for unit in seen_units]
+        for start in range(0, len(unit_ids), batch_size):
+            StockHistory.objects.filter(pk__in=unit_ids[start:start + batch_size]).update(issued=True)
+
+        records = []
+        consumed = []
+        for item_id, quantity, numbers, employee_id in parsed:
+            item = items[item_id]
+            employee = employees[employee_id] if employee_id is not None else issued_to
+            common = dict(item=item, description=item.description, issue_voucher_number=issue_voucher_number,
+                          issued_to=employee, department=department, office=employee.office, issued_by=issued_by)
+            if numbers:
+                for number in numbers:
+                    records.append(IssuedOutHistory(engraved_number=number, quantity_issued_out=1, **common))
+                    consumed.append((item_id, department.id, 1, available_units[(item_id, number)]))
+            else:
+                records.append(IssuedOutHistory(quantity_issued_out=quantity, **common))
+                consumed.append((item_id, department.id, quantity, None))
+
+        # Cost every record from the open layers of its holding, consumed in voucher order
+        for record, fifo_cost in zip(records, CostLayer.consume(consumed, batch_size=batch_size)):
+            record.fifo_cost = fifo_cost
+            record.average_cost = _average_cost(quantities[record.item_id], record.quantity_issued_out)
+        records = IssuedOutHistory.objects.bulk_create(records, batch_size=batch_size)
+        StockLedgerEntry.append_issues(records, batch_size=batch_size)
+
+        # bulk_create and update() do not send signals
+        ItemCostSnapshot.refresh_for_items(requested)
+        DailyStockMovement.refresh(
+            (timezone.localtime(record.date).date(), record.item_id, record.department_id) for record in records
+        )
+        bump_data_version()
+    return records
@@ -0,0 +1,140 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from inventory.cache import bump_data_version, invalidate_departments
+from inventory.models import StockHistory, ItemCostSnapshot, Quantity, IssuedOutHistory, InventoryItem, StaffDepartment, \
+    DailyStockMovement, CostLayer
+
+
+@receiver(post_save, sender=StockHistory)
+def open_cost_layer(sender, instance, created, **kwargs):
+    """
+    Opens the cost layer of a new stock history record. Registered before
+    `refresh_item_cost_snapshot`, so the item's FIFO cost includes the new layer.
+
+    :param sender: The model class that sent the signal.
+    :param instance: The record that was saved.
+    :param created: Whether the record was created.
+    """
+    if created:
+        CostLayer.open_for([instance])
+
+
+@receiver(post_save, sender=StockHistory)
+@receiver(post_delete, sender=StockHistory)
+@receiver(post_save, sender=IssuedOutHistory)
+@receiver(post_delete, sender=IssuedOutHistory)
+@receiver(post_save, sender=Quantity)
+@receiver(post_delete, sender=Quantity)
+def refresh_item_cost_snapshot(sender, instance, **kwargs):
+    """
+    Keeps the cost snapshot of an item in sync with its stock history and holdings.
+
+    Called whenever a stock history, issued-out or quantity record is saved or
+    deleted, so that the materialized latest unit cost, purchase date and condition of
+    the affected item always reflect its most recent stock history record, and its FIFO
+    cost the units currently on hand.
+
+    When a record is moved to another item, the item it is moved away from, remembered
+    by `remember_stock_movement_key` or `remember_quantity_item`, is refreshed as well.
+
+    :param sender: The model class that sent the signal.
+    :param instance: The record that was saved or deleted.
+    """
+    previous = getattr(instance, '_previous_item_id', None)
+    ItemCostSnapshot.refresh_for_items({instance.item_id, previous} - {None})
+
+
+def stock_movement_key(instance):
+    """
+    Returns the daily stock movement rollup key a stock history or issued-out record
+    counts towards.
+
+    :param instance: A StockHistory or IssuedOutHistory record.
+    :return: A (date, item ID, department ID) tuple; the date is None if not set yet.
+    """
+    if isinstance(instance, IssuedOutHistory):
+        day = timezone.localtime(instance.date).date() if instance.date else None
+    else:
+        day = instance.date_added
+    return day, instance.item_id, instance.department_id
+
+
+@receiver(pre_save, sender=StockHistory)
+@receiver(pre_save, sender=IssuedOutHistory)
+def remember_stock_movement_key(sender, instance, **kwargs):
+    """
+    Remembers the rollup key and item of a record before it is updated, so that the
+    day, item or department it is moved away from is refreshed as well.
+
+    :param sender: The model class that sent the signal.
+    :param instance: The record about to be saved.
+    """
+    previous = sender.objects.filter(pk=instance.pk).first() if instance.pk else None
+    instance._previous_movement_key = stock_movement_key(previous) if previous else None
+    instance._previous_item_id = previous.item_id if previous else None
+
+
+@receiver(pre_save, sender=Quantity)
+def remember_quantity_item(sender, instance, **kwargs):
+    """
+    Remembers the item of a quantity record before it is updated, so that the cost
+    snapshot of the item it is moved away from is refreshed as well.
+
+    :param sender: The model class that sent the signal.
+    :param instance: The record about to be saved.
+    """
+    instance._previous_item_id = (
+        sender.objects.filter(pk=instance.pk).values_list('item_id', flat=True).first() if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=StockHistory)
+@receiver(post_delete, sender=StockHistory)
+@receiver(post_save, sender=IssuedOutHistory)
+@receiver(post_delete, sender=IssuedOutHistory)
+def refresh_daily_stock_movement(sender, instance, **kwargs):
+    """
+    Keeps the daily stock movement rollup in sync with the stock history and
+    issued-out history.
+
+    :param sender: The model class that sent the signal.
+    :param instance: The record that was saved or deleted.
+    """
+    keys = [stock_movement_key(instance)]
+    previous = getattr(instance, '_previous_movement_key', None)
+    if previous:
+        keys.append(previous)
+    DailyStockMovement.refresh(keys)
+
+
+@receiver(post_save, sender=StockHistory)
+@receiver(post_delete, sender=StockHistory)
+@receiver(post_save, sender=Quantity)
+@receiver(post_delete, sender=Quantity)
+@receiver(post_save, sender=IssuedOutHistory)
+@receiver(post_delete, sender=IssuedOutHistory)
+@receiver(post_save, sender=InventoryItem)
+@receiver(post_delete, sender=InventoryItem)
+@receiver(post_save, sender=StaffDepartment)
+@receiver(post_delete, sender=StaffDepartment)
+def invalidate_inventory_snapshots(sender, **kwargs):
+    """
+    Bumps the inventory data version whenever data feeding the cached snapshots is
+    written, so the dashboard and other cached snapshots are rebuilt on their next read.
+
+    :param sender: The model class that sent the signal.
+    """
+    bump_data_version()
+
+
+@receiver(post_save, sender=StaffDepartment)
+@receiver(post_delete, sender=StaffDepartment)
+def refresh_department_list(sender, **kwargs):
+    """
+    Invalidates the cached department list whenever a department is saved or deleted.
+
+    :param sender: The model class that sent the signal.
+    """
+    invalidate_departments()
@@ -0,0 +1,316 @@
+import csv
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from inventory.jobs import get_artifacts_dir, run_report_job
+from inventory.metrics import registry
+from inventory.models import InventoryItem, StaffDepartment, Employee, Quantity, StockHistory, IssuedOutHistory, \
+    CostLayer, ReportJob, StockLedgerEntry, StockSnapshot
+from inventory.pagination import InvalidCursor, KeysetPaginator, decode_cursor, encode_cursor
+from inventory.services import StockMovementError, adjust_quantity, clean_unit_cost, issue_stock, issue_voucher, \
+    receive_engraved_stock, receive_stock
+from inventory.valuation import consume_layers, moving_average, replay_costs
+
+
+def layer(stock_id, remaining, unit_cost):
+    return {'stock_id': stock_id, 'remaining': remaining, 'unit_cost': Decimal(unit_cost)}
+
+
+class ValuationTests(SimpleTestCase):
+    def test_consume_layers_takes_the_oldest_layers_first(self):
+        layers = [layer(1, 3, '10.00'), layer(2, 2, '20.00')]
+        cost, changed = consume_layers(layers, 4)
+        self.assertEqual(cost, Decimal('50.00'))
+        self.assertEqual([entry['remaining'] for entry in layers], [0, 1])
+        self.assertEqual([entry['stock_id'] for entry in changed], [1, 2])
+
+    def test_consume_layers_continues_from_a_partially_consumed_layer(self):
+        layers = [layer(1, 3, '10.00'), layer(2, 2, '20.00')]
+        consume_layers(layers, 2)
+        cost, _ = consume_layers(layers, 2)
+        self.assertEqual(cost, Decimal('30.00'))
+        self.assertEqual([entry['remaining'] for entry in layers], [0, 1])
+
+    def test_consume_layers_costs_units_beyond_the_open_layers_at_the_newest_cost(self):
+        layers = [layer(1, 1, '10.00'), layer(2, 1, '20.00')]
+        cost, _ = consume_layers(layers, 3)
+        self.assertEqual(cost, Decimal('50.00'))
+        self.assertEqual([entry['remaining'] for entry in layers], [0, 0])
+
+    def test_consume_layers_issues_an_engraved_unit_from_its_own_layer(self):
+        layers = [layer(1, 1, '10.00'), layer(2, 1, '25.00')]
+        cost, changed = consume_layers(layers, 1, stock_id=2)
+        self.assertEqual(cost, Decimal('25.00'))
+        self.assertEqual([entry['stock_id'] for entry in changed], [2])
+
+    def test_moving_average_weights_the_units_held(self):
+        self.assertEqual(moving_average(3, Decimal('10'), 1, Decimal('11')), Decimal('10.25'))
+        # Receiving into an empty or overdrawn holding starts from the receipt's cost
+        self.assertEqual(moving_average(-2, Decimal('99'), 4, Decimal('5')), Decimal('5'))
+
+    def test_replay_costs_applies_receipts_before_the_issues_of_the_same_day(self):
+        day = date(2024, 1, 10)
+        receipts = [
+            (1, 7, 8, day, 2, Decimal('10.00'), None),
+            (2, 7, 8, day + timedelta(days=1), 2, Decimal('13.00'), None),
+        ]
+        issues = [(100, 7, 8, day, 1, None), (101, 7, 8, day + timedelta(days=1), 2, None)]
+        remaining, issue_costs, averages = replay_costs(receipts, issues)
+        self.assertEqual(remaining, {1: 0, 2: 1})
+        self.assertEqual(issue_costs[100], (Decimal('10.00'), Decimal('10.00')))
+        # One unit at 10 is left when the second receipt moves the average to (10 + 26) / 3
+        self.assertEqual(issue_costs[101], (Decimal('23.00'), Decimal('24.00')))
+        self.assertEqual(averages[(7, 8)], Decimal('12'))
+
+
+class CursorTests(SimpleTestCase):
+    def test_cursor_round_trip(self):
+        cursor = encode_cursor(['2024-01-10T08:00:00+00:00', 42], previous=True)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor), (['2024-01-10T08:00:00+00:00', 42], True))
+
+    def test_malformed_cursor_is_rejected(self):
+        for cursor in ('not-a-cursor', encode_cursor([1])[:-2] + '!!', 'e30'):
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(cursor)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class InventoryTestCase(TestCase):
+    """
+    Creates a user, two departments with an employee each and an inventory item, and
+    records stock movements through the services.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('clerk', 'clerk@example.com', 'clerk')
+        cls.department = StaffDepartment.objects.create(Department_name='Registry', added_by=cls.user)
+        cls.other_department = StaffDepartment.objects.create(Department_name='Finance', added_by=cls.user)
+        cls.employee = Employee.objects.create(name='Clerk', department=cls.department, office='101')
+        cls.item = InventoryItem.objects.create(item_name='Toner', description='Black toner', added_by=cls.user)
+
+    def receive(self, quantity, unit_cost, date_added=None, department=None):
+        return receive_stock(StockHistory(
+            item=self.item, department=department or self.department, quantity=quantity,
+            unit_cost=Decimal(unit_cost), lpo='LPO-1', supplied_by='Supplier', delivery_number='DN-1',
+            date_added=date_added or timezone.localdate(), added_by=self.user,
+        ))
+
+    def holding(self, department=None):
+        return Quantity.objects.get(item=self.item, department=department or self.department)
+
+    def issue(self, quantity, department=None):
+        return issue_stock(self.holding(department).pk, self.item, department or self.department, self.employee,
+                           quantity, 'IVN-1', self.user)
+
+
+class StockMovementTests(InventoryTestCase):
+    def test_issue_consumes_fifo_layers_and_costs_the_moving_average(self):
+        self.receive(3, '10.00')
+        self.receive(1, '11.00')
+        self.assertEqual(self.holding().average_cost, Decimal('10.2500'))
+
+        record = self.issue(2)
+        self.assertEqual(record.fifo_cost, Decimal('20.00'))
+        self.assertEqual(record.average_cost, Decimal('20.50'))
+        record = self.issue(2)
+        self.assertEqual(record.fifo_cost, Decimal('21.00'))
+        self.assertEqual(list(CostLayer.objects.order_by('stock_id').values_list('remaining', flat=True)), [0, 0])
+
+    def test_issuing_more_than_is_available_writes_nothing(self):
+        self.receive(2, '10.00')
+        with self.assertRaisesMessage(StockMovementError, 'cannot exceed available quantity'):
+            self.issue(3)
+        self.assertEqual(self.holding().quantity, 2)
+        self.assertFalse(IssuedOutHistory.objects.exists())
+        self.assertEqual(CostLayer.objects.get().remaining, 2)
+
+    def test_issue_rejects_a_quantity_record_of_another_department(self):
+        self.receive(2, '10.00')
+        with self.assertRaises(StockMovementError):
+            issue_stock(self.holding().pk, self.item, self.other_department, self.employee, 1, 'IVN-1', self.user)
+        self.assertEqual(self.holding().quantity, 2)
+
+    def test_voucher_requires_engraved_numbers_for_engraved_items(self):
+        self.item.engraved = True
+        self.item.save()
+        receive_engraved_stock(self.item, self.department, ['E-1', 'E-2'], '15.00', self.user, 'LPO-1', 'Supplier',
+                               'DN-1')
+        with self.assertRaisesMessage(StockMovementError, 'is engraved'):
+            issue_voucher('IVN-2', self.department, [{'item_id': self.item.pk, 'quantity': 1}], self.user,
+                          issued_to=self.employee)
+        self.assertEqual(self.holding().quantity, 2)
+
+        issue_voucher('IVN-2', self.department, [{'item_id': self.item.pk, 'engraved_numbers': ['E-2']}], self.user,
+                      issued_to=self.employee)
+        self.assertEqual(self.holding().quantity, 1)
+        self.assertEqual(list(StockHistory.objects.filter(issued=True).values_list('engraved_number', flat=True)),
+                         ['E-2'])
+
+    def test_invalid_unit_costs_are_rejected(self):
+        for unit_cost in ('NaN', 'Infinity', '-1', '100000000', 'abc', None):
+            with self.assertRaisesMessage(StockMovementError, 'Invalid unit cost.'):
+                clean_unit_cost(unit_cost)
+        self.assertEqual(clean_unit_cost('12.345'), Decimal('12.35'))
+        with self.assertRaises(StockMovementError):
+            self.receive(1, '-5.00')
+        self.assertFalse(StockHistory.objects.exists())
+
+
+class StockLedgerTests(InventoryTestCase):
+    def test_reconcile_reports_and_repairs_drifted_quantities(self):
+        self.receive(5, '10.00')
+        self.issue(2)
+        self.assertEqual(StockLedgerEntry.reconcile(), [])
+
+        Quantity.objects.filter(pk=self.holding().pk).update(quantity=9)
+        drift = [(self.item.pk, self.department.pk, 9, 3)]
+        self.assertEqual(StockLedgerEntry.reconcile(), drift)
+        self.assertEqual(self.holding().quantity, 9)
+        self.assertEqual(StockLedgerEntry.reconcile(apply=True), drift)
+        self.assertEqual(self.holding().quantity, 3)
+        self.assertEqual(StockLedgerEntry.reconcile(), [])
+
+    def test_adjustments_are_appended_to_the_ledger(self):
+        self.receive(5, '10.00')
+        adjust_quantity(self.holding().pk, 4, 'Stock count')
+        self.assertEqual(self.holding().quantity, 4)
+        entry = StockLedgerEntry.objects.get(kind=StockLedgerEntry.ADJUSTMENT)
+        self.assertEqual((entry.change, entry.note), (-1, 'Stock count'))
+        self.assertEqual(StockLedgerEntry.reconcile(), [])
+        with self.assertRaises(StockMovementError):
+            adjust_quantity(self.holding().pk, -1, 'Stock count')
+
+
+class StockSnapshotTests(InventoryTestCase):
+    def test_balances_between_snapshots_add_the_movements_since_the_latest_one(self):
+        self.receive(5, '10.00', date_added=date(2024, 1, 10))
+        self.receive(3, '10.00', date_added=date(2024, 2, 10))
+        self.receive(2, '10.00', date_added=date(2024, 3, 10))
+        self.receive(4, '10.00', date_added=date(2024, 2, 20), department=self.other_department)
+        StockSnapshot.take(date(2024, 1, 31))
+        StockSnapshot.take(date(2024, 2, 29))
+
+        holding, other = (self.item.pk, self.department.pk), (self.item.pk, self.other_department.pk)
+        self.assertEqual(StockSnapshot.balances_as_of(date(2024, 1, 15)), (None, {holding: 5}))
+        self.assertEqual(StockSnapshot.balances_as_of(date(2024, 2, 15)), (date(2024, 1, 31), {holding: 8}))
+        self.assertEqual(StockSnapshot.balances_as_of(date(2024, 3, 15)),
+                         (date(2024, 2, 29), {holding: 10, other: 4}))
+        self.assertEqual(StockSnapshot.balances_as_of(date(2024, 3, 15), department_id=self.other_department.pk),
+                         (date(2024, 2, 29), {other: 4}))
+
+
+class KeysetPaginatorTests(InventoryTestCase):
+    def setUp(self):
+        self.receive(10, '10.00')
+        self.records = [self.issue(1) for _ in range(7)]
+        # Every record shares one date, so only the ID breaks the ties
+        IssuedOutHistory.objects.update(date=timezone.now().replace(microsecond=0))
+        self.ids = sorted((record.pk for record in self.records), reverse=True)
+
+    def test_pages_cover_duplicate_sort_keys_exactly_once(self):
+        paginator = KeysetPaginator(IssuedOutHistory.objects.all(), per_page=3)
+        pages, cursor = [], None
+        while True:
+            page = paginator.page(cursor)
+            pages.append([record.pk for record in page])
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEqual(pages, [self.ids[:3], self.ids[3:6], self.ids[6:]])
+
+    def test_previous_cursor_returns_the_preceding_page(self):
+        paginator = KeysetPaginator(IssuedOutHistory.objects.all(), per_page=3)
+        second = paginator.page(paginator.page().next_cursor)
+        self.assertEqual([record.pk for record in second], self.ids[3:6])
+        first = paginator.page(second.previous_cursor)
+        self.assertEqual([record.pk for record in first], self.ids[:3])
+        self.assertFalse(first.has_previous())
+
+    def test_cursor_with_the_wrong_number_of_values_is_rejected(self):
+        paginator = KeysetPaginator(IssuedOutHistory.objects.all(), per_page=3)
+        with self.assertRaises(InvalidCursor):
+            paginator.page(encode_cursor([1]))
+
+
+class ExportTests(InventoryTestCase):
+    def test_xlsx_export_opens_with_a_spreadsheet_reader(self):
+        receive_stock(StockHistory(
+            item=self.item, department=self.department, quantity=3, unit_cost=Decimal('10.50'),
+            lpo='=1+1', supplied_by='<Smith> & Sons\x07\x1f', delivery_number='DN\x00-1',
+            date_added=date(2024, 1, 2), added_by=self.user,
+        ))
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('all_delivered_export'), {'format': 'xlsx'})
+        workbook = load_workbook(BytesIO(b''.join(response.streaming_content)), read_only=True)
+        header, row = workbook['Delivered Items'].iter_rows(values_only=True)
+
+        self.assertEqual(header[0], 'Item Name')
+        values = dict(zip(header, row))
+        self.assertEqual(values['Supplied By'], '<Smith> & Sons')
+        self.assertEqual(values['Delivery Number'], 'DN-1')
+        self.assertEqual(values['LPO'], '=1+1')
+        self.assertEqual(values['Quantity'], 3)
+        self.assertEqual(values['Unit Cost (UGX)'], 10.5)
+        self.assertEqual(values['Remaining Quantity'], 3)
+
+
+class ReportJobTests(InventoryTestCase):
+    def setUp(self):
+        artifacts_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(artifacts_dir.cleanup)
+        self.enterContext(override_settings(REPORT_ARTIFACTS_DIR=artifacts_dir.name))
+        # Names outside Latin-1 must survive every artifact format
+        department = StaffDepartment.objects.create(Department_name='Отдел закупок 東京', added_by=self.user)
+        self.receive(4, '2500.00', department=department)
+
+    def run_job(self, export_format):
+        job = ReportJob.objects.create(kind='combined', format=export_format, created_by=self.user)
+        self.assertEqual(run_report_job(job.pk), ReportJob.DONE)
+        job.refresh_from_db()
+        return get_artifacts_dir() / job.artifact
+
+    def test_xlsx_report_keeps_non_latin_names(self):
+        workbook = load_workbook(self.run_job('xlsx'), read_only=True)
+        rows = list(workbook['Report'].iter_rows(values_only=True))
+        self.assertEqual(rows[0][0], 'Combined Report')
+        self.assertIn(('Отдел закупок 東京', 4, 10000), [row[:3] for row in rows])
+
+    def test_csv_and_html_reports_keep_non_latin_names(self):
+        with open(self.run_job('csv'), newline='', encoding='utf-8') as file:
+            self.assertIn(['Отдел закупок 東京', '4', '10000'], list(csv.reader(file)))
+        self.assertIn('Отдел закупок 東京', self.run_job('html').read_text(encoding='utf-8'))
+
+    def test_pdf_jobs_fail(self):
+        job = ReportJob.objects.create(kind='combined', format='pdf', created_by=self.user)
+        with self.assertLogs('inventory.jobs', 'ERROR'):
+            self.assertEqual(run_report_job(job.pk), ReportJob.FAILED)
+        job.refresh_from_db()
+        self.assertEqual(job.error, 'Unsupported report format: pdf')
+
+
+class RequestMetricsTests(InventoryTestCase):
+    def test_streamed_export_is_recorded_once_its_body_is_sent(self):
+        self.receive(3, '10.00')
+        self.client.force_login(self.user)
+        registry.reset()
+
+        response = self.client.get(reverse('all_delivered_export'))
+        self.assertTrue(response.streaming)
+        self.assertNotIn('Server-Timing', response)
+        self.assertNotIn('all_delivered_export', registry.render())
+        b''.join(response.streaming_content)
+        response.close()
+
+        metrics = registry.render()
+        self.assertIn('inventory_db_queries_total{view="all_delivered_export"}', metrics)
+        self.assertNotIn('inventory_db_queries_total{view="all_delivered_export"} 0\n', metrics)
@@ -3,7 +3,9 @@ from inventory.views import dashboard, inventory, add_category, add_department,
     combined_report, department_report, inflow_report, outflow_report, department_dashboard, department_item_details, \
     cost_report, outflow_dashboard, ivn_list_view, ivn_detail_view, all_delivered_view, delivery_numbers_list, \
     get_delivery_details, lpo_numbers_list, get_lpo_details, add_engraved_stock, engraved_issue_out, AllIssuedOutView, \
-    AssetView, employee_list, employee_create, employee_update, employee_delete
+    AssetView, employee_list, employee_create, employee_update, employee_delete, all_delivered_export, \
+    all_delivered_data, issue_out_voucher, report_job_create, report_job_status, report_job_download, metrics, \
+    stock_as_of
 
 urlpatterns = [
     path('', dashboard, name='dashboard'),
@@ -17,17 +19,24 @@ urlpatterns = [
     path('add-employee', add_employee, name='add_employee'),
     path('issue_out/', issue_out, name='issue_out'),
     path('issue_out_engraved/', engraved_issue_out, name='issue_out_engraved'),
+    path('issue_out_voucher/', issue_out_voucher, name='issue_out_voucher'),
     path('report/combined/', combined_report, name='combined_report'),
     path('report/department/<int:department_id>/', department_report, name='department_report'),
     path('report/in-flow/', inflow_report, name='in_flow_report'),
     path('report/outflow-report/', outflow_report, name='outflow_report'),
     path('report/cost-report/', cost_report, name='cost-report'),
+    path('report/jobs/', report_job_create, name='report_job_create'),
+    path('report/jobs/<int:job_id>/', report_job_status, name='report_job_status'),
+    path('report/jobs/<int:job_id>/download/', report_job_download, name='report_job_download'),
+    path('report/stock-as-of/', stock_as_of, name='stock_as_of'),
     path('department/<int:department_id>/', department_dashboard, name='department_dashboard'),
     path('department/<int:department_id>/item/<int:item_id>/', department_item_details, name='department_item_details'),
     path('inventory/issued-out', outflow_dashboard, name='outflow_dashboard'),
     path('ivn-list/', ivn_list_view, name='ivn_list'),
     path('ivn-detail/', ivn_detail_view, name='ivn_detail'),
     path('all-delivered/', all_delivered_view, name='all_delivered'),
+    path('all-delivered/data/', all_delivered_data, name='all_delivered_data'),
+    path('all-delivered/export/', all_delivered_export, name='all_delivered_export'),
     path('delivery_numbers/', delivery_numbers_list, name='delivery_numbers_list'),
     path('get_delivery_details/<str:delivery_number>/', get_delivery_details, name='get_delivery_details'),
     path('lpo_numbers/', lpo_numbers_list, name='lpo_numbers_list'),
@@ -38,4 +47,5 @@ urlpatterns = [
     path('employees/create/', employee_create, name='employee_create'),
     path('employees/<int:pk>/update/', employee_update, name='employee_update'),
     path('employees/<int:pk>/delete/', employee_delete, name='employee_delete'),
+    path('metrics', metrics, name='metrics'),
 ]
\ No newline at end of file
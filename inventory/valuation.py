@@ -0,0 +1,225 @@
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, NullIf
+
+# The ItemCostSnapshot field holding the unit cost of every valuation method
+VALUATION_METHODS = {
+    'latest': 'unit_cost',
+    'average': 'average_cost',
+    'fifo': 'fifo_cost',
+}
+
+CENT = Decimal('0.01')
+
+
+def get_valuation_method(method=None):
+    """
+    Validates a valuation method name, falling back to the `INVENTORY_VALUATION_METHOD`
+    setting.
+
+    :param method: Optional name of a valuation method, one of `VALUATION_METHODS`.
+    :return: The name of the valuation method.
+    :raises ValueError: If the method is not one of `VALUATION_METHODS`.
+    """
+    method = method or getattr(settings, 'INVENTORY_VALUATION_METHOD', 'latest')
+    if method not in VALUATION_METHODS:
+        raise ValueError(f"Unknown valuation method {method!r}, expected one of {', '.join(VALUATION_METHODS)}.")
+    return method
+
+
+def unit_cost(method=None, item='item'):
+    """
+    Returns an expression for the unit cost of an item under a valuation method.
+
+    The cost is read from the item's cost snapshot, which holds exactly one row per
+    item, so joining it never multiplies the rows of the surrounding query.
+
+    :param method: Optional valuation method, see `get_valuation_method`.
+    :param item: The lookup of the inventory item from the queried model, or an empty
+        string when querying inventory items.
+    :return: An F expression.
+    """
+    prefix = f'{item}__' if item else ''
+    return F(f'{prefix}cost_snapshot__{VALUATION_METHODS[get_valuation_method(method)]}')
+
+
+def holding_value(method=None):
+    """
+    Returns an expression for the value of a Quantity record under a valuation method.
+
+    Latest cost values the holding at the latest unit cost of its item. Weighted average
+    values it at the moving average cost of the holding. FIFO values it at the remaining
+    units of its open cost layers, read with a subquery over the open layers of the
+    holding only.
+
+    :param method: Optional valuation method, see `get_valuation_method`.
+    :return: An expression to use in annotations and aggregates of Quantity querysets.
+    """
+    from inventory.models import CostLayer
+
+    method = get_valuation_method(method)
+    if method == 'average':
+        return F('quantity') * F('average_cost')
+    if method == 'fifo':
+        layers = CostLayer.objects.filter(
+            item=OuterRef('item'), department=OuterRef('department'), remaining__gt=0) \
+            .order_by().values('item').annotate(value=Sum(F('remaining') * F('unit_cost'))).values('value')
+        return Coalesce(Subquery(layers, output_field=DecimalField()), 0, output_field=DecimalField())
+    return F('quantity') * unit_cost('latest')
+
+
+def issued_cost(method=None):
+    """
+    Returns an expression for the cost of an IssuedOutHistory record under a valuation
+    method: the cost of the consumed layers for FIFO, the moving average cost at the
+    time of issue for weighted average, or the issued quantity at the latest unit cost.
+
+    :param method: Optional valuation method, see `get_valuation_method`.
+    :return: An expression to use in annotations and aggregates of IssuedOutHistory querysets.
+    """
+    method = get_valuation_method(method)
+    if method == 'average':
+        return F('average_cost')
+    if method == 'fifo':
+        return F('fifo_cost')
+    return F('quantity_issued_out') * unit_cost('latest')
+
+
+def issued_unit_cost(method=None):
+    """
+    Returns an expression for the unit cost of an IssuedOutHistory record under a
+    valuation method, the cost of the record divided by its issued quantity.
+
+    :param method: Optional valuation method, see `get_valuation_method`.
+    :return: An expression to use in annotations and aggregates of IssuedOutHistory querysets.
+    """
+    method = get_valuation_method(method)
+    if method == 'latest':
+        return unit_cost(method)
+    # SQLite stores whole amounts as integers, which would otherwise be divided as integers
+    return ExpressionWrapper(Value(Decimal(1)) * issued_cost(method) / NullIf(F('quantity_issued_out'), 0),
+                             output_field=DecimalField())
+
+
+def summarize_holdings(quantities, *fields, method=None, **expressions):
+    """
+    Totals the quantity and value of holdings per group in one grouped query.
+
+    The groups are given like the arguments of `QuerySet.values()`, for example
+    `summarize_holdings(quantities, category=F('item__category'))`.
+
+    :param quantities: A queryset of Quantity records.
+    :param fields: Field lookups to group by.
+    :param method: Optional valuation method, see `get_valuation_method`.
+    :param expressions: Expressions to group by, keyed by the name they are returned under.
+    :return: A queryset of dictionaries with the group keys, 'total_quantity' and 'total_value'.
+    """
+    return quantities.values(*fields, **expressions).annotate(
+        total_quantity=Coalesce(Sum('quantity'), 0),
+        total_value=Coalesce(Sum(holding_value(method)), 0, output_field=DecimalField()),
+    ).order_by(*fields, *expressions)
+
+
+def moving_average(quantity, average, received, cost):
+    """
+    Returns the moving average unit cost of a holding after a receipt.
+
+    :param quantity: The units held before the receipt.
+    :param average: The moving average unit cost before the receipt.
+    :param received: The units received.
+    :param cost: The unit cost of the receipt.
+    :return: The new moving average unit cost as a Decimal.
+    """
+    quantity = max(quantity, 0)
+    if quantity + received <= 0:
+        return Decimal(average)
+    return (quantity * Decimal(average) + received * Decimal(cost)) / (quantity + received)
+
+
+def consume_layers(layers, quantity, stock_id=None):
+    """
+    Consumes `quantity` units from the open cost layers of one holding.
+
+    Layers are consumed oldest first. An engraved unit is issued from the layer of its
+    own stock history record when `stock_id` names an open one. Units beyond the open
+    layers, which only occur when the holding was edited outside the stock movement
+    services, are costed at the unit cost of the newest layer.
+
+    :param layers: The layers of the holding, oldest first, as dictionaries with 'stock_id',
+        'remaining' and 'unit_cost' keys. Their 'remaining' counts are updated in place.
+    :param quantity: The number of units to consume.
+    :param stock_id: Optional ID of the stock history record of an engraved unit.
+    :return: A tuple of the cost of the consumed units, rounded to cents, and the list of
+        layers that were changed.
+    """
+    cost = Decimal(0)
+    changed = []
+    if stock_id is not None:
+        candidates = [layer for layer in layers if layer['stock_id'] == stock_id and layer['remaining'] > 0]
+        candidates += [layer for layer in layers if layer['stock_id'] != stock_id]
+    else:
+        candidates = layers
+    for layer in candidates:
+        if quantity <= 0:
+            break
+        taken = min(layer['remaining'], quantity)
+        if taken <= 0:
+            continue
+        layer['remaining'] -= taken
+        quantity -= taken
+        cost += taken * layer['unit_cost']
+        changed.append(layer)
+    if quantity > 0 and layers:
+        cost += quantity * layers[-1]['unit_cost']
+    return cost.quantize(CENT, ROUND_HALF_UP), changed
+
+
+def replay_costs(receipts, issues):
+    """
+    Replays the stock history of holdings in date order to rebuild their cost layers,
+    moving average costs and the cost of every issue.
+
+    Receipts are applied before the issues of the same day. This is only needed to
+    build the layers of existing data or to repair them; day-to-day movements open and
+    consume layers incrementally.
+
+    :param receipts: (stock_id, item_id, department_id, date, quantity, unit_cost,
+        engraved_number) tuples of stock history records.
+    :param issues: (issue_id, item_id, department_id, date, quantity, engraved_number)
+        tuples of issued-out records.
+    :return: A tuple of a dictionary of remaining units per stock history ID, a
+        dictionary of (fifo_cost, average_cost) tuples per issue ID and a dictionary of
+        moving average unit costs per (item_id, department_id) holding.
+    """
+    events = defaultdict(list)
+    engraved_units = {}
+    for stock_id, item_id, department_id, day, quantity, cost, engraved_number in receipts:
+        events[(item_id, department_id)].append((day, 0, stock_id, quantity, Decimal(cost)))
+        if engraved_number:
+            engraved_units[(item_id, engraved_number)] = stock_id
+    for issue_id, item_id, department_id, day, quantity, engraved_number in issues:
+        stock_id = engraved_units.get((item_id, engraved_number)) if engraved_number else None
+        events[(item_id, department_id)].append((day, 1, issue_id, quantity, stock_id))
+
+    remaining = {}
+    issue_costs = {}
+    averages = {}
+    for holding, holding_events in events.items():
+        layers = []
+        held = 0
+        average = Decimal(0)
+        for day, kind, record_id, quantity, detail in sorted(holding_events, key=lambda event: event[:3]):
+            if kind == 0:
+                average = moving_average(held, average, quantity, detail)
+                held += quantity
+                layers.append({'stock_id': record_id, 'remaining': quantity, 'unit_cost': detail})
+            else:
+                fifo_cost, _ = consume_layers(layers, quantity, detail)
+                issue_costs[record_id] = (fifo_cost, (quantity * average).quantize(CENT, ROUND_HALF_UP))
+                held = max(held - quantity, 0)
+        remaining.update((layer['stock_id'], layer['remaining']) for layer in layers)
+        averages[holding] = average
+    return remaining, issue_costs, averages
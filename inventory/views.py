@@ -1,15 +1,29 @@
+import json
+
 from django.contrib.auth.decorators import login_required
 from django.db.models import Sum, F, Max, Count
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse, Http404, FileResponse, HttpResponse, \
+    HttpResponseForbidden
 from django.shortcuts import render, get_object_or_404
+from django.urls import reverse
 from django.template.loader import render_to_string
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_date
 from django.views.generic import ListView
 from django import forms
-from inventory.forms import InventoryItemForm, ItemCategoryForm, StaffDepartmentForm, StockHistoryForm, EmployeeForm
+from inventory.forms import InventoryItemForm, ItemCategoryForm, StaffDepartmentForm, StockHistoryForm, EmployeeForm, \
+    DeliveredItemsFilterForm, DateRangeForm, ReportJobForm, StockAsOfForm
 from inventory.models import InventoryItem, Quantity, Employee, StockHistory, StaffDepartment, IssuedOutHistory, \
-    ItemCategory
-from inventory.context import get_dashboard_context, get_inventory_context, get_item_details_context, get_combined_report_context, get_department_report_context, get_inflow_report_context, get_outflow_report_context, get_department_dashboard_context, get_department_item_details_context, get_cost_report_context, get_outflow_dashboard_context, get_all_delivered_view_context
+    ItemCategory, ReportJob
+from inventory.context import get_dashboard_context, get_inventory_context, get_item_details_context, get_combined_report_context, get_department_report_context, get_inflow_report_context, get_outflow_report_context, get_department_dashboard_context, get_department_item_details_context, get_cost_report_context, get_outflow_dashboard_context, get_all_delivered_view_context, get_delivered_items_queryset, get_all_delivered_page_context, get_stock_as_of_context
+from inventory.services import StockMovementError, receive_stock, receive_engraved_stock, issue_stock, \
+    issue_voucher, clean_unit_cost
+from inventory.pagination import KeysetPaginator, InvalidCursor
+from inventory.jobs import get_artifacts_dir
+from inventory.metrics import registry
+from inventory.exports import DELIVERED_EXPORT_COLUMNS, XLSX_CONTENT_TYPE, iter_export_rows, stream_csv, stream_xlsx
 
 
 def is_ajax(request):
@@ -28,6 +42,28 @@ def is_ajax(request):
     # Check if the request is an AJAX request by looking for the 'X-Requested-With' header
     return request.headers.get('X-Requested-With') == 'XMLHttpRequest'
 
+def get_report_scope(request):
+    """
+    Reads the period and department a report is restricted to from the GET parameters.
+
+    The parameters are validated with `DateRangeForm`; invalid values are ignored, so
+    a report with a malformed filter falls back to its unrestricted form and shows the
+    form errors.
+
+    :param request: The HTTP request object carrying the `start_date`, `end_date` and
+        `department` GET parameters.
+    :return: A tuple of the bound form and a dictionary with the `start`, `end` and
+        `department` arguments of the report context builders.
+    """
+    form = DateRangeForm(request.GET or None)
+    cleaned_data = form.cleaned_data if form.is_valid() else {}
+    scope = {
+        'start': cleaned_data.get('start_date'),
+        'end': cleaned_data.get('end_date'),
+        'department': cleaned_data.get('department'),
+    }
+    return form, scope
+
 @login_required
 def dashboard(request):
     """
@@ -167,34 +203,16 @@ def item_details(request, item_id):
             new_stock.item = get_object_or_404(InventoryItem, id=item_id)
 
             # Set optional fields if provided
-            if 'expiry_date' in stock_form.cleaned_data:
-                new_stock.expiry_date = stock_form.cleaned_data['expiry_date']
-            if 'depreciation_date' in stock_form.cleaned_data:
-                new_stock.depreciation_date = stock_form.cleaned_data['depreciation_date']
-            new_stock.save()
+            expiry_date = stock_form.cleaned_data.get('expiry_date')
+            depreciation_date = stock_form.cleaned_data.get('depreciation_date')
+            new_stock.expiry_date = expiry_date
+            new_stock.depreciation_date = depreciation_date
 
-            department = stock_form.cleaned_data['department']
+            # Record the intake and update the department's quantity in one transaction
             try:
-                # Update existing quantity for the item in the department
-                existing_quantity = Quantity.objects.get(item=new_stock.item, department=department)
-                existing_quantity.quantity += stock_form.cleaned_data['quantity']
-                if 'expiry_date' in stock_form.cleaned_data:
-                    existing_quantity.expiry_date = stock_form.cleaned_data['expiry_date']
-                if 'depreciation_date' in stock_form.cleaned_data:
-                    existing_quantity.depreciation_date = stock_form.cleaned_data['depreciation_date']
-                existing_quantity.save()
-            except Quantity.DoesNotExist:
-                # Create a new quantity record if it does not exist
-                new_quantity = Quantity(
-                    item=new_stock.item,
-                    department=department,
-                    quantity=stock_form.cleaned_data['quantity'],
-                )
-                if 'expiry_date' in stock_form.cleaned_data:
-                    new_quantity.expiry_date = stock_form.cleaned_data['expiry_date']
-                if 'depreciation_date' in stock_form.cleaned_data:
-                    new_quantity.depreciation_date = stock_form.cleaned_data['depreciation_date']
-                new_quantity.save()
+                receive_stock(new_stock, expiry_date=expiry_date, depreciation_date=depreciation_date)
+            except StockMovementError as error:
+                return JsonResponse({'success': False, 'error': str(error)})
             return JsonResponse({'success': True})
         else:
             return JsonResponse({'success': False, 'form_html': stock_form.as_p()})
@@ -254,42 +272,68 @@ def issue_out(request):
         issue_voucher_number = request.POST.get('issue_voucher_number')
         issued_to_id = request.POST.get('issued_to')
 
-        # Fetch the quantity entry for the item and department
-        quantity_entry = get_object_or_404(Quantity, id=quantity_id)
         # Fetch the employee to whom the item is issued
         issued_to = get_object_or_404(Employee, id=issued_to_id, department__id=department_id)
-        # Fetch the office of the employee
-        office = Employee.objects.get(id=issued_to_id).office
         # Fetch the department
         department = get_object_or_404(StaffDepartment, id=department_id)
         # Fetch the inventory item
         item = get_object_or_404(InventoryItem, id=item_id)
 
-        # Check if the issued quantity exceeds the available quantity
-        if issued_quantity > quantity_entry.quantity:
-            return JsonResponse({'success': False, 'error': 'Issued quantity cannot exceed available quantity.'})
-
-        # Reduce the available quantity
-        quantity_entry.quantity -= issued_quantity
-        quantity_entry.save()
-
-        # Create an IssuedOutHistory record
-        IssuedOutHistory.objects.create(
-            item=item,
-            description=item.description,
-            quantity_issued_out=issued_quantity,
-            issue_voucher_number=issue_voucher_number,
-            issued_to=issued_to,
-            department=department,
-            office=office,
-            issued_by=request.user
-        )
+        # Reduce the available quantity and record the issuance in one transaction
+        try:
+            issue_stock(quantity_id, item, department, issued_to, issued_quantity, issue_voucher_number, request.user)
+        except StockMovementError as error:
+            return JsonResponse({'success': False, 'error': str(error)})
 
         return JsonResponse({'success': True})
 
     return JsonResponse({'success': False, 'error': 'Invalid request method.'})
 
 
+@login_required
+def issue_out_voucher(request):
+    """
+    Issues a whole issue voucher in a single request.
+
+    Expects a JSON body with the `issue_voucher_number`, the `department_id`, an optional
+    default `issued_to` employee ID and a list of `lines`. Each line holds an `item_id`
+    and either a `quantity` or a list of `engraved_numbers`, and may name its own
+    `issued_to` employee. Every line is validated before anything is written, so either
+    the whole voucher is issued or nothing is.
+
+    :param request: The HTTP request object containing the voucher as JSON.
+    :returns: A JsonResponse indicating the success or failure of the operation, with the
+        number of issuance records created on success. In case of failure, an error
+        message listing the offending lines is included.
+    """
+    if request.method == 'POST':
+        try:
+            voucher = json.loads(request.body)
+            department_id = int(voucher['department_id'])
+            issued_to_id = int(voucher['issued_to']) if voucher.get('issued_to') not in (None, '') else None
+        except (ValueError, TypeError, KeyError):
+            return JsonResponse({'success': False, 'error': 'Invalid voucher.'})
+        if not isinstance(voucher.get('lines'), list):
+            return JsonResponse({'success': False, 'error': 'Invalid voucher.'})
+
+        # Fetch the department and the voucher's default employee
+        department = get_object_or_404(StaffDepartment, id=department_id)
+        issued_to = None
+        if issued_to_id is not None:
+            issued_to = get_object_or_404(Employee, id=issued_to_id, department=department)
+
+        # Validate every line, then issue the whole voucher in one transaction
+        try:
+            records = issue_voucher(voucher.get('issue_voucher_number'), department, voucher['lines'], request.user,
+                                    issued_to=issued_to)
+        except StockMovementError as error:
+            return JsonResponse({'success': False, 'error': str(error)})
+
+        return JsonResponse({'success': True, 'issued': len(records)})
+
+    return JsonResponse({'success': False, 'error': 'Invalid request method.'})
+
+
 def combined_report(request):
     """
     Generate and render a combined report view.
@@ -300,13 +344,18 @@ def combined_report(request):
     combined report provides users with an overview of aggregated
     data from multiple sources or modules.
 
+    The report is restricted by the `start_date`, `end_date` and `department` GET
+    parameters, see `get_report_scope`.
+
     :param request: The HTTP request object providing metadata about
                     the request such as headers, user details, and
                     request method.
     :return: An HTTP response object rendering the 'combined_report.html'
              template populated with the generated context.
     """
-    context = get_combined_report_context()
+    date_range_form, scope = get_report_scope(request)
+    context = get_combined_report_context(**scope)
+    context['date_range_form'] = date_range_form
     return render(request, 'reports/combined_report.html', context)
 
 
@@ -319,6 +368,9 @@ def department_report(request, department_id, decimal_default=None):
     optional decimal default value to structure the department's report context.
     The function then renders a report page with the generated context.
 
+    The reported period is restricted by the `start_date` and `end_date` GET
+    parameters, see `get_report_scope`.
+
     :param request: The HTTP request object that triggered this
         function, typically containing metadata about the request.
     :param department_id: A unique identifier representing the department
@@ -329,7 +381,9 @@ def department_report(request, department_id, decimal_default=None):
     :return: An HTTP response object containing the rendered department
         report page.
     """
-    context = get_department_report_context(department_id, decimal_default)
+    date_range_form, scope = get_report_scope(request)
+    context = get_department_report_context(department_id, decimal_default, start=scope['start'], end=scope['end'])
+    context['date_range_form'] = date_range_form
     return render(request, 'reports/department_report.html', context)
 
 
@@ -342,10 +396,15 @@ def inflow_report(request):
     context is created, the function renders the 'inflow_report.html' template
     along with the generated context and returns the response.
 
+    The report is restricted by the `start_date`, `end_date` and `department` GET
+    parameters, see `get_report_scope`.
+
     :param request: The HTTP request object containing the request data.
     :return: An HTTP response rendering the inflow report page.
     """
-    context = get_inflow_report_context()
+    date_range_form, scope = get_report_scope(request)
+    context = get_inflow_report_context(**scope)
+    context['date_range_form'] = date_range_form
     return render(request, 'reports/inflow_report.html', context)
 
 
@@ -357,12 +416,17 @@ def outflow_report(request):
     renders the "inventory/outflow_dashboard.html" template using the retrieved
     context.
 
+    The report is restricted by the `start_date`, `end_date` and `department` GET
+    parameters, see `get_report_scope`.
+
     :param request: The HTTP request object containing metadata and user information
         associated with the request.
     :return: An HTTP response object that contains the rendered "inventory/outflow_dashboard.html"
         template.
     """
-    context = get_outflow_report_context()
+    date_range_form, scope = get_report_scope(request)
+    context = get_outflow_report_context(**scope)
+    context['date_range_form'] = date_range_form
     return render(request, 'inventory/outflow_dashboard.html', context)
 
 
@@ -404,11 +468,16 @@ def cost_report(request):
     the specified HTML template. This function utilizes a helper method to gather context
     data required for rendering the cost report.
 
+    The report is restricted by the `start_date`, `end_date` and `department` GET
+    parameters, see `get_report_scope`.
+
     :param request: Django HttpRequest object representing the incoming HTTP request.
 
     :return: HttpResponse object containing the rendered cost report page.
     """
-    context = get_cost_report_context()
+    date_range_form, scope = get_report_scope(request)
+    context = get_cost_report_context(**scope)
+    context['date_range_form'] = date_range_form
     return render(request, 'reports/cost_report.html', context)
 
 def outflow_dashboard(request):
@@ -498,16 +567,82 @@ def all_delivered_view(request):
     Retrieves the context for all delivered items and renders the respective HTML page.
 
     This function is used to manage the view for displaying all delivered items
-    within an inventory system. It fetches the context data needed for the
-    template and renders `all_delivered.html`.
+    within an inventory system. It fetches the filter options and the register totals
+    needed for the template and renders `all_delivered.html`; the rows themselves are
+    loaded page by page from `all_delivered_data`.
 
     :param request: The HTTP request object containing metadata about the request.
 
     :return: The HTTP response object containing the rendered HTML page.
     """
-    context = get_all_delivered_view_context()
+    # Narrow the initial totals by the same GET filters as the register rows
+    form = DeliveredItemsFilterForm(request.GET)
+    context = get_all_delivered_view_context(form.cleaned_data if form.is_valid() else None)
     return render(request, 'inventory/all_delivered.html', context)
 
+
+def all_delivered_data(request):
+    """
+    Returns one page of the delivered items register as JSON.
+
+    The register is filtered, sorted and paginated on the server according to the
+    `DeliveredItemsFilterForm` GET parameters, and the returned totals are aggregated
+    over every row matching the filters.
+
+    :param request: The HTTP request object carrying the filter, sort and paging
+        options as GET parameters.
+    :return: A JsonResponse with the rows of the requested page, the filtered totals and
+        the paging metadata, or the form errors with status 400 if the options are invalid.
+    """
+    form = DeliveredItemsFilterForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'success': False, 'errors': form.errors}, status=400)
+
+    data = get_all_delivered_page_context(
+        filters=form.cleaned_data,
+        page=form.cleaned_data['page'] or 1,
+        page_size=form.cleaned_data['page_size'] or 25,
+        sort=form.cleaned_data['sort'],
+    )
+    data['success'] = True
+    return JsonResponse(data)
+
+@login_required
+def all_delivered_export(request):
+    """
+    Streams the register of delivered items as a CSV or XLSX download, narrowed by the
+    same filters as the all-delivered page.
+
+    The delivered items are read from the database in chunks while the response is being
+    sent, so the register is never held in memory as a whole. CSV lines are sent as they
+    are encoded; an XLSX workbook is spooled to a temporary file and sent once complete.
+    The export keeps the issued and remaining quantity annotations of the all-delivered view.
+
+    :param request: The HTTP request object. The `format` GET parameter selects
+        either 'csv' (the default) or 'xlsx'; the other GET parameters are the
+        `DeliveredItemsFilterForm` filters.
+    :return: A StreamingHttpResponse with the register as an attachment.
+    :raises Http404: If an unsupported export format is requested.
+    """
+    export_format = request.GET.get('format', 'csv')
+    form = DeliveredItemsFilterForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'success': False, 'errors': form.errors}, status=400)
+
+    rows = iter_export_rows(get_delivered_items_queryset(form.cleaned_data), DELIVERED_EXPORT_COLUMNS)
+    filename = f"delivered_items_{timezone.now():%Y%m%d}"
+
+    if export_format == 'csv':
+        response = StreamingHttpResponse(stream_csv(rows, DELIVERED_EXPORT_COLUMNS), content_type='text/csv')
+    elif export_format == 'xlsx':
+        response = StreamingHttpResponse(stream_xlsx(rows, DELIVERED_EXPORT_COLUMNS, sheet_name='Delivered Items'),
+                                         content_type=XLSX_CONTENT_TYPE)
+    else:
+        raise Http404('Unsupported export format.')
+
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
+
 def delivery_numbers_list(request):
     """
     Retrieves a list of distinct delivery numbers and their associated 'date_added'
@@ -689,34 +824,28 @@ def add_engraved_stock(request, item_id):
 
         department = get_object_or_404(StaffDepartment, id=department_id)
 
-        for engraved_number in engraved_numbers:
-            new_stock = StockHistory(
-                item=item,
-                department_id=department_id,
-                quantity=1,  # Each item has a quantity of 1
-                unit_cost=unit_cost,
-                total_cost=unit_cost,
-                lpo=lpo,
-                supplied_by=supplied_by,
-                delivery_number=delivery_number,
-                engraved_number=engraved_number,
-                date_added=date_added,
-                added_by=request.user
-            )
-            new_stock.save()
-
-            # Update the Quantity table
+        # Parse the delivery details shared by every engraved unit
+        try:
+            unit_cost = clean_unit_cost(unit_cost)
+        except StockMovementError as error:
+            return JsonResponse({'success': False, 'error': str(error)})
+        if date_added:
+            # parse_date returns None for malformed dates and raises for impossible ones
             try:
-                existing_quantity = Quantity.objects.get(item=item, department=department)
-                existing_quantity.quantity += 1
-                existing_quantity.save()
-            except Quantity.DoesNotExist:
-                new_quantity = Quantity(
-                    item=item,
-                    department=department,
-                    quantity=1,
-                )
-                new_quantity.save()
+                date_added = parse_date(date_added)
+            except ValueError:
+                date_added = None
+            if date_added is None:
+                return JsonResponse({'success': False, 'error': 'Invalid date.'})
+        else:
+            date_added = None
+
+        # Validate every engraved number, then record the whole delivery in one transaction
+        try:
+            receive_engraved_stock(item, department, engraved_numbers, unit_cost, request.user, lpo, supplied_by,
+                                   delivery_number, date_added=date_added)
+        except StockMovementError as error:
+            return JsonResponse({'success': False, 'error': str(error)})
 
         return JsonResponse({'success': True})
 
@@ -761,43 +890,19 @@ def engraved_issue_out(request):
         issue_voucher_number = request.POST.get('issue_voucher_number')
         issued_to_id = request.POST.get('issued_to')
 
-        # Fetch the quantity entry for the item and department
-        quantity_entry = get_object_or_404(Quantity, id=quantity_id)
         # Fetch the employee to whom the item is issued
         issued_to = get_object_or_404(Employee, id=issued_to_id, department__id=department_id)
-        # Fetch the office of the employee
-        office = Employee.objects.get(id=issued_to_id).office
         # Fetch the department
         department = get_object_or_404(StaffDepartment, id=department_id)
         # Fetch the inventory item
         item = get_object_or_404(InventoryItem, id=item_id)
 
-        # Check if the issued quantity exceeds the available quantity
-        if issued_quantity > quantity_entry.quantity:
-            return JsonResponse({'success': False, 'error': 'Issued quantity cannot exceed available quantity.'})
-
-        # Reduce the available quantity
-        quantity_entry.quantity -= issued_quantity
-        quantity_entry.save()
-
-        # Get the StockHistory instance or return a 404 error if not found
-        item_stock_history = get_object_or_404(StockHistory, engraved_number=engraved_number)
-        # Mark the item as issued
-        item_stock_history.issued = True
-        item_stock_history.save()
-
-        # Create an IssuedOutHistory record
-        IssuedOutHistory.objects.create(
-            item=item,
-            description=item.description,
-            engraved_number=engraved_number,
-            quantity_issued_out=issued_quantity,
-            issue_voucher_number=issue_voucher_number,
-            issued_to=issued_to,
-            department=department,
-            office=office,
-            issued_by=request.user  # The current logged-in user
-        )
+        # Reduce the available quantity, mark the engraved unit as issued and record the issuance in one transaction
+        try:
+            issue_stock(quantity_id, item, department, issued_to, issued_quantity, issue_voucher_number, request.user,
+                        engraved_number=engraved_number)
+        except StockMovementError as error:
+            return JsonResponse({'success': False, 'error': str(error)})
 
         return JsonResponse({'success': True})
 
@@ -866,7 +971,56 @@ class IssuedOutFilterForm(forms.Form):
 
 
 
-class AllIssuedOutView(ListView):
+class KeysetPaginationMixin:
+    """
+    Adds an opt-in keyset (cursor) pagination mode to a paginated ListView.
+
+    By default the view keeps Django's page-number pagination. When the request carries
+    `paging=keyset` or a `cursor` GET parameter, the filtered queryset is instead paginated
+    by seeking past the `keyset_fields` values of the last row shown, so deep pages cost
+    the same as the first one and no COUNT(*) is run. Adding `count=approx` also counts the
+    matching rows up to `keyset_count_limit`.
+
+    :ivar keyset_fields: The fields the list is ordered by in descending order, ending
+        with a unique tie-breaker.
+    :type keyset_fields: tuple
+    :ivar keyset_count_limit: The number of rows after which the approximate count stops.
+    :type keyset_count_limit: int
+    """
+    keyset_fields = ('date', 'id')
+    keyset_count_limit = 10000
+
+    def uses_keyset_pagination(self):
+        return self.request.GET.get('paging') == 'keyset' or 'cursor' in self.request.GET
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.uses_keyset_pagination():
+            return super().paginate_queryset(queryset, page_size)
+
+        paginator = KeysetPaginator(queryset, page_size, keyset_fields=self.keyset_fields,
+                                    count_limit=self.keyset_count_limit)
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor:
+            raise Http404('Invalid cursor.')
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if self.uses_keyset_pagination():
+            # Keep the filters and the keyset mode in the cursor links
+            query = self.request.GET.copy()
+            query.pop('cursor', None)
+            query.pop('page', None)
+            query['paging'] = 'keyset'
+            context['keyset'] = True
+            context['keyset_query'] = query.urlencode()
+            if self.request.GET.get('count') == 'approx':
+                context['approximate_count'], context['count_is_exact'] = context['paginator'].approximate_count()
+        return context
+
+
+class AllIssuedOutView(KeysetPaginationMixin, ListView):
     """
     View for displaying a paginated list of issued-out items with filtering capabilities.
 
@@ -923,7 +1077,7 @@ class AllIssuedOutView(ListView):
             if end_date:
                 queryset = queryset.filter(date__lte=end_date)
 
-        return queryset.order_by('-date')
+        return queryset.select_related('item', 'issued_to', 'department', 'issued_by').order_by('-date', '-id')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -987,7 +1141,7 @@ class AssetFilterForm(forms.Form):
 
 
 
-class AssetView(ListView):
+class AssetView(KeysetPaginationMixin, ListView):
     """
     Handles the presentation of issued out items via a paginated view. It filters the
     issued out items based on user-submitted parameters in the GET request.
@@ -1035,7 +1189,8 @@ class AssetView(ListView):
             if end_date:
                 queryset = queryset.filter(date__lte=end_date)
 
-        return queryset.order_by('-date')
+        # The asset register renders cost, condition and purchase date from the item's cost snapshot
+        return queryset.select_related('item__cost_snapshot', 'department', 'issued_to').order_by('-date', '-id')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -1158,3 +1313,108 @@ def employee_delete(request, pk):
         data['html_form'] = render_to_string('inventory/partial_employee_delete.html', context, request=request)
     return JsonResponse(data)
 
+
+
+def report_job_payload(job):
+    """
+    Serializes a report job for the JSON polling endpoints.
+
+    :param job: The ReportJob record.
+    :return: A dictionary with the job's state and, once it is done, its download URL.
+    """
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'format': job.format,
+        'status': job.status,
+        'progress': job.progress,
+        'error': job.error,
+        'status_url': reverse('report_job_status', args=[job.id]),
+        'download_url': reverse('report_job_download', args=[job.id]) if job.status == ReportJob.DONE else None,
+    }
+
+@login_required
+def report_job_create(request):
+    """
+    Queues a report to be generated in the background by the report worker.
+
+    :param request: The HTTP request object. Must be a POST request carrying the
+        `ReportJobForm` fields.
+    :return: A JsonResponse with the queued job, or the form errors if the request is invalid.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid request method.'})
+
+    form = ReportJobForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'success': False, 'errors': form.errors})
+
+    job = form.save(commit=False)
+    job.created_by = request.user
+    job.save()
+    return JsonResponse({'success': True, 'job': report_job_payload(job)})
+
+@login_required
+def report_job_status(request, job_id):
+    """
+    Returns the status and progress of a report job, for polling from the report pages.
+
+    :param request: The HTTP request object.
+    :param job_id: The ID of a report job queued by the current user.
+    :return: A JsonResponse with the job's state.
+    """
+    job = get_object_or_404(ReportJob, pk=job_id, created_by=request.user)
+    return JsonResponse({'success': True, 'job': report_job_payload(job)})
+
+@login_required
+def report_job_download(request, job_id):
+    """
+    Downloads the artifact of a completed report job.
+
+    :param request: The HTTP request object.
+    :param job_id: The ID of a report job queued by the current user.
+    :return: A FileResponse with the generated report as an attachment.
+    :raises Http404: If the job is not done or its artifact no longer exists.
+    """
+    job = get_object_or_404(ReportJob, pk=job_id, created_by=request.user, status=ReportJob.DONE)
+    path = get_artifacts_dir() / job.artifact
+    if not job.artifact or not path.is_file():
+        raise Http404('Report file not found.')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=job.artifact)
+
+@login_required
+def stock_as_of(request):
+    """
+    Returns the quantities held at the end of a past day, for audits of past stock
+    levels, as computed by `get_stock_as_of_context`.
+
+    :param request: The HTTP request object carrying the optional `date` and
+        `department` GET parameters of `StockAsOfForm`.
+    :return: A JsonResponse with the balances, or the form errors if the parameters
+        are invalid.
+    """
+    form = StockAsOfForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'success': False, 'errors': form.errors})
+
+    context = get_stock_as_of_context(form.cleaned_data['date'], form.cleaned_data['department'])
+    return JsonResponse({'success': True, **context})
+
+
+def metrics(request):
+    """
+    Exposes the per-view request, latency and query metrics recorded by
+    `RequestMetricsMiddleware` for scraping by Prometheus.
+
+    The metrics name every view and its traffic, so they are only served to requests
+    carrying the `INVENTORY_METRICS_TOKEN` bearer token and to logged-in staff users.
+
+    :param request: The HTTP request object.
+    :return: An HttpResponse with the metrics in the Prometheus text format, or a 403
+        response for any other request.
+    """
+    token = settings.INVENTORY_METRICS_TOKEN
+    authorized = bool(token) and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not authorized and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')